@@ -1,38 +1,75 @@
 from urcl import *
+from urclcache import *
 import sys
 
-args = sys.argv[1:len(sys.argv)]
+#Worker processes import this module again, so the build only runs in the main process.
+if __name__ == "__main__":
+	args = sys.argv[1:len(sys.argv)]
 
-inputs = []
-output = "output.py"
-nextArgIsOutput = False
-for arg in args:
-	if arg.startswith("-"):
-		nextArgIsOutput = False
-		if arg == "-o":
-			nextArgIsOutput = True
+	inputs = []
+	output = "output.py"
+	cacheDirectory = DEFAULT_CACHE_DIRECTORY
+	cacheSize = DEFAULT_CACHE_SIZE
+	useCache = True
+	printStats = False
+	profile = False
+	workers = 1
+	nextArg = None
+	for arg in args:
+		if arg.startswith("-"):
+			nextArg = None
+			if arg == "-o" or arg == "-j" or arg == "--cache" or arg == "--cache-size":
+				nextArg = arg
+			elif arg == "--no-cache":
+				useCache = False
+			elif arg == "--stats":
+				printStats = True
+			elif arg == "--profile":
+				profile = True
+			else:
+				print("Unknown command line option: " + arg)
+				exit(1)
+		elif nextArg == "-o":
+			output = arg
+			nextArg = None
+		elif nextArg == "-j":
+			workers = int(arg)
+			nextArg = None
+		elif nextArg == "--cache":
+			cacheDirectory = arg
+			nextArg = None
+		elif nextArg == "--cache-size":
+			cacheSize = int(arg)
+			nextArg = None
 		else:
-			print("Unknown command line option: " + arg)
-			exit(1)
-	elif nextArgIsOutput:
-		output = arg
-		nextArgIsOutput = False
-	else:
-		inputs += [arg]
+			inputs += [arg]
+
+	from urclpy import PythonEmit
+	emitter = Emitter(emitTarget=PythonEmit(useDebugger=True, profile=profile))
 
-from urclpy import PythonEmit
-emitter = Emitter(emitTarget=PythonEmit(useDebugger=True))
+	cache = None
+	if useCache:
+		cache = BuildCache(cacheDirectory, cacheSize)
 
-for file in inputs:
-	with open(file) as stream:
-		lines = stream.readlines()
-		for line in lines:
-			inst = ParseInstruction(line)
-			if inst != None:
-				if emitter.IsLabel(inst):
-					emitter.MarkLabel(inst)
-				else:
-					emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+	try:
+		definitions = {}
+		for path, parsed in zip(inputs, ParseFiles(inputs, cache, workers)):
+			EmitParsed(emitter, parsed, path, definitions)
+	except ValueError as error:
+		print("ERROR: " + str(error))
+		exit(1)
+
+	if output.lower().endswith(".urclb"):
+		from urclbin import WriteBinary
+		with open(output, "wb") as file:
+			WriteBinary(emitter, file)
+	else:
+		with open(output, "w") as file:
+			emitter.CompileTo(file)
 
-with open(output, "w") as file:
-    file.write(str(emitter))
\ No newline at end of file
+	if cache != None:
+		cache.Trim()
+		if printStats:
+			print("cache: " + str(cache) + " size=" + str(cache.GetSize()))
+	elif printStats:
+		print("cache: disabled")
@@ -0,0 +1,1074 @@
+from urcl import *
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def PeakRSS():
+	import resource
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		peak //= 1024
+	return peak
+
+def Report(name, values):
+	result = name.ljust(28)
+	for key in values:
+		result += " " + key + "=" + str(values[key])
+	print(result)
+
+def RunChild(args):
+	output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"] + args, capture_output=True, text=True, check=True).stdout
+	return output.strip().split(" ")
+
+def WriteSyntheticURCL(path, lineCount):
+	with open(path, "w") as stream:
+		for i in range(lineCount):
+			if i % 16 == 0:
+				stream.write(".label_" + str(i) + "\n")
+			elif i % 16 == 1:
+				stream.write("// Comment line " + str(i) + "\n")
+			elif i % 16 == 2:
+				stream.write("BRL .label_" + str(i - 2) + ", R1, R2 // Loop back.\n")
+			else:
+				stream.write("ADD R" + str(i % 8 + 1) + " R" + str(i % 5 + 1) + " " + str(i) + "\n")
+
+def LegacyParseInstruction(text):
+	text = str(text).strip()
+	if len(text) <= 0:
+		return None
+	if text.startswith("//"):
+		return None
+	if text.startswith(".") and not (' ' in text):
+		return text
+	text = text.replace(",", " ").replace("//", " //").replace("  ", " ").split(" ")
+	comment = False
+	for i in range(4):
+		if i >= len(text):
+			text.append(None)
+		elif text[i].startswith("//") or comment:
+			text[i] = None
+			comment = True
+	return Instruction(text[0].upper(), text[1], text[2], text[3])
+
+class LegacyInstruction:
+	def __init__(self, operation="NOP", operandA=None, operandB=None, operandC=None):
+		self.Operation = operation
+		self.OperandA = operandA
+		self.OperandB = operandB
+		self.OperandC = operandC
+
+def ChildEmit(mode, count):
+	count = int(count)
+	baseline = PeakRSS()
+	start = time.perf_counter()
+	if mode == "legacy":
+		instructions = []
+		for i in range(count):
+			instructions.append(LegacyInstruction(ADD, "R" + str(i % 8 + 1), "R" + str(i % 5 + 1), str(i % 100)))
+	else:
+		emitter = Emitter()
+		for i in range(count):
+			emitter.Emit(ADD, "R" + str(i % 8 + 1), "R" + str(i % 5 + 1), str(i % 100))
+	elapsed = time.perf_counter() - start
+	print(str(count) + " " + str(elapsed) + " " + str(PeakRSS() - baseline))
+
+def BenchmarkEmit(args):
+	count = 1000000
+	if len(args) > 0:
+		count = int(args[0])
+	for mode in ["legacy", "slots"]:
+		emitted, elapsed, memory = RunChild(["emit", mode, str(count)])
+		Report("emit/" + mode, {
+			"instructions": emitted,
+			"instructions/sec": int(count / float(elapsed)),
+			"memory_kb": memory,
+			"bytes/instruction": int(int(memory) * 1024 / count)
+		})
+
+def BuildLoopProgram(emitter, count):
+	counter = emitter.NewRegister()
+	total = emitter.NewRegister()
+	loop = emitter.NewLabel()
+	emitter.Emit(IMM, counter, count)
+	emitter.MarkLabel(loop)
+	emitter.Emit(ADD, total, total, counter)
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, loop, counter)
+	emitter.Emit(HLT)
+
+def BuildMemoryProgram(emitter, count):
+	index = emitter.NewRegister()
+	value = emitter.NewRegister()
+	total = emitter.NewRegister()
+	fill = emitter.NewLabel()
+	sum = emitter.NewLabel()
+	emitter.Emit(IMM, index, 0)
+	emitter.MarkLabel(fill)
+	emitter.Emit(STR, index, index)
+	emitter.Emit(INC, index, index)
+	emitter.Emit(BRL, fill, index, count)
+	emitter.Emit(IMM, index, 0)
+	emitter.MarkLabel(sum)
+	emitter.Emit(LOD, value, index)
+	emitter.Emit(ADD, total, total, value)
+	emitter.Emit(INC, index, index)
+	emitter.Emit(BRL, sum, index, count)
+	emitter.Emit(HLT)
+
+def _PushCallArguments(emitter, registers):
+	for register in registers:
+		emitter.Emit(PSH, register)
+	return len(registers)
+
+def _EmitAddBody(emitter, registers, returnLabel):
+	emitter.EmitGetArgument(2, 0, registers[0])
+	emitter.EmitGetArgument(2, 1, registers[1])
+	emitter.Emit(ADD, registers[2], registers[0], registers[1])
+
+def BuildCallProgram(emitter, count):
+	counter = emitter.NewRegister()
+	total = emitter.NewRegister()
+	scratch = emitter.NewRegister()
+	function = emitter.NewLabel("add")
+	main = emitter.NewLabel("main")
+	loop = emitter.NewLabel()
+	emitter.Emit(JMP, main)
+	emitter.EmitFunction(function, 0, _EmitAddBody, [scratch, counter, total])
+	emitter.MarkLabel(main)
+	emitter.Emit(IMM, counter, count)
+	emitter.MarkLabel(loop)
+	emitter.CallFunction(function, _PushCallArguments, [total, counter])
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, loop, counter)
+	emitter.Emit(HLT)
+
+def BuildHeapProgram(emitter, count):
+	counter = emitter.NewRegister()
+	pointer = emitter.NewRegister()
+	loop = emitter.NewLabel()
+	emitter.Emit(IMM, counter, count)
+	emitter.MarkLabel(loop)
+	emitter.NewPointer(2, pointer)
+	emitter.EmitSetObjectField(pointer, 0, counter)
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, loop, counter)
+	emitter.Emit(HLT)
+
+PROGRAMS = {
+	"loop": BuildLoopProgram,
+	"memory": BuildMemoryProgram,
+	"call": BuildCallProgram
+}
+
+def BuildProgram(name, count, emitTarget=DEFAULT_TARGET, **options):
+	emitter = Emitter(emitTarget=emitTarget, **options)
+	PROGRAMS[name](emitter, count)
+	return emitter
+
+def CountInstructions(emitter):
+	from urclvm import Machine
+	return Machine(emitter).Execute(1 << 62)
+
+def TimeGeneratedModule(emitter):
+	namespace = {}
+	exec(str(emitter), namespace)
+	start = time.perf_counter()
+	namespace["Execute"]()
+	return time.perf_counter() - start
+
+def TimeMachine(emitter):
+	from urclvm import Machine
+	machine = emitter
+	if not isinstance(emitter, Machine):
+		machine = Machine(emitter)
+	start = time.perf_counter()
+	machine.Execute()
+	return time.perf_counter() - start
+
+def BenchmarkEngine(args):
+	from urclpy import PythonEmit
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	for name in PROGRAMS:
+		executed = CountInstructions(BuildProgram(name, count))
+		generated = TimeGeneratedModule(BuildProgram(name, count, PythonEmit(useDebugger=True)))
+		engine = TimeMachine(BuildProgram(name, count))
+		Report("engine/" + name, {
+			"instructions": executed,
+			"generated_ips": int(executed / generated),
+			"engine_ips": int(executed / engine),
+			"speedup": round(generated / engine, 2)
+		})
+
+def BenchmarkBlocks(args):
+	from urclpy import PythonEmit
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	for name in PROGRAMS:
+		executed = CountInstructions(BuildProgram(name, count))
+		single = TimeGeneratedModule(BuildProgram(name, count, PythonEmit(useDebugger=True)))
+		blocks = TimeGeneratedModule(BuildProgram(name, count, PythonEmit(useDebugger=True, useBasicBlocks=True)))
+		Report("blocks/" + name, {
+			"instructions": executed,
+			"instruction_ips": int(executed / single),
+			"block_ips": int(executed / blocks),
+			"speedup": round(single / blocks, 2)
+		})
+
+def BenchmarkMemoryModel(args):
+	from urclpy import PythonEmit, MEMORY_SPARSE, MEMORY_DENSE
+	count = 300
+	if len(args) > 0:
+		count = int(args[0])
+	programs = [("memory", BuildMemoryProgram, count * 100, count * 100), ("heap", BuildHeapProgram, count, count * 4 + 16)]
+	for name, builder, size, ramSize in programs:
+		options = {"memoryManagerMaxAddress": ramSize - 1, "inlineMemoryManagement": False}
+		models = [
+			("sparse", {"memoryModel": MEMORY_SPARSE}),
+			("dense", {"memoryModel": MEMORY_DENSE, "ramSize": ramSize}),
+			("dense32", {"memoryModel": MEMORY_DENSE, "ramSize": ramSize, "wordBits": 32})
+		]
+		emitter = Emitter(**options)
+		builder(emitter, size)
+		executed = CountInstructions(emitter)
+		for useBasicBlocks in [False, True]:
+			values = {"instructions": executed}
+			for model, modelOptions in models:
+				emitter = Emitter(emitTarget=PythonEmit(useDebugger=True, useBasicBlocks=useBasicBlocks, **modelOptions), **options)
+				builder(emitter, size)
+				values[model + "_ips"] = int(executed / TimeGeneratedModule(emitter))
+			mode = "instructions"
+			if useBasicBlocks:
+				mode = "blocks"
+			Report("memorymodel/" + name + "/" + mode, values)
+	#A push followed by a store to the top RAM address must not overwrite the stack in any model.
+	models = [
+		("sparse", {"memoryModel": MEMORY_SPARSE}),
+		("dense", {"memoryModel": MEMORY_DENSE}),
+		("dense32", {"memoryModel": MEMORY_DENSE, "wordBits": 32}),
+		("dense16", {"memoryModel": MEMORY_DENSE, "wordBits": 16}),
+		("dense8", {"memoryModel": MEMORY_DENSE, "ramSize": 256, "wordBits": 8})
+	]
+	for useBasicBlocks in [False, True]:
+		values = {}
+		for model, modelOptions in models:
+			emitter = Emitter(emitTarget=PythonEmit(useBasicBlocks=useBasicBlocks, **modelOptions))
+			emitter.Emit(IMM, "R1", 7)
+			emitter.Emit(PSH, "R1")
+			emitter.Emit(STR, modelOptions.get("ramSize", 65536) - 1, 99)
+			emitter.Emit(POP, "R2")
+			emitter.Emit(HLT)
+			namespace = {}
+			exec(str(emitter), namespace)
+			namespace["Execute"]()
+			values[model] = namespace["R2"]
+		machine, executed = RunToHalt(emitter)
+		values["vm"] = machine.GetRegister("R2")
+		values["same_result"] = len(set(values.values())) == 1
+		mode = "instructions"
+		if useBasicBlocks:
+			mode = "blocks"
+		Report("memorymodel/stack/" + mode, values)
+
+ALLOCATOR_TABLE = 1 << 24
+
+def BuildAllocatorPhase(emitter, count, step, sizeModulo, sizeBase, free):
+	index = emitter.NewRegister()
+	size = emitter.NewRegister()
+	pointer = emitter.NewRegister()
+	address = emitter.NewRegister()
+	loop = emitter.NewLabel()
+	emitter.Emit(IMM, index, 0)
+	emitter.MarkLabel(loop)
+	emitter.Emit(ADD, address, index, ALLOCATOR_TABLE)
+	if free:
+		emitter.Emit(LOD, pointer, address)
+		emitter.FreePointer(pointer)
+	else:
+		emitter.Emit(MOD, size, index, sizeModulo)
+		emitter.Emit(ADD, size, size, sizeBase)
+		emitter.NewPointer(size, pointer)
+		emitter.Emit(STR, address, pointer)
+	emitter.Emit(ADD, index, index, step)
+	emitter.Emit(BRL, loop, index, count)
+	emitter.Emit(BRK)
+	for register in [index, size, pointer, address]:
+		emitter.FreeRegister(register)
+
+def BuildAllocatorProgram(emitter, count):
+	#Allocate mixed sizes, free every other object, then refill the holes with different sizes.
+	BuildAllocatorPhase(emitter, count, 1, 7, 1, False)
+	BuildAllocatorPhase(emitter, count, 2, 1, 0, True)
+	BuildAllocatorPhase(emitter, count, 2, 5, 3, False)
+	emitter.Emit(HLT)
+	return [("allocate", count), ("free", (count + 1) // 2), ("reallocate", (count + 1) // 2)]
+
+def GetLiveWords(count):
+	words = 0
+	for i in range(count):
+		if i % 2 == 0:
+			words += i % 5 + 3
+		else:
+			words += i % 7 + 1
+	return words
+
+def BenchmarkAllocator(args):
+	from urclvm import Machine
+	count = 2000
+	if len(args) > 0:
+		count = int(args[0])
+	for name, mode in [("firstfit", MEMORY_MANAGER_FIRST_FIT), ("freelist", MEMORY_MANAGER_FREE_LIST)]:
+		emitter = Emitter(memoryManagerMaxAddress=ALLOCATOR_TABLE - 1, inlineMemoryManagement=False, memoryManager=mode)
+		phases = BuildAllocatorProgram(emitter, count)
+		machine = Machine(emitter)
+		values = {}
+		for phase, operations in phases:
+			values[phase + "_cycles/op"] = round(machine.Execute(1 << 62) / operations, 1)
+		heapEnd = 0
+		for address in machine.RAM:
+			if address < ALLOCATOR_TABLE and machine.RAM[address] != 0:
+				heapEnd = max(heapEnd, address + 1)
+		liveWords = GetLiveWords(count)
+		values["heap_words"] = heapEnd
+		values["live_words"] = liveWords
+		values["fragmentation"] = round(1 - liveWords / heapEnd, 3)
+		Report("allocator/" + name, values)
+
+def BuildArenaProgram(emitter, count, useArena):
+	counter = emitter.NewRegister()
+	pointer = emitter.NewRegister()
+	arena = emitter.NewRegister()
+	loop = emitter.NewLabel()
+	pair = Class("Pair", None, [Field(WORD, "First"), Field(WORD, "Second")])
+	if useArena:
+		emitter.NewArena(count * pair.GetSize(), arena)
+	emitter.Emit(BRK)
+	emitter.Emit(IMM, counter, count)
+	emitter.MarkLabel(loop)
+	if useArena:
+		emitter.ArenaNewObject(arena, pair, pointer)
+	else:
+		emitter.NewObject(pair, pointer)
+	emitter.EmitSetObjectField(pointer, 1, counter)
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, loop, counter)
+	emitter.Emit(HLT)
+
+def BenchmarkArena(args):
+	from urclvm import Machine
+	count = 2000
+	if len(args) > 0:
+		count = int(args[0])
+	modes = [("firstfit", MEMORY_MANAGER_FIRST_FIT, False), ("freelist", MEMORY_MANAGER_FREE_LIST, False), ("arena", MEMORY_MANAGER_FIRST_FIT, True)]
+	for name, mode, useArena in modes:
+		emitter = Emitter(inlineMemoryManagement=False, memoryManager=mode)
+		BuildArenaProgram(emitter, count, useArena)
+		machine = Machine(emitter)
+		machine.Execute(1 << 62)
+		Report("arena/" + name, {
+			"objects": count,
+			"cycles/object": round(machine.Execute(1 << 62) / count, 1)
+		})
+
+def CountAllInstructions(emitter):
+	from urclvm import Machine
+	machine = Machine(emitter)
+	executed = 0
+	while not machine.HALT:
+		executed += machine.Execute(1 << 62)
+	return executed
+
+def BuildFreeListProgram(builder, count, **options):
+	emitter = Emitter(memoryManagerMaxAddress=ALLOCATOR_TABLE - 1, inlineMemoryManagement=False, memoryManager=MEMORY_MANAGER_FREE_LIST, **options)
+	builder(emitter, count)
+	return emitter
+
+def BenchmarkRegisterAllocation(args):
+	from urclopt import RegisterAllocator
+	count = 200
+	if len(args) > 0:
+		count = int(args[0])
+	builders = [
+		("loop", lambda: BuildProgram("loop", count)),
+		("call", lambda: BuildProgram("call", count)),
+		("allocator", lambda: BuildFreeListProgram(BuildAllocatorProgram, count))
+	]
+	for name, builder in builders:
+		for registerCount in [4, 8, 16]:
+			emitter = builder()
+			size = len(emitter.Instructions)
+			executed = CountAllInstructions(emitter)
+			allocator = RegisterAllocator(registerCount, ALLOCATOR_TABLE * 2).Run(emitter)
+			Report("regalloc/" + name + "/" + str(registerCount), {
+				"virtual": allocator.VirtualRegisterCount,
+				"max_live": allocator.MaxLive,
+				"peak": allocator.PeakRegisterCount,
+				"spilled": len(allocator.Spills),
+				"size": str(size) + "->" + str(len(emitter.Instructions)),
+				"executed": str(executed) + "->" + str(CountAllInstructions(emitter)),
+				"hot": ",".join(allocator.GetHotRegisters(3))
+			})
+
+def BuildObjectProgram(emitter, count):
+	#Build a linked list of objects, then walk it calling a function per node.
+	node = emitter.NewRegister()
+	previous = emitter.NewRegister()
+	counter = emitter.NewRegister()
+	value = emitter.NewRegister()
+	function = emitter.NewLabel("visit")
+	main = emitter.NewLabel("main")
+	build = emitter.NewLabel()
+	walk = emitter.NewLabel()
+	done = emitter.NewLabel()
+	linkedListClass = Class("LinkedList", None, [Field(PENDING, "Next"), Field(WORD, "Value")])
+	linkedListClass.Fields[0].Type = linkedListClass
+	emitter.Emit(JMP, main)
+	emitter.EmitFunction(function, 0, _EmitAddBody, [value, counter, value])
+	emitter.MarkLabel(main)
+	emitter.Emit(IMM, counter, count)
+	emitter.Emit(MOV, previous, ZERO)
+	emitter.MarkLabel(build)
+	emitter.NewObject(linkedListClass, node)
+	emitter.EmitSetObjectField(node, 0, previous)
+	emitter.EmitSetObjectField(node, 1, counter)
+	emitter.Emit(MOV, previous, node)
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, build, counter)
+	emitter.Emit(IMM, counter, 0)
+	emitter.MarkLabel(walk)
+	emitter.Emit(BRZ, done, node)
+	emitter.EmitGetObjectField(node, 1, value)
+	emitter.CallFunction(function, _PushCallArguments, [counter, value])
+	emitter.Emit(MOV, counter, value)
+	emitter.EmitGetObjectField(node, 0, node)
+	emitter.Emit(JMP, walk)
+	emitter.MarkLabel(done)
+	emitter.Emit(STR, ALLOCATOR_TABLE, counter)
+	emitter.Emit(HLT)
+
+def BenchmarkPeephole(args):
+	from urclopt import PeepholeOptimizer
+	count = 200
+	if len(args) > 0:
+		count = int(args[0])
+	builders = [
+		("call", lambda: BuildProgram("call", count)),
+		("objects", lambda: BuildFreeListProgram(BuildObjectProgram, count)),
+		("allocator", lambda: BuildFreeListProgram(BuildAllocatorProgram, count))
+	]
+	for name, builder in builders:
+		emitter = builder()
+		size = len(emitter.Instructions)
+		executed = CountAllInstructions(emitter)
+		optimizer = PeepholeOptimizer().Run(emitter)
+		values = {
+			"size": str(size) + "->" + str(len(emitter.Instructions)),
+			"executed": str(executed) + "->" + str(CountAllInstructions(emitter))
+		}
+		for rule in optimizer.Hits:
+			values[rule] = optimizer.Hits[rule]
+		Report("peephole/" + name, values)
+
+C_MAIN = """
+#include <stdio.h>
+int main()
+{
+	while (!HALT)
+	{
+		Execute();
+		if (STATUS != SUCCESS)
+		{
+			printf("%s\\n", STATUS);
+			return 1;
+		}
+	}
+	return 0;
+}
+"""
+
+def CountInstructionsLinear(name, count):
+	#The programs are linear in their count, so extrapolate from two small runs.
+	small = CountInstructions(BuildProgram(name, 100))
+	large = CountInstructions(BuildProgram(name, 200))
+	return small + (large - small) * (count - 100) // 100
+
+def TimeCompiledProgram(emitter, directory):
+	import shutil
+	path = os.path.join(directory, "program.c")
+	with open(path, "w") as file:
+		file.write(str(emitter).replace("#pragma once", "") + C_MAIN)
+	executable = os.path.join(directory, "program")
+	subprocess.run([shutil.which("cc"), "-O2", "-w", "-fwrapv", "-o", executable, path], check=True)
+	start = time.perf_counter()
+	subprocess.run([executable], check=True)
+	return time.perf_counter() - start
+
+def BenchmarkC(args):
+	import shutil
+	from urclc import CEmit, DISPATCH_TABLE, DISPATCH_SWITCH, DISPATCH_GOTO
+	if shutil.which("cc") == None:
+		print("c: cc was not found.")
+		return
+	count = 100000000
+	if len(args) > 0:
+		count = int(args[0])
+	programs = [("loop", count), ("memory", count // 10), ("call", count // 5)]
+	with tempfile.TemporaryDirectory() as directory:
+		for name, size in programs:
+			executed = CountInstructionsLinear(name, size)
+			values = {"instructions": executed}
+			times = {}
+			for dispatch in [DISPATCH_TABLE, DISPATCH_SWITCH, DISPATCH_GOTO]:
+				times[dispatch] = TimeCompiledProgram(BuildProgram(name, size, CEmit(size + 1, 1024, dispatch)), directory)
+				values[dispatch + "_ips"] = int(executed / times[dispatch])
+			values["switch_speedup"] = round(times[DISPATCH_TABLE] / times[DISPATCH_SWITCH], 2)
+			values["goto_speedup"] = round(times[DISPATCH_TABLE] / times[DISPATCH_GOTO], 2)
+			Report("c/" + name, values)
+
+def BuildStraightLineProgram(emitter, count):
+	for i in range(count):
+		if i % 16 == 0:
+			emitter.MarkLabel(".label_" + str(i))
+		if i % 16 == 15:
+			emitter.Emit(BRL, ".label_" + str(i - 15), "R" + str(i % 8 + 1), "R" + str(i % 5 + 1))
+		else:
+			emitter.Emit(ADD, "R" + str(i % 8 + 1), "R" + str(i % 5 + 1), i % 100)
+	emitter.Emit(HLT)
+
+def BenchmarkTargets(args):
+	from urclpy import PythonEmit
+	from urclc import CEmit
+	from urcl86 import X86Emit
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	def GetTargets():
+		return [URCLEmit(), PythonEmit(useDebugger=True), CEmit(65536, 65536), X86Emit()]
+	start = time.perf_counter()
+	for target in GetTargets():
+		emitter = Emitter(emitTarget=target)
+		BuildStraightLineProgram(emitter, count)
+		str(emitter)
+	rebuild = time.perf_counter() - start
+	start = time.perf_counter()
+	emitter = Emitter()
+	BuildStraightLineProgram(emitter, count)
+	program = emitter.GetProgram()
+	for target in GetTargets():
+		target.Emit(program)
+	serial = time.perf_counter() - start
+	start = time.perf_counter()
+	emitter = Emitter()
+	BuildStraightLineProgram(emitter, count)
+	CompileTargets(emitter, GetTargets())
+	parallel = time.perf_counter() - start
+	Report("targets/" + str(len(GetTargets())), {
+		"instructions": count,
+		"rebuild_sec": round(rebuild, 3),
+		"shared_sec": round(serial, 3),
+		"parallel_sec": round(parallel, 3),
+		"shared_speedup": round(rebuild / serial, 2),
+		"parallel_speedup": round(rebuild / parallel, 2)
+	})
+
+def ChildParse(mode, path):
+	count = 0
+	start = time.perf_counter()
+	if mode == "legacy":
+		with open(path) as stream:
+			lines = stream.readlines()
+			for line in lines:
+				if LegacyParseInstruction(line) != None:
+					count += 1
+	elif mode == "stream":
+		with open(path) as stream:
+			for lineNumber, value in ParseStream(stream):
+				count += 1
+	elif mode == "mmap":
+		import mmap
+		with open(path, "rb") as file:
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+				for lineNumber, value in ParseStream(buffer):
+					count += 1
+	elapsed = time.perf_counter() - start
+	print(str(count) + " " + str(elapsed) + " " + str(PeakRSS()))
+
+def BenchmarkParse(args):
+	lineCount = 1000000
+	if len(args) > 0:
+		lineCount = int(args[0])
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "input.urcl")
+		WriteSyntheticURCL(path, lineCount)
+		for mode in ["legacy", "stream", "mmap"]:
+			count, elapsed, peak = RunChild(["parse", mode, path])
+			Report("parse/" + mode, {
+				"lines": lineCount,
+				"records": count,
+				"lines/sec": int(lineCount / float(elapsed)),
+				"peak_rss_kb": peak
+			})
+
+def LoadSources(paths, cache):
+	from urclcache import EmitParsed
+	emitter = Emitter()
+	start = time.perf_counter()
+	for path in paths:
+		if cache != None:
+			EmitParsed(emitter, cache.Parse(path))
+		else:
+			with open(path) as stream:
+				for lineNumber, inst in ParseStream(stream):
+					if emitter.IsLabel(inst):
+						emitter.MarkLabel(inst)
+					else:
+						emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+	return time.perf_counter() - start
+
+def BenchmarkCache(args):
+	from urclcache import BuildCache
+	fileCount = 200
+	if len(args) > 0:
+		fileCount = int(args[0])
+	with tempfile.TemporaryDirectory() as directory:
+		paths = []
+		for i in range(fileCount):
+			paths.append(os.path.join(directory, "input" + str(i) + ".urcl"))
+			WriteSyntheticURCL(paths[i], 2000)
+			with open(paths[i], "a") as stream:
+				stream.write(".input_" + str(i) + "\n")
+		uncached = LoadSources(paths, None)
+		cache = BuildCache(os.path.join(directory, "cache"))
+		cold = LoadSources(paths, cache)
+		warm = LoadSources(paths, cache)
+		with open(paths[0], "a") as stream:
+			stream.write("NOP\n")
+		touched = LoadSources(paths, cache)
+		Report("cache/" + str(fileCount), {
+			"uncached_sec": round(uncached, 3),
+			"cold_sec": round(cold, 3),
+			"warm_sec": round(warm, 3),
+			"touched_sec": round(touched, 3),
+			"speedup": round(uncached / touched, 2),
+			"hits": cache.Hits,
+			"misses": cache.Misses
+		})
+
+def BenchmarkJobs(args):
+	from urclcache import ParseFiles, EmitParsed
+	fileCount = 200
+	if len(args) > 0:
+		fileCount = int(args[0])
+	with tempfile.TemporaryDirectory() as directory:
+		paths = []
+		for i in range(fileCount):
+			paths.append(os.path.join(directory, "input" + str(i) + ".urcl"))
+			WriteSyntheticURCL(paths[i], 2000)
+			with open(paths[i], "a") as stream:
+				stream.write(".input_" + str(i) + "\n")
+		serial = None
+		for workers in [1, 2, 4, 8]:
+			start = time.perf_counter()
+			emitter = Emitter()
+			#The synthetic files share label names, so labels are only checked within each file.
+			for path, parsed in zip(paths, ParseFiles(paths, None, workers)):
+				EmitParsed(emitter, parsed, path)
+			elapsed = time.perf_counter() - start
+			if serial == None:
+				serial = elapsed
+			Report("jobs/" + str(workers), {
+				"files": fileCount,
+				"cpus": os.cpu_count(),
+				"sec": round(elapsed, 3),
+				"speedup": round(serial / elapsed, 2)
+			})
+
+def ChildStartup(mode, path):
+	start = time.perf_counter()
+	if mode == "urcl":
+		from urclvm import Machine
+		emitter = Emitter()
+		with open(path) as stream:
+			for lineNumber, inst in ParseStream(stream):
+				if emitter.IsLabel(inst):
+					emitter.MarkLabel(inst)
+				else:
+					emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+		Machine(emitter)
+	elif mode == "python":
+		with open(path) as stream:
+			exec(stream.read(), {})
+	elif mode == "binary":
+		from urclbin import BinaryMachine
+		BinaryMachine(path)
+	elapsed = time.perf_counter() - start
+	print(str(elapsed) + " " + str(PeakRSS()))
+
+def BenchmarkStartup(args):
+	from urclpy import PythonEmit
+	from urclbin import WriteBinary
+	counts = [10000, 100000, 1000000]
+	if len(args) > 0:
+		counts = [int(arg) for arg in args]
+	with tempfile.TemporaryDirectory() as directory:
+		for count in counts:
+			emitter = Emitter()
+			BuildStraightLineProgram(emitter, count)
+			paths = {
+				"urcl": os.path.join(directory, "program.urcl"),
+				"binary": os.path.join(directory, "program.urclb")
+			}
+			with open(paths["urcl"], "w") as stream:
+				emitter.CompileTo(stream)
+			with open(paths["binary"], "wb") as stream:
+				WriteBinary(emitter, stream)
+			#Compiling the generated module grows much faster than the program, so larger sizes would take minutes.
+			if count <= 100000:
+				paths["python"] = os.path.join(directory, "program.py")
+				with open(paths["python"], "w") as stream:
+					emitter.CompileTo(stream, PythonEmit(useDebugger=True))
+			for mode in paths:
+				elapsed, peak = RunChild(["startup", mode, paths[mode]])
+				Report("startup/" + mode + "/" + str(count), {
+					"sec": round(float(elapsed), 3),
+					"file_kb": os.path.getsize(paths[mode]) // 1024,
+					"peak_rss_kb": peak
+				})
+
+def BuildBreakpointProgram(count, sites):
+	emitter = BuildProgram("call", count)
+	#Breakpoints go on instructions after the final HLT, so they are armed but never hit.
+	first = len(emitter.Instructions)
+	for i in range(sites):
+		emitter.Emit(NOP)
+	return emitter, first
+
+def TimeCheckedLoop(machine, breakpoints):
+	rom = machine.ROM
+	ip = machine.IP
+	start = time.perf_counter()
+	while ip >= 0:
+		if ip in breakpoints:
+			break
+		ip = rom[ip]()
+	return time.perf_counter() - start
+
+def BenchmarkBreakpoints(args):
+	from urclvm import Machine
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	emitter, first = BuildBreakpointProgram(count, 1000)
+	executed = CountInstructions(emitter)
+	baseline = None
+	for breakpoints in [0, 10, 1000]:
+		machine = Machine(emitter)
+		for i in range(breakpoints):
+			machine.AddBreakpoint(first + i)
+		elapsed = TimeMachine(machine)
+		checked = TimeCheckedLoop(Machine(emitter), set(range(first, first + breakpoints)))
+		if baseline == None:
+			baseline = elapsed
+		Report("breakpoints/" + str(breakpoints), {
+			"instructions": executed,
+			"sec": round(elapsed, 3),
+			"overhead": str(round((elapsed / baseline - 1) * 100, 1)) + "%",
+			"checked_sec": round(checked, 3)
+		})
+	machine = Machine(emitter)
+	machine.AddWatchpoint(1 << 20)
+	elapsed = TimeMachine(machine)
+	Report("breakpoints/watch_memory", {
+		"instructions": executed,
+		"sec": round(elapsed, 3),
+		"overhead": str(round((elapsed / baseline - 1) * 100, 1)) + "%"
+	})
+	machine = Machine(emitter)
+	#The condition never holds, so every write to R1 is checked without stopping.
+	machine.AddWatchpoint("R1", lambda value: False)
+	elapsed = TimeMachine(machine)
+	Report("breakpoints/watch_register", {
+		"instructions": executed,
+		"sec": round(elapsed, 3),
+		"overhead": str(round((elapsed / baseline - 1) * 100, 1)) + "%"
+	})
+
+def BenchmarkProfile(args):
+	from urclpy import PythonEmit
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	for name in PROGRAMS:
+		executed = CountInstructions(BuildProgram(name, count))
+		plain = TimeGeneratedModule(BuildProgram(name, count, PythonEmit(useDebugger=True)))
+		profiled = TimeGeneratedModule(BuildProgram(name, count, PythonEmit(useDebugger=True, profile=True)))
+		Report("profile/" + name, {
+			"instructions": executed,
+			"plain_ips": int(executed / plain),
+			"profiled_ips": int(executed / profiled),
+			"overhead": str(round((profiled / plain - 1) * 100, 1)) + "%"
+		})
+
+def BenchmarkJournal(args):
+	from urclvm import Machine
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	for name in PROGRAMS:
+		emitter = BuildProgram(name, count)
+		executed = CountInstructions(emitter)
+		plain = TimeMachine(Machine(emitter))
+		machine = Machine(emitter)
+		machine.EnableJournal()
+		recorded = TimeMachine(machine)
+		start = time.perf_counter()
+		undone = machine.StepBack(executed)
+		back = time.perf_counter() - start
+		Report("journal/" + name, {
+			"instructions": executed,
+			"plain_ips": int(executed / plain),
+			"recorded_ips": int(executed / recorded),
+			"overhead": str(round((recorded / plain - 1) * 100, 1)) + "%",
+			"undone": undone,
+			"back_sec": round(back, 3)
+		})
+
+def BenchmarkCheckpoint(args):
+	from urclvm import Machine
+	from urclckpt import SaveCheckpoint, LoadCheckpoint
+	count = 100000
+	if len(args) > 0:
+		count = int(args[0])
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "program.ckpt")
+		for name in PROGRAMS:
+			emitter = BuildProgram(name, count)
+			prefix = CountInstructions(emitter) // 2
+			machine = Machine(emitter)
+			start = time.perf_counter()
+			machine.Execute(prefix)
+			executed = time.perf_counter() - start
+			start = time.perf_counter()
+			SaveCheckpoint(machine, path)
+			saved = time.perf_counter() - start
+			machine = Machine(emitter)
+			start = time.perf_counter()
+			LoadCheckpoint(machine, path)
+			loaded = time.perf_counter() - start
+			Report("checkpoint/" + name, {
+				"prefix_instructions": prefix,
+				"prefix_sec": round(executed, 3),
+				"save_sec": round(saved, 3),
+				"load_sec": round(loaded, 3),
+				"bytes": os.path.getsize(path),
+				"speedup": round(executed / loaded, 1)
+			})
+
+def _EmitScaleBody(emitter, registers, returnLabel):
+	emitter.EmitGetArgument(1, 0, registers[0])
+	emitter.EmitSetLocal(0, registers[0])
+	emitter.EmitGetLocal(0, registers[1])
+	emitter.Emit(ADD, registers[1], registers[1], registers[2])
+
+def BuildConstantProgram(emitter, count):
+	#Sizes and flags are set once with IMM and only read afterwards, like configuration constants.
+	counter = emitter.NewRegister()
+	total = emitter.NewRegister()
+	scale = emitter.NewRegister()
+	offset = emitter.NewRegister()
+	debug = emitter.NewRegister()
+	value = emitter.NewRegister()
+	function = emitter.NewLabel("scale")
+	main = emitter.NewLabel("main")
+	loop = emitter.NewLabel()
+	skip = emitter.NewLabel()
+	emitter.Emit(JMP, main)
+	emitter.EmitFunction(function, 1, _EmitScaleBody, [value, total, offset])
+	emitter.MarkLabel(main)
+	emitter.Emit(IMM, scale, 3)
+	emitter.Emit(LSH, scale, scale)
+	emitter.Emit(ADD, offset, scale, 10)
+	emitter.Emit(IMM, debug, 0)
+	emitter.Emit(IMM, counter, count)
+	emitter.MarkLabel(loop)
+	emitter.Emit(BRZ, skip, debug)
+	emitter.Emit(STR, ALLOCATOR_TABLE + 1, counter)
+	emitter.MarkLabel(skip)
+	emitter.Emit(MLT, value, counter, scale)
+	emitter.CallFunction(function, _PushCallArguments, [value])
+	emitter.Emit(DEC, counter, counter)
+	emitter.Emit(BNZ, loop, counter)
+	emitter.Emit(STR, ALLOCATOR_TABLE, total)
+	emitter.Emit(HLT)
+
+def BuildEmitter(builder, count, **options):
+	emitter = Emitter(**options)
+	builder(emitter, count)
+	return emitter
+
+def RunToHalt(emitter):
+	from urclvm import Machine
+	machine = Machine(emitter)
+	executed = 0
+	while not machine.HALT:
+		executed += machine.Execute(1 << 62)
+	return (machine, executed)
+
+def BenchmarkConstantPropagation(args):
+	from urclopt import ConstantPropagator
+	count = 200
+	if len(args) > 0:
+		count = int(args[0])
+	builders = [
+		("constants", lambda: BuildEmitter(BuildConstantProgram, count)),
+		("call", lambda: BuildProgram("call", count)),
+		("objects", lambda: BuildFreeListProgram(BuildObjectProgram, count)),
+		("allocator", lambda: BuildFreeListProgram(BuildAllocatorProgram, count))
+	]
+	for name, builder in builders:
+		emitter = builder()
+		size = len(emitter.Instructions)
+		machine, executed = RunToHalt(emitter)
+		propagator = ConstantPropagator().Run(emitter)
+		optimized, optimizedExecuted = RunToHalt(emitter)
+		Report("constprop/" + name, {
+			"size": str(size) + "->" + str(len(emitter.Instructions)),
+			"executed": str(executed) + "->" + str(optimizedExecuted),
+			"reduction": str(round((1 - len(emitter.Instructions) / size) * 100, 1)) + "%",
+			"folded": propagator.Folded,
+			"branches": propagator.Branches,
+			"unreachable": propagator.Unreachable,
+			"dead_stores": propagator.DeadStores,
+			"same_result": machine.RAM == optimized.RAM
+		})
+
+def BenchmarkInlining(args):
+	from urclopt import PeepholeOptimizer
+	count = 200
+	if len(args) > 0:
+		count = int(args[0])
+	builders = [
+		("call", lambda size: BuildProgram("call", count, inlineFunctionSize=size)),
+		("constants", lambda size: BuildEmitter(BuildConstantProgram, count, inlineFunctionSize=size)),
+		("objects", lambda size: BuildFreeListProgram(BuildObjectProgram, count, inlineFunctionSize=size))
+	]
+	for name, builder in builders:
+		baseline = builder(None)
+		machine, executed = RunToHalt(baseline)
+		for size in [4, 16]:
+			emitter = builder(size)
+			inlinedSize = len(emitter.Instructions)
+			inlined, inlinedExecuted = RunToHalt(emitter)
+			PeepholeOptimizer().Run(emitter)
+			optimized, optimizedExecuted = RunToHalt(emitter)
+			Report("inline/" + name + "/" + str(size), {
+				"calls": emitter.InlinedCalls,
+				"size": str(len(baseline.Instructions)) + "->" + str(inlinedSize),
+				"executed": str(executed) + "->" + str(inlinedExecuted),
+				"peephole_executed": optimizedExecuted,
+				"speedup": round(executed / optimizedExecuted, 2),
+				"same_result": machine.RAM == inlined.RAM and machine.RAM == optimized.RAM
+			})
+
+def GetExecutionCounts(emitter):
+	from urclpy import PythonEmit
+	module = {}
+	exec(emitter.Compile(PythonEmit(useDebugger=True, profile=True)), module)
+	while not module["HALT"]:
+		module["Execute"]()
+	return module["PROFILE_COUNTS"]
+
+def CountX86Instructions(target, counts):
+	#Count the machine instructions and memory operands emitted for each URCL instruction, weighted by how often it runs.
+	static = 0
+	memory = 0
+	executed = 0
+	executedMemory = 0
+	for i in range(len(target.InstructionStarts) - 1):
+		for inst in target.Instructions[target.InstructionStarts[i]:target.InstructionStarts[i + 1]]:
+			for line in inst.Compile(target.Bits, True).split("\n"):
+				if len(line) == 0 or line.endswith(":"):
+					continue
+				static += 1
+				executed += counts[i]
+				if "[" in line:
+					memory += 1
+					executedMemory += counts[i]
+	return (static, memory, executed, executedMemory)
+
+def BenchmarkX86(args):
+	from urcl86 import X86Emit
+	count = 200
+	if len(args) > 0:
+		count = int(args[0])
+	builders = [
+		("loop", lambda: BuildProgram("loop", count)),
+		("memory", lambda: BuildProgram("memory", count)),
+		("call", lambda: BuildProgram("call", count)),
+		("constants", lambda: BuildEmitter(BuildConstantProgram, count))
+	]
+	for name, builder in builders:
+		emitter = builder()
+		counts = GetExecutionCounts(emitter)
+		program = emitter.GetProgram()
+		for bits in [32, 64]:
+			values = {}
+			for pin in [False, True]:
+				target = X86Emit(bits=bits, expandMacros=True, pinRegisters=pin)
+				values[pin] = (len(target.Emit(program)),) + CountX86Instructions(target, counts)
+			Report("x86/" + name + "/" + str(bits), {
+				"pinned": len(target.PinnedRegisters),
+				"bytes": str(values[False][0]) + "->" + str(values[True][0]),
+				"instructions": str(values[False][1]) + "->" + str(values[True][1]),
+				"memory_operands": str(values[False][2]) + "->" + str(values[True][2]),
+				"executed": str(values[False][3]) + "->" + str(values[True][3]),
+				"executed_memory": str(values[False][4]) + "->" + str(values[True][4])
+			})
+
+BENCHMARKS = {
+	"parse": BenchmarkParse,
+	"emit": BenchmarkEmit,
+	"engine": BenchmarkEngine,
+	"blocks": BenchmarkBlocks,
+	"memorymodel": BenchmarkMemoryModel,
+	"allocator": BenchmarkAllocator,
+	"arena": BenchmarkArena,
+	"regalloc": BenchmarkRegisterAllocation,
+	"peephole": BenchmarkPeephole,
+	"c": BenchmarkC,
+	"targets": BenchmarkTargets,
+	"cache": BenchmarkCache,
+	"jobs": BenchmarkJobs,
+	"startup": BenchmarkStartup,
+	"breakpoints": BenchmarkBreakpoints,
+	"profile": BenchmarkProfile,
+	"journal": BenchmarkJournal,
+	"checkpoint": BenchmarkCheckpoint,
+	"constprop": BenchmarkConstantPropagation,
+	"inline": BenchmarkInlining,
+	"x86": BenchmarkX86
+}
+
+CHILDREN = {
+	"parse": ChildParse,
+	"emit": ChildEmit,
+	"startup": ChildStartup
+}
+
+if __name__ == "__main__":
+	args = sys.argv[1:len(sys.argv)]
+	if len(args) > 0 and args[0] == "--child":
+		CHILDREN[args[1]](*args[2:len(args)])
+	elif len(args) > 0 and not args[0] in BENCHMARKS:
+		print("Unknown benchmark: " + args[0])
+		print("Available benchmarks: " + ", ".join(BENCHMARKS))
+		exit(1)
+	elif len(args) > 0:
+		BENCHMARKS[args[0]](args[1:len(args)])
+	else:
+		for name in BENCHMARKS:
+			BENCHMARKS[name]([])
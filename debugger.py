@@ -1,10 +1,16 @@
-import collections
+from bisect import insort
+from itertools import islice
+from math import log
 from sys import argv
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 from tkinter import filedialog as fd
-from urcl import Emitter, ParseInstruction
-from urclpy import PythonEmit
+from tkinter import simpledialog
+from urcl import Emitter, ParseStream, ParseInstruction, GetOperandKind, OPERAND_REGISTER, ZERO
+from urclvm import Machine, Watchpoint, OPERATIONS, MEMORY_WRITE_OPERATIONS, STACK_POINTER_OPERATIONS
+from urclbin import BinaryMachine
+from urclprof import LoadProfile
 
 root = tk.Tk()
 root.title("URCL Debugger")
@@ -28,55 +34,320 @@ def CreateMenu(root, menuItems=[]):
 		
 	return menuroot
 
-def CreateScrollableFrame(root, row, column):
-	container = ttk.Frame(root)
-	canvas = tk.Canvas(container)
-	scrollbar = ttk.Scrollbar(container, orient="vertical", command=canvas.yview)
-	scrollable = ttk.Frame(canvas)
+#Rows have a fixed height so the number of visible rows follows from the height of the view.
+_RowHeight = 20
+ttk.Style(root).configure("Treeview", rowheight=_RowHeight)
 
-	scrollable.bind(
-		"<Configure>",
-		lambda e: canvas.configure(
-			scrollregion=canvas.bbox("all")
-		)
-	)
+class VirtualList:
+	def __init__(self, root, row, column, columns, getCount, getRow):
+		container = ttk.Frame(root)
+		self.Tree = ttk.Treeview(container, columns=columns, show="headings", selectmode="none")
+		for name in columns:
+			self.Tree.heading(name, text=name)
+		self.ScrollBar = ttk.Scrollbar(container, orient="vertical", command=self.OnScroll)
+		container.grid(row=row, column=column, sticky="nsew")
+		self.ScrollBar.pack(side="right", fill="y")
+		self.Tree.pack(side="left", fill="both", expand=True)
+		self.Tree.bind("<Configure>", self.OnResize)
+		self.Tree.bind("<MouseWheel>", lambda e: self.OnWheel(-1 if e.delta > 0 else 1))
+		self.Tree.bind("<Button-4>", lambda e: self.OnWheel(-1))
+		self.Tree.bind("<Button-5>", lambda e: self.OnWheel(1))
+		for tag, color in ROW_COLORS.items():
+			self.Tree.tag_configure(tag, background=color)
+		self.GetCount = getCount
+		self.GetRow = getRow
+		self.First = 0
+		self.RowCount = 1
+		self.Items = []
+		self.Shown = []
 
-	canvas.create_window((0, 0), window=scrollable, anchor="nw")
+	def Render(self):
+		#Only the visible rows exist as Treeview items, and an item is only changed when its row is different.
+		count = self.GetCount()
+		self.First = max(0, min(self.First, count - self.RowCount))
+		visible = max(0, min(self.RowCount, count - self.First))
+		while len(self.Items) < visible:
+			self.Items.append(self.Tree.insert("", "end"))
+			self.Shown.append(None)
+		while len(self.Items) > visible:
+			self.Tree.delete(self.Items.pop())
+			self.Shown.pop()
+		for slot in range(visible):
+			row = self.GetRow(self.First + slot)
+			if row != self.Shown[slot]:
+				self.Tree.item(self.Items[slot], values=row[0], tags=row[1])
+				self.Shown[slot] = row
+		if count > 0:
+			self.ScrollBar.set(self.First / count, (self.First + visible) / count)
+		else:
+			self.ScrollBar.set(0, 1)
+
+	def See(self, index):
+		if index < self.First:
+			self.First = index
+		elif index >= self.First + self.RowCount:
+			self.First = index - self.RowCount // 2
+
+	def Scroll(self, rows):
+		self.First += rows
+		self.Render()
+
+	def GetIndexAt(self, y):
+		item = self.Tree.identify_row(y)
+		if not item in self.Items:
+			return None
+		return self.First + self.Items.index(item)
+
+	def OnWheel(self, rows):
+		#The Treeview only holds the visible rows, so its own scrolling is skipped.
+		self.Scroll(rows * 3)
+		return "break"
+
+	def OnScroll(self, command, value, unit=None):
+		if command == "moveto":
+			self.First = int(float(value) * self.GetCount())
+			self.Render()
+		elif unit == "pages":
+			self.Scroll(int(value) * self.RowCount)
+		else:
+			self.Scroll(int(value))
+
+	def OnResize(self, event):
+		#The heading takes up about one row.
+		rowCount = max(1, event.height // _RowHeight - 1)
+		if rowCount != self.RowCount:
+			self.RowCount = rowCount
+			self.Render()
+
+class ROMEntry:
+	def __init__(self, source):
+		self.Source = source
+
+#Sources are only read for the rows that are shown.
+class MachineROM:
+	def __init__(self, machine):
+		self.Machine = machine
+
+	def __len__(self):
+		return self.Machine.Size
 
-	canvas.configure(yscrollcommand=scrollbar.set)
+	def __iter__(self):
+		return iter(range(self.Machine.Size))
 
-	container.grid(row=row, column=column, sticky="nsew")
-	canvas.pack(side="left", fill="both", expand=True)
-	scrollbar.pack(side="right", fill="y")
-	scrollable.ScrollBar = scrollbar
-	return scrollable
+	def __contains__(self, addr):
+		return isinstance(addr, int) and 0 <= addr < self.Machine.Size
 
-def ScrollTo(scrollarea, position):
-	scrollbar = scrollarea.ScrollBar
-	start, end = scrollbar.get()
-	if position < start or position > end:
-		scrollbar.set(position, position + (end - start))
-		root.nametowidget(scrollarea.winfo_parent()).yview_moveto(position)
+	def __getitem__(self, addr):
+		return ROMEntry(self.Machine.GetSource(addr))
+
+def SyncMachine(machine):
+	fields = globals()
+	for name in machine.RegisterNames:
+		if name != ZERO:
+			fields[name] = machine.GetRegister(name)
+	fields["IP"] = machine.IP
+	fields["HALT"] = machine.HALT
+	fields["BREAK"] = machine.BREAK
+
+def BindMachine(machine):
+	global _Machine
+	global ROM
+	global RAM
+	global STACK
+	global Execute
+	_Machine = machine
+	if _JournalSize > 0:
+		machine.EnableJournal(_JournalSize)
+	ROM = MachineROM(machine)
+	RAM = machine.RAM
+	STACK = machine.STACK
+
+	def ExecuteMachine(limit=None):
+		if STEP:
+			machine.Step()
+		else:
+			machine.Execute(limit)
+		SyncMachine(machine)
+
+	Execute = ExecuteMachine
+	SyncMachine(machine)
+
+#Breakpoints and watchpoints are armed on the machine, or by replacing ROM entries of a loaded module.
+_Machine = None
+_Breakpoints = set()
+_Watchpoints = {}
+_Originals = {}
+_ResumeAddress = None
+
+def GetModuleWrite(addr):
+	inst = ParseInstruction(_Originals.get(addr, ROM[addr]).Source)
+	if inst == None or isinstance(inst, str) or (not inst.Operation in OPERATIONS) or not OPERATIONS[inst.Operation][3]:
+		return (inst, None)
+	return (inst, inst.OperandA)
+
+def PatchModule(addr):
+	original = _Originals.get(addr, ROM[addr])
+	handler = original
+	for watch in _Watchpoints.values():
+		if addr in watch.Positions:
+			handler = ModuleWatch(handler, watch)
+	if addr in _Breakpoints:
+		handler = ModuleBreak(handler, addr)
+	if handler is original:
+		_Originals.pop(addr, None)
+	else:
+		_Originals[addr] = original
+		handler.Source = original.Source
+	ROM[addr] = handler
+
+def ModuleBreak(handler, addr):
+	def Break():
+		global IP
+		global BREAK
+		global _ResumeAddress
+		if _ResumeAddress == addr:
+			_ResumeAddress = None
+			return handler()
+		_ResumeAddress = addr
+		BREAK = True
+		#The module advances IP after every instruction.
+		IP = addr - 1
+	return Break
+
+def ModuleWatch(handler, watch):
+	def Watch():
+		global BREAK
+		handler()
+		if watch.Check():
+			BREAK = True
+	return Watch
+
+def GetBreakpoints():
+	if _Machine != None:
+		return _Machine.Breakpoints
+	return _Breakpoints
+
+def ToggleBreakpoint(target):
+	global _Breakpoints
+	if _Machine != None:
+		if _Machine.GetPosition(target) in _Machine.Breakpoints:
+			_Machine.RemoveBreakpoint(target)
+		else:
+			_Machine.AddBreakpoint(target)
+		return
+	addr = target
+	if isinstance(target, str):
+		addr = globals().get("LABEL_" + target[1:len(target)])
+	if not addr in ROM:
+		raise ValueError("\"" + str(target) + "\" is not a ROM address or label.")
+	if addr in _Breakpoints:
+		_Breakpoints.discard(addr)
+	else:
+		_Breakpoints.add(addr)
+	PatchModule(addr)
+
+def AddWatchpoint(target, condition=None):
+	if _Machine != None:
+		_Machine.AddWatchpoint(target, condition)
+		return
+	if target in _Watchpoints:
+		watch = _Watchpoints.pop(target)
+		for addr in watch.Positions:
+			PatchModule(addr)
+	fields = globals()
+	positions = set()
+	if isinstance(target, int):
+		read = lambda: Get(target)
+		for addr in ROM:
+			inst, written = GetModuleWrite(addr)
+			if inst != None and not isinstance(inst, str) and inst.Operation in MEMORY_WRITE_OPERATIONS:
+				positions.add(addr)
+	elif GetOperandKind(target) == OPERAND_REGISTER and target in fields and target != ZERO:
+		read = lambda: fields[target]
+		for addr in ROM:
+			inst, written = GetModuleWrite(addr)
+			if written == target or (target == "SP" and inst != None and not isinstance(inst, str) and inst.Operation in STACK_POINTER_OPERATIONS):
+				positions.add(addr)
+	else:
+		raise ValueError("\"" + str(target) + "\" is not a register of the program or a memory address.")
+	_Watchpoints[target] = Watchpoint(target, read, condition, positions)
+	for addr in positions:
+		PatchModule(addr)
+
+def ClearBreakpoints():
+	if _Machine != None:
+		_Machine.ClearBreakpoints()
+		return
+	_Breakpoints.clear()
+	_Watchpoints.clear()
+	for addr in list(_Originals):
+		PatchModule(addr)
+
+def ParseTarget(text):
+	text = text.strip()
+	try:
+		return int(text, 0)
+	except ValueError:
+		return text
+
+def OnAddBreakpoint():
+	text = simpledialog.askstring("Breakpoint", "ROM address or label:")
+	if text != None and len(text.strip()) > 0:
+		try:
+			ToggleBreakpoint(ParseTarget(text))
+		except ValueError as error:
+			messagebox.showerror(title="Breakpoint Error", message=str(error))
+		UpdateUI()
+
+def OnAddWatchpoint():
+	text = simpledialog.askstring("Watchpoint", "Register or memory address:")
+	if text == None or len(text.strip()) == 0:
+		return
+	condition = simpledialog.askstring("Watchpoint", "Stop when the new value matches this condition, for example \"value > 10\". Leave empty to stop on every change:")
+	try:
+		if condition != None and len(condition.strip()) > 0:
+			condition = eval("lambda value: " + condition)
+			#The condition is tried once here, so a name or type error is reported now rather than in the middle of a run.
+			condition(0)
+		else:
+			condition = None
+		AddWatchpoint(ParseTarget(text), condition)
+	except Exception as error:
+		messagebox.showerror(title="Watchpoint Error", message=str(error))
+
+def OnClearBreakpoints():
+	ClearBreakpoints()
+	UpdateUI()
 
 def ImportFile(file):
+	global _Machine
+	global PROFILE_COUNTS
+	global _ProfileCounts
 	file = str(file)
+	_Machine = None
+	PROFILE_COUNTS = None
+	_ProfileCounts = None
+	_Breakpoints.clear()
+	_Watchpoints.clear()
+	_Originals.clear()
+	globals().pop("REGISTERS", None)
 	if file.lower().endswith(".py"):
 		with open(file) as stream:
 			exec(stream.read(), globals())
 	elif file.lower().endswith(".urcl"):
-		emitter = Emitter(emitTarget=PythonEmit(useDebugger=True))
+		emitter = Emitter()
 		with open(file) as stream:
-			lines = stream.readlines()
-			for line in lines:
-				inst = ParseInstruction(line)
-				if inst != None:
-					if emitter.IsLabel(inst):
-						emitter.MarkLabel(inst)
-					else:
-						emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
-		exec(str(emitter), globals())
+			for lineNumber, inst in ParseStream(stream):
+				if emitter.IsLabel(inst):
+					emitter.MarkLabel(inst)
+				else:
+					emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+		BindMachine(Machine(emitter))
+	elif file.lower().endswith(".urclb"):
+		BindMachine(BinaryMachine(file))
 	else:
 		messagebox.showerror(title="Import Error", message="File format is not supported.")
+	LoadRegisterNames()
 	UpdateUI()
 
 def OnOpen():
@@ -84,6 +355,16 @@ def OnOpen():
 	if len(file) > 0:
 		ImportFile(file)
 
+def OnOpenProfile():
+	global _ProfileCounts
+	file = fd.askopenfilename(filetypes=[("Profiles", "*.json"), ("All Files", "*")])
+	if len(file) > 0:
+		try:
+			_ProfileCounts = LoadProfile(file).Counts
+		except (OSError, ValueError, KeyError) as error:
+			messagebox.showerror(title="Profile Error", message=str(error))
+		UpdateUI()
+
 def OnExit():
 	exit(0)
 
@@ -96,18 +377,47 @@ STEP = True
 HALT = False
 BREAK = False
 
+#Run executes slices of up to _TimeSlice seconds and only updates the UI between them. The clock is checked every _SliceInstructions instructions.
+_TimeSlice = 0.016
+_SliceInstructions = 4096
+
 _IsTimerExecuting = False
 _ShouldTimerStop = False
 
-def Execute():
+#Programs run on a machine record their last _JournalSize instructions so they can be stepped back.
+_JournalSize = 1000000
+
+def Execute(limit=None):
 	messagebox.showwarning(title="Engine Exception", message="Engine Exception: name 'Execute' is not defined.")
 
 def OnStep():
 	global STEP
+	global _ResumeAddress
 	STEP = True
+	#A step always executes the current instruction, even when it has a breakpoint.
+	_ResumeAddress = IP
 	Execute()
 	UpdateUI()
 
+def StepBackMachine(backward):
+	if _IsTimerExecuting:
+		return
+	if _Machine == None or _Machine.Journal == None:
+		messagebox.showerror(title="Reverse Execution", message="Stepping back needs a .urcl or .urclb program and a journal.")
+		return
+	if backward:
+		_Machine.RunBackward()
+	else:
+		_Machine.StepBack()
+	SyncMachine(_Machine)
+	UpdateUI()
+
+def OnStepBack():
+	StepBackMachine(False)
+
+def OnRunBack():
+	StepBackMachine(True)
+
 def OnRun():
 	global _ShouldTimerStop
 	if not _IsTimerExecuting:
@@ -128,19 +438,39 @@ def OnClock():
 		return
 	else:
 		_IsTimerExecuting = True
-	OnStep()
+	RunSlice()
+	UpdateUI()
 	if BREAK or HALT:
 		_IsTimerExecuting = False
 	else:
-		root.after(100, OnClock)
+		root.after(1, OnClock)
+
+def RunSlice():
+	global STEP
+	global _ResumeAddress
+	STEP = False
+	if _ResumeAddress != IP:
+		_ResumeAddress = None
+	start = time.perf_counter()
+	Execute(_SliceInstructions)
+	while not (BREAK or HALT) and time.perf_counter() - start < _TimeSlice:
+		Execute(_SliceInstructions)
 
 MenuBar = CreateMenu(root, [
 	MenuItem("File", None, [
 		MenuItem("Open", OnOpen),
+		MenuItem("Open Profile", OnOpenProfile),
 		MenuItem("Exit", OnExit)
 	]),
+	MenuItem("Breakpoints", None, [
+		MenuItem("Toggle Breakpoint", OnAddBreakpoint),
+		MenuItem("Add Watchpoint", OnAddWatchpoint),
+		MenuItem("Clear All", OnClearBreakpoints)
+	]),
 	MenuItem("Step", OnStep),
 	MenuItem("Run", OnRun),
+	MenuItem("Step Back", OnStepBack),
+	MenuItem("Run Back", OnRunBack),
 	MenuItem("Interrupt", OnInterrupt)
 ])
 root.config(menu=MenuBar)
@@ -149,79 +479,196 @@ root.rowconfigure(1, weight=1)
 root.columnconfigure(0, weight=1)
 root.columnconfigure(1, weight=1)
 
-RegistersArea = CreateScrollableFrame(root, 0, 0)
-ROMArea = CreateScrollableFrame(root, 0, 1)
-StackArea = CreateScrollableFrame(root, 1, 0)
-RAMArea = CreateScrollableFrame(root, 1, 1)
-
 RegisterValues = {}
 RAMValues = {}
+RegisterRows = []
+#Rows are built from these names, which are only collected when a program is loaded.
+_RegisterNames = ["IP", "SP", "HALT", "BREAK"]
+#Addresses whose value changed since the previous update, among the rows that were visible then.
+_RAMWritten = set()
+
+#The ROM pane maps rows to ROM addresses, and the RAM pane keeps the addresses of a sparse RAM sorted.
+_ROMSource = None
+_ROMAddresses = []
+_ROMRows = {}
+_RAMSource = None
+_RAMAddresses = []
+_RAMIndexed = 0
+_RAMVersion = None
+
+#Execution counts come from a profiled module while it runs, or from a saved profile. Rows are shaded by count on a log scale.
+PROFILE_COUNTS = None
+_ProfileCounts = None
+_ProfileMax = 0
+
+def GetRegisterRow(index):
+	return RegisterRows[index]
 
-def Clear(root):
-	for child in root.winfo_children():
-		child.destroy()
+def GetProfileCounts():
+	if PROFILE_COUNTS != None:
+		return PROFILE_COUNTS
+	return _ProfileCounts
+
+def GetHeatTag(count):
+	if count <= 0 or _ProfileMax <= 0:
+		return None
+	if _ProfileMax == 1:
+		return "heat4"
+	return "heat" + str(1 + min(3, int(4 * log(count) / log(_ProfileMax + 1))))
+
+def GetROMRow(index):
+	addr = _ROMAddresses[index]
+	counts = GetProfileCounts()
+	count = ""
+	if counts != None and 0 <= addr < len(counts):
+		count = counts[addr]
+	tags = ()
+	if addr == IP:
+		tags = ("ip",)
+	elif addr in GetBreakpoints():
+		tags = ("breakpoint",)
+	elif count != "" and GetHeatTag(count) != None:
+		tags = (GetHeatTag(count),)
+	return ((addr, ROM[addr].Source, count), tags)
+
+def GetStackDepth():
+	depth = max(-SP, 0)
+	for addr in range(len(STACK) - 1, depth - 1, -1):
+		if STACK[addr] != 0:
+			depth = addr + 1
+			break
+	return depth
+
+def GetStackRow(index):
+	tags = ()
+	if (-SP - 1) == index:
+		tags = ("sp",)
+	return ((index, STACK[index]), tags)
+
+def GetRAMCount():
+	if isinstance(RAM, dict):
+		return len(_RAMAddresses)
+	return len(RAM)
+
+def GetRAMAddress(index):
+	if isinstance(RAM, dict):
+		return _RAMAddresses[index]
+	return index
+
+def GetRAMRow(index):
+	addr = GetRAMAddress(index)
+	tags = ()
+	if addr in _RAMWritten:
+		tags = ("written",)
+	return ((addr, RAM[addr]), tags)
+
+ROW_COLORS = {
+	"changed": "IndianRed1",
+	"ip": "light goldenrod",
+	"breakpoint": "tomato",
+	"sp": "light sky blue",
+	"written": "PaleGreen1",
+	"heat1": "lavender",
+	"heat2": "thistle",
+	"heat3": "plum",
+	"heat4": "orchid"
+}
+
+RegistersArea = VirtualList(root, 0, 0, ("Register", "Value"), lambda: len(RegisterRows), GetRegisterRow)
+ROMArea = VirtualList(root, 0, 1, ("Address", "Instruction", "Count"), lambda: len(_ROMAddresses), GetROMRow)
+
+def OnROMDoubleClick(event):
+	index = ROMArea.GetIndexAt(event.y)
+	if index != None:
+		ToggleBreakpoint(_ROMAddresses[index])
+		UpdateUI()
+
+ROMArea.Tree.bind("<Double-1>", OnROMDoubleClick)
+StackArea = VirtualList(root, 1, 0, ("Depth", "Value"), GetStackDepth, GetStackRow)
+RAMArea = VirtualList(root, 1, 1, ("Address", "Value"), GetRAMCount, GetRAMRow)
+
+def LoadRegisterNames():
+	global _RegisterNames
+	fields = globals()
+	if _Machine != None:
+		names = [name for name in _Machine.RegisterNames if name != ZERO]
+	elif "REGISTERS" in fields:
+		names = list(fields["REGISTERS"])
+	else:
+		#Modules without a register list are scanned once for integer globals.
+		names = [key for key in fields if not key.startswith("_") and isinstance(fields[key], int)]
+	names = ["IP", "HALT", "BREAK"] + [name for name in names if not name in ["IP", "HALT", "BREAK"]]
+	names.sort(key=len)
+	_RegisterNames = names
 
 def UpdateRegisters():
-	Clear(RegistersArea)
+	global RegisterRows
 	fields = globals()
-	fieldNames = list(fields.keys())
-	fieldNames.sort(key=len)
-	row = 0
-	for key in fieldNames:
-		if not key.startswith("_"):
-			value = fields[key]
-			if isinstance(value, int) or isinstance(value, bool):
-				color = "IndianRed1"
-				if key in RegisterValues and RegisterValues[key] == value:
-					color = "gray94"
-				else:
-					RegisterValues[key] = value
-				ttk.Label(RegistersArea, text=(key + " = " + str(value)), background=color).grid(row=row, sticky="nsew")
-				row += 1
+	RegisterRows = []
+	for key in _RegisterNames:
+		value = fields.get(key, 0)
+		tags = ("changed",)
+		if key in RegisterValues and RegisterValues[key] == value:
+			tags = ()
+		else:
+			RegisterValues[key] = value
+		RegisterRows.append(((key, value), tags))
+	RegistersArea.Render()
 
 def UpdateInstructions():
-	Clear(ROMArea)
-	row = 0
-	for addr in ROM:
-		color = "gray94"
-		if addr == IP:
-			color = "light goldenrod"
-		label = ttk.Label(ROMArea, text=ROM[addr].Source, background=color)
-		if addr == IP:
-			position = row / len(ROM)
-			ScrollTo(ROMArea, position)
-		label.grid(row=row, sticky="nsew")
-		row += 1
+	global _ROMSource
+	global _ROMAddresses
+	global _ROMRows
+	global _ProfileMax
+	counts = GetProfileCounts()
+	_ProfileMax = 0
+	if counts != None and len(counts) > 0:
+		_ProfileMax = max(counts)
+	if ROM is not _ROMSource or len(ROM) != len(_ROMAddresses):
+		_ROMSource = ROM
+		_ROMAddresses = list(ROM)
+		_ROMRows = {_ROMAddresses[row]: row for row in range(len(_ROMAddresses))}
+	if IP in _ROMRows:
+		ROMArea.See(_ROMRows[IP])
+	ROMArea.Render()
 
 def UpdateStack():
-	Clear(StackArea)
-	addr = 0
-	for value in STACK:
-		color = "gray94"
-		if (-SP - 1) == addr:
-			color = "light sky blue"
-		ttk.Label(StackArea, text=str(value), background=color).grid(row=addr, sticky="nsew")
-		addr += 1
+	StackArea.Render()
+
+def UpdateRAMIndex():
+	global _RAMSource
+	global _RAMAddresses
+	global _RAMIndexed
+	global _RAMVersion
+	if not isinstance(RAM, dict):
+		return
+	version = None
+	if _Machine != None:
+		version = _Machine.MemoryVersion
+	if RAM is not _RAMSource or version != _RAMVersion or len(RAM) < _RAMIndexed:
+		_RAMSource = RAM
+		_RAMVersion = version
+		_RAMAddresses = []
+		_RAMIndexed = 0
+	#Stepping back and restoring checkpoints bump the memory version when they remove addresses, so otherwise the ones written since the last update are at the end of the dict.
+	for addr in islice(RAM, _RAMIndexed, None):
+		insort(_RAMAddresses, addr)
+	_RAMIndexed = len(RAM)
 
 def UpdateRAM():
-	Clear(RAMArea)
-	row = 0
-	last = -1
-	ram = collections.OrderedDict(sorted(RAM.items()))
-	for addr in ram:
+	global _RAMWritten
+	UpdateRAMIndex()
+	#Changes are found here rather than while rendering, so scrolling does not clear them.
+	count = GetRAMCount()
+	first = max(0, min(RAMArea.First, count - RAMArea.RowCount))
+	_RAMWritten = set()
+	for index in range(first, min(count, first + RAMArea.RowCount)):
+		addr = GetRAMAddress(index)
 		value = RAM[addr]
-		color = "PaleGreen1"
-		if addr in RAMValues and RAMValues[addr] == value:
-			color = "gray94"
-		else:
+		if RAMValues.get(addr, 0) != value:
+			_RAMWritten.add(addr)
 			RAMValues[addr] = value
-		if addr != last + 1:
-			ttk.Label(RAMArea, text="...").grid(row=row, columnspan=2, sticky="nsew")
-			row += 1
-		last = addr
-		ttk.Label(RAMArea, text=str(addr), background=color).grid(row=row, column=0, sticky="nsew")
-		ttk.Label(RAMArea, text=str(value), background=color).grid(row=row, column=1, sticky="nsew")
-		row += 1
+	RAMArea.Render()
 
 def UpdateUI():
 	UpdateRegisters()
@@ -229,7 +676,17 @@ def UpdateUI():
 	UpdateStack()
 	UpdateRAM()
 
-for file in argv[1:len(argv)]:
-	ImportFile(file)
+nextArg = None
+for arg in argv[1:len(argv)]:
+	if arg == "--slice" or arg == "--journal":
+		nextArg = arg
+	elif nextArg == "--slice":
+		_TimeSlice = float(arg) / 1000
+		nextArg = None
+	elif nextArg == "--journal":
+		_JournalSize = int(arg)
+		nextArg = None
+	else:
+		ImportFile(arg)
 
 root.mainloop()
\ No newline at end of file
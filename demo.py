@@ -34,4 +34,4 @@ outputFile = "./build/output." + ext
 import os
 os.makedirs(os.path.dirname(outputFile), exist_ok=True)
 with open(outputFile, "w") as file:
-    file.write(str(emitter))
\ No newline at end of file
+    emitter.CompileTo(file)
\ No newline at end of file
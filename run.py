@@ -0,0 +1,161 @@
+from urcl import *
+from urclckpt import SaveCheckpoint, LoadCheckpoint
+import sys
+import time
+
+SLICE_SIZE = 65536
+
+EXIT_HALTED = 0
+EXIT_ERROR = 1
+EXIT_BUDGET = 2
+EXIT_TIMEOUT = 3
+
+class ModuleMachine:
+	def __init__(self, file):
+		self.Module = {}
+		with open(file) as stream:
+			exec(stream.read(), self.Module)
+		self.RAM = self.Module["RAM"]
+		self.STACK = self.Module["STACK"]
+
+	@property
+	def StackDepth(self):
+		return -self.Module["SP_MIN"]
+
+	@property
+	def HALT(self):
+		return self.Module["HALT"]
+
+	@property
+	def BREAK(self):
+		return self.Module["BREAK"]
+
+	def Execute(self, limit):
+		return self.Module["Execute"](limit)
+
+def GetCheckpointTarget(machine):
+	if isinstance(machine, ModuleMachine):
+		return machine.Module
+	return machine
+
+def LoadMachine(file):
+	if file.lower().endswith(".urcl"):
+		from urclvm import Machine
+		emitter = Emitter()
+		with open(file) as stream:
+			for lineNumber, inst in ParseStream(stream):
+				if emitter.IsLabel(inst):
+					emitter.MarkLabel(inst)
+				else:
+					emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+		return Machine(emitter)
+	elif file.lower().endswith(".urclb"):
+		from urclbin import BinaryMachine
+		return BinaryMachine(file)
+	elif file.lower().endswith(".py"):
+		return ModuleMachine(file)
+	print("ERROR: File format of \"" + file + "\" is not supported.")
+	exit(EXIT_ERROR)
+
+def GetStackDepth(machine):
+	#Generated modules track the lowest stack pointer, the VM stack list only ever grows to the deepest word written.
+	if isinstance(machine, ModuleMachine):
+		return machine.StackDepth
+	return len(machine.STACK)
+
+def GetRAMWords(ram):
+	if isinstance(ram, dict):
+		return len(ram)
+	return len(ram) - list(ram).count(0)
+
+def Run(machine, budget=None, timeout=None, checkpoint=None, checkpointInterval=None):
+	executed = 0
+	breaks = 0
+	status = "halted"
+	saved = 0
+	start = time.perf_counter()
+	while not machine.HALT:
+		if checkpoint != None and checkpointInterval != None and executed - saved >= checkpointInterval:
+			SaveCheckpoint(GetCheckpointTarget(machine), checkpoint)
+			saved = executed
+		limit = SLICE_SIZE
+		if budget != None:
+			if executed >= budget:
+				status = "budget"
+				break
+			limit = min(limit, budget - executed)
+		if timeout != None and time.perf_counter() - start >= timeout:
+			status = "timeout"
+			break
+		try:
+			executed += machine.Execute(limit)
+		except Exception as error:
+			print("ERROR: " + str(error))
+			status = "error"
+			break
+		#BRK only pauses the debugger, so a headless run counts it and continues.
+		if machine.BREAK:
+			breaks += 1
+	if checkpoint != None and status != "error":
+		SaveCheckpoint(GetCheckpointTarget(machine), checkpoint)
+	return (status, executed, breaks, time.perf_counter() - start)
+
+if __name__ == "__main__":
+	args = sys.argv[1:len(sys.argv)]
+
+	inputs = []
+	budget = None
+	timeout = None
+	checkpoint = None
+	checkpointInterval = None
+	resume = None
+	nextArg = None
+	for arg in args:
+		if arg.startswith("-"):
+			nextArg = None
+			if arg == "--max-instructions" or arg == "--timeout" or arg == "--checkpoint" or arg == "--checkpoint-every" or arg == "--resume":
+				nextArg = arg
+			else:
+				print("Unknown command line option: " + arg)
+				exit(EXIT_ERROR)
+		elif nextArg == "--max-instructions":
+			budget = int(arg)
+			nextArg = None
+		elif nextArg == "--timeout":
+			timeout = float(arg)
+			nextArg = None
+		elif nextArg == "--checkpoint":
+			checkpoint = arg
+			nextArg = None
+		elif nextArg == "--checkpoint-every":
+			checkpointInterval = int(arg)
+			nextArg = None
+		elif nextArg == "--resume":
+			resume = arg
+			nextArg = None
+		else:
+			inputs += [arg]
+
+	if len(inputs) != 1:
+		print("Usage: python run.py input.urcl [--max-instructions N] [--timeout SECONDS] [--checkpoint FILE] [--checkpoint-every N] [--resume FILE]")
+		exit(EXIT_ERROR)
+
+	machine = LoadMachine(inputs[0])
+	if resume != None:
+		try:
+			LoadCheckpoint(GetCheckpointTarget(machine), resume)
+		except (OSError, ValueError) as error:
+			print("ERROR: " + str(error))
+			exit(EXIT_ERROR)
+	status, executed, breaks, elapsed = Run(machine, budget, timeout, checkpoint, checkpointInterval)
+	rate = 0
+	if elapsed > 0:
+		rate = int(executed / elapsed)
+	print("status=" + status + " instructions=" + str(executed) + " seconds=" + str(round(elapsed, 3)) + " instructions/sec=" + str(rate) + \
+		" breaks=" + str(breaks) + " peak_stack=" + str(GetStackDepth(machine)) + " ram_words=" + str(GetRAMWords(machine.RAM)))
+	if status == "budget":
+		exit(EXIT_BUDGET)
+	elif status == "timeout":
+		exit(EXIT_TIMEOUT)
+	elif status == "error":
+		exit(EXIT_ERROR)
@@ -1,3 +1,8 @@
+import functools
+import gc
+import os
+import sys
+
 SP = "SP"
 ZERO = "R0"
 
@@ -42,6 +47,54 @@ BLE = "BLE"
 BRG = "BRG"
 BGE = "BGE"
 
+BRANCHES = [JMP, BRZ, BNZ, BRE, BNE, BRL, BLE, BRG, BGE]
+TERMINATORS = BRANCHES + [CAL, RET, HLT, BRK]
+
+OPERAND_NONE = 0
+OPERAND_REGISTER = 1
+OPERAND_IMMEDIATE = 2
+OPERAND_LABEL = 3
+
+#Classified operands are cached, but only the most recently used ones so long-running processes don't grow without limit.
+OPERAND_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=OPERAND_CACHE_SIZE)
+def _ClassifyOperand(value):
+	if value == SP or (len(value) > 1 and value[0] == "R" and value[1:len(value)].isdigit()):
+		return (sys.intern(value), OPERAND_REGISTER)
+	elif len(value) > 1 and value[0] == "." and not " " in value:
+		return (sys.intern(value), OPERAND_LABEL)
+	try:
+		return (int(value, 0), OPERAND_IMMEDIATE)
+	except ValueError:
+		try:
+			return (int(value), OPERAND_IMMEDIATE)
+		except ValueError:
+			return (sys.intern(value), OPERAND_IMMEDIATE)
+
+def _LookupOperand(value):
+	if not isinstance(value, str):
+		return (value, OPERAND_IMMEDIATE)
+	return _ClassifyOperand(value)
+
+def InternOperand(value):
+	"""Get the shared, classified form of an operand. Registers and labels become interned strings and numeric strings become integers."""
+	if value == None:
+		return None
+	return _LookupOperand(value)[0]
+
+def GetOperandKind(value):
+	"""Get the OPERAND_* kind of an operand."""
+	if value == None:
+		return OPERAND_NONE
+	return _LookupOperand(value)[1]
+
+def GetRegisterIndex(value):
+	"""Get the index of a register operand. The stack pointer has index -1."""
+	if value == SP:
+		return -1
+	return int(value[1:len(value)])
+
 class Class:
 	"""Represents a compile-time class."""
 	def __init__(self, name="className", parentClass=None, fields=[], sealed=False):
@@ -119,11 +172,13 @@ class RegisterMap:
 
 class Instruction:
 	"""Represents an URCL instruction."""
+	__slots__ = ("Operation", "OperandA", "OperandB", "OperandC")
+
 	def __init__(self, operation="NOP", operandA=None, operandB=None, operandC=None):
-		self.Operation = operation
-		self.OperandA = operandA
-		self.OperandB = operandB
-		self.OperandC = operandC
+		self.Operation = sys.intern(operation)
+		self.OperandA = InternOperand(operandA)
+		self.OperandB = InternOperand(operandB)
+		self.OperandC = InternOperand(operandC)
 	
 	def GetOperandCount(self):
 		"""Get the number of operands in this instruction."""
@@ -147,60 +202,224 @@ class Instruction:
 		else:
 			return [self.OperandA, self.OperandB, self.OperandC]
 	
+	def GetOperandKinds(self):
+		"""Get a list of the OPERAND_* kinds of the operands in this instruction."""
+		return [GetOperandKind(operand) for operand in self.GetOperands()]
+
 	def __str__(self):
 		"""Convert the instruction to a string."""
 		if self.OperandA == None:
 			return self.Operation
-		elif self.OperandB == None:
-			return self.Operation + " " + str(self.OperandA)
-		elif self.OperandC == None:
-			return self.Operation + " " + str(self.OperandA) + " " + str(self.OperandB)
-		else:
-			return self.Operation + " " + str(self.OperandA) + " " + str(self.OperandB) + " " + str(self.OperandC)
+		return self.Operation + " " + " ".join([str(operand) for operand in self.GetOperands()])
+
+class FrozenInstruction(Instruction):
+	"""Represents an URCL instruction that can't be modified."""
+	__slots__ = ()
+
+	def __init__(self, operation="NOP", operandA=None, operandB=None, operandC=None):
+		object.__setattr__(self, "Operation", sys.intern(operation))
+		object.__setattr__(self, "OperandA", InternOperand(operandA))
+		object.__setattr__(self, "OperandB", InternOperand(operandB))
+		object.__setattr__(self, "OperandC", InternOperand(operandC))
+
+	def __setattr__(self, name, value):
+		raise AttributeError("Program instructions can't be modified.")
+
+	def __reduce__(self):
+		return (FrozenInstruction, (self.Operation, self.OperandA, self.OperandB, self.OperandC))
+
+_SetOperation = Instruction.Operation.__set__
+_SetOperandA = Instruction.OperandA.__set__
+_SetOperandB = Instruction.OperandB.__set__
+_SetOperandC = Instruction.OperandC.__set__
+
+def FreezeInstruction(inst):
+	"""Get a read-only copy of an instruction. The operands are already interned, so they are shared."""
+	frozen = object.__new__(FrozenInstruction)
+	_SetOperation(frozen, inst.Operation)
+	_SetOperandA(frozen, inst.OperandA)
+	_SetOperandB(frozen, inst.OperandB)
+	_SetOperandC(frozen, inst.OperandC)
+	return frozen
+
+class Program:
+	"""A read-only snapshot of an emitter's instructions and labels, with label positions and registers resolved. Emit targets compile from this."""
+	def __init__(self, emitter):
+		#Collections triggered by the many small allocations cost more than the copy itself.
+		collecting = gc.isenabled()
+		gc.disable()
+		try:
+			self.Instructions = tuple([FreezeInstruction(inst) for inst in emitter.Instructions])
+		finally:
+			if collecting:
+				gc.enable()
+		self.Labels = {}
+		self.LabelPositions = {}
+		for position in emitter.Labels:
+			self.Labels[position] = tuple(emitter.Labels[position])
+			for label in emitter.Labels[position]:
+				self.LabelPositions[label] = position
+		operands = dict.fromkeys([operand for inst in self.Instructions for operand in (inst.OperandA, inst.OperandB, inst.OperandC)])
+		self.Registers = tuple([operand for operand in operands if operand != ZERO and GetOperandKind(operand) == OPERAND_REGISTER])
+
+	def GetProgram(self):
+		"""Get the program. A program is already read-only."""
+		return self
+
+class TextWriter:
+	"""Collects emitted text in chunks. Text is flushed to the stream when one is given, otherwise it is kept until GetText is called."""
+	def __init__(self, stream=None, chunkSize=65536):
+		self._Stream = stream
+		self._ChunkSize = chunkSize
+		self._Chunks = []
+		self._Size = 0
+
+	def Write(self, text):
+		"""Write text to the writer."""
+		self._Chunks.append(text)
+		self._Size += len(text)
+		if self._Stream != None and self._Size >= self._ChunkSize:
+			self.Flush()
+
+	def Flush(self):
+		"""Write any buffered text to the stream."""
+		if self._Stream != None and len(self._Chunks) > 0:
+			self._Stream.write("".join(self._Chunks))
+			self._Chunks = []
+			self._Size = 0
+
+	def GetText(self):
+		"""Get all of the text written so far."""
+		return "".join(self._Chunks)
 
 class URCLEmit:
 	"""The default emitter target type. Outputs emitter instructions as plain URCL."""
+	def EmitTo(self, emitter, writer):
+		labels = emitter.Labels
+		position = 0
+		for inst in emitter.Instructions:
+			if position in labels:
+				for label in labels[position]:
+					writer.Write(str(label) + "\n")
+			writer.Write(str(inst) + "\n")
+			position += 1
+		if position in labels:
+			for label in labels[position]:
+				writer.Write(str(label) + "\n")
+
 	def Emit(self, emitter):
-		result = ""
-		for i in range(len(emitter.Instructions)):
-			if i in emitter.Labels:
-				for j in range(len(emitter.Labels[i])):
-					result += str(emitter.Labels[i][j]) + "\n"
-			result += str(emitter.Instructions[i]) + "\n"
-		if len(emitter.Instructions) in emitter.Labels:
-			for i in range(len(emitter.Labels[len(emitter.Instructions)])):
-				result += str(emitter.Labels[len(emitter.Instructions)][i]) + "\n"
-		return result
+		writer = TextWriter()
+		self.EmitTo(emitter, writer)
+		return writer.GetText()
 
 DEFAULT_TARGET = URCLEmit()
 
+_WorkerProgram = None
+
+def _SetWorkerProgram(program):
+	global _WorkerProgram
+	_WorkerProgram = program
+
+def _EmitWorkerProgram(target):
+	return target.Emit(_WorkerProgram)
+
+def CompileTargets(emitter, targets, maxWorkers=None):
+	"""Compile an emitter or program for several emit targets in parallel worker processes, or in this process when only one worker can run. Returns the output of each target in order."""
+	from concurrent.futures import ProcessPoolExecutor
+	program = emitter.GetProgram()
+	if maxWorkers == None:
+		maxWorkers = min(len(targets), os.cpu_count() or 1)
+	#Starting workers and sending them the program only pays off when they can run at the same time.
+	if maxWorkers <= 1:
+		return [target.Emit(program) for target in targets]
+	with ProcessPoolExecutor(maxWorkers, initializer=_SetWorkerProgram, initargs=(program,)) as pool:
+		return list(pool.map(_EmitWorkerProgram, targets))
+
+def _TokenizeLine(text):
+	end = text.find("//")
+	if end >= 0:
+		text = text[0:end]
+	return text.replace(",", " ").split()
+
+def _ParseTokens(tokens):
+	if len(tokens) <= 0:
+		return None
+	if len(tokens) == 1 and tokens[0].startswith("."):
+		return tokens[0]
+	while len(tokens) < 4:
+		tokens.append(None)
+	return Instruction(tokens[0].upper(), tokens[1], tokens[2], tokens[3])
+
 def ParseInstruction(text):
 	"""Parse an URCL instruction from a string. Returns None is the instruction is a comment or empty line."""
-	text = str(text).strip()
-	if len(text) <= 0:
-		return None
-	if text.startswith("//"):
-		return None
-	if text.startswith(".") and not (' ' in text):
-		return text
-	text = text.replace(",", " ").replace("//", " //").replace("  ", " ").split(" ")
-	comment = False
-	for i in range(4):
-		if i >= len(text):
-			text.append(None)
-		elif text[i].startswith("//") or comment:
-			text[i] = None
-			comment = True
-	return Instruction(text[0].upper(), text[1], text[2], text[3])
+	return _ParseTokens(_TokenizeLine(str(text)))
+
+def ParseStream(stream):
+	"""Parse URCL from a file object or memory-mapped buffer one line at a time. Yields (lineNumber, value) pairs where value is a label or an instruction."""
+	readline = stream.readline
+	lineNumber = 0
+	line = readline()
+	decode = isinstance(line, bytes)
+	while line:
+		lineNumber += 1
+		if decode:
+			line = line.decode()
+		value = _ParseTokens(_TokenizeLine(line))
+		if value != None:
+			yield (lineNumber, value)
+		line = readline()
+
+MEMORY_MANAGER_FIRST_FIT = "firstfit"
+MEMORY_MANAGER_FREE_LIST = "freelist"
+FREE_LIST_EXACT_SIZES = 12
+FREE_LIST_BINS = 24
+
+def GetBasicBlocks(instructions, labels):
+	"""Split instructions into basic blocks at label positions, jump targets and after control transfers. Returns a list of (start, end) position pairs."""
+	leaders = set(labels)
+	leaders.add(0)
+	for position in range(len(instructions)):
+		inst = instructions[position]
+		if inst.Operation in TERMINATORS:
+			leaders.add(position + 1)
+			if isinstance(inst.OperandA, int):
+				leaders.add(inst.OperandA)
+	leaders = sorted([leader for leader in leaders if 0 <= leader < len(instructions)])
+	blocks = []
+	for i in range(len(leaders)):
+		if i + 1 < len(leaders):
+			blocks.append((leaders[i], leaders[i + 1]))
+		else:
+			blocks.append((leaders[i], len(instructions)))
+	return blocks
+
+class _InlineFrame:
+	#The arguments and locals of a function body that is being inlined into a call site.
+	def __init__(self, label):
+		self.Label = label
+		self.Arguments = []
+		self.Locals = {}
+		self.Registers = []
+
+	def GetLocal(self, emitter, localIndex):
+		if not localIndex in self.Locals:
+			self.Locals[localIndex] = emitter.NewRegister()
+			self.Registers.append(self.Locals[localIndex])
+		return self.Locals[localIndex]
 
 class Emitter:
 	"""An emitter for URCL instructions."""
-	def __init__(self, emitTarget=DEFAULT_TARGET, useR1AsBasePointer=False, memoryManagerMinAddress=0, memoryManagerMaxAddress=18446744073709551615, inlineMemoryManagement=True):
+	def __init__(self, emitTarget=DEFAULT_TARGET, useR1AsBasePointer=False, memoryManagerMinAddress=0, memoryManagerMaxAddress=18446744073709551615, inlineMemoryManagement=True, memoryManager=MEMORY_MANAGER_FIRST_FIT, inlineFunctionSize=None):
 		self.Instructions = []
 		self.Labels = {}
 		self._Registers = RegisterMap()
 		self._EmitterTarget = emitTarget
 
+		self._Functions = {}
+		self._InlineFunctionSize = inlineFunctionSize
+		self._InlineFrames = []
+		self.InlinedCalls = 0
+
 		if useR1AsBasePointer:
 			self.BP = self._Registers.New()
 		else:
@@ -221,7 +440,9 @@ class Emitter:
 		self._MemoryManagerRegister = None
 		self._PushRegistersOnMemManage = False
 
-		if not inlineMemoryManagement:
+		if memoryManager == MEMORY_MANAGER_FREE_LIST:
+			self._EmitFreeListManager()
+		elif not inlineMemoryManagement:
 			self._InlineMemoryManagement = True
 			self._PushRegistersOnMemManage = True
 
@@ -245,6 +466,236 @@ class Emitter:
 
 			self._InlineMemoryManagement = False
 
+	def _EmitFreeListManager(self):
+		"""Emit a shared allocator with size-segregated free lists and coalescing of neighbouring free blocks."""
+		#Layout: one list head per size class, then the top of the heap, then the blocks.
+		#Each block has a header and footer of (size << 1) | inUse, free blocks keep next/prev links after the header.
+		binBase = self._MemoryManagerMinAddress
+		topAddress = binBase + FREE_LIST_BINS
+		heapStart = topAddress + 1
+
+		entryPoint = self.NewLabel()
+		self._MemoryManagerAllocate = self.NewLabel()
+		self._MemoryManagerFree = self.NewLabel()
+		self._MemoryManagerRegister = self.NewRegister()
+		getBin = self.NewLabel()
+		unlink = self.NewLabel()
+		insert = self.NewLabel()
+
+		#These registers are reserved for the allocator, so the routines don't need to save them.
+		size = self.NewRegister()
+		bin = self.NewRegister()
+		block = self.NewRegister()
+		blockSize = self.NewRegister()
+		temp = self.NewRegister()
+		next = self.NewRegister()
+		previous = self.NewRegister()
+		binSize = self.NewRegister()
+		binIndex = self.NewRegister()
+
+		self.Emit(STR, topAddress, heapStart)
+		self.Emit(JMP, entryPoint)
+
+		#Allocate: size in, pointer out.
+		binLoop = self.NewLabel()
+		blockLoop = self.NewLabel()
+		nextBin = self.NewLabel()
+		found = self.NewLabel()
+		noSplit = self.NewLabel()
+		markUsed = self.NewLabel()
+		bump = self.NewLabel()
+		outOfMemory = self.NewLabel()
+		minimumSize = self.NewLabel()
+		self.MarkLabel(self._MemoryManagerAllocate)
+		#Blocks need room for the links once freed, plus the header and footer.
+		self.Emit(MOV, size, self._MemoryManagerRegister)
+		self.Emit(BGE, minimumSize, size, 2)
+		self.Emit(IMM, size, 2)
+		self.MarkLabel(minimumSize)
+		self.Emit(ADD, size, size, 2)
+		self.Emit(MOV, binSize, size)
+		self.Emit(CAL, getBin)
+		self.Emit(MOV, bin, binIndex)
+		self.MarkLabel(binLoop)
+		self.Emit(ADD, temp, bin, binBase)
+		self.Emit(LOD, block, temp)
+		self.MarkLabel(blockLoop)
+		#If the list is exhausted, try the next size class.
+		self.Emit(BRZ, nextBin, block)
+		self.Emit(LOD, blockSize, block)
+		self.Emit(RSH, blockSize, blockSize)
+		self.Emit(BGE, found, blockSize, size)
+		self.Emit(ADD, temp, block, 1)
+		self.Emit(LOD, block, temp)
+		self.Emit(JMP, blockLoop)
+		self.MarkLabel(nextBin)
+		self.Emit(INC, bin, bin)
+		self.Emit(BRL, binLoop, bin, FREE_LIST_BINS)
+		self.Emit(JMP, bump)
+
+		self.MarkLabel(found)
+		self.Emit(CAL, unlink)
+		#The size class is no longer needed, keep the block address in its register.
+		self.Emit(MOV, bin, block)
+		#If the remainder can hold a block, split it off and put it back on a free list.
+		self.Emit(SUB, blockSize, blockSize, size)
+		self.Emit(BRL, noSplit, blockSize, 4)
+		self.Emit(ADD, block, bin, size)
+		self.Emit(CAL, insert)
+		self.Emit(MOV, blockSize, size)
+		self.Emit(JMP, markUsed)
+		self.MarkLabel(noSplit)
+		self.Emit(ADD, blockSize, blockSize, size)
+		self.Emit(JMP, markUsed)
+
+		self.MarkLabel(bump)
+		#No free block fits, take a new one from the top of the heap.
+		self.Emit(LOD, bin, topAddress)
+		self.Emit(ADD, temp, bin, size)
+		self.Emit(DEC, blockSize, temp)
+		self.Emit(BRG, outOfMemory, blockSize, self._MemoryManagerMaxAddress)
+		self.Emit(STR, topAddress, temp)
+		self.Emit(MOV, blockSize, size)
+
+		self.MarkLabel(markUsed)
+		self.Emit(LSH, temp, blockSize)
+		self.Emit(OR, temp, temp, 1)
+		self.Emit(STR, bin, temp)
+		self.Emit(ADD, next, bin, blockSize)
+		self.Emit(DEC, next, next)
+		self.Emit(STR, next, temp)
+		self.Emit(ADD, self._MemoryManagerRegister, bin, 1)
+		self.Emit(RET)
+
+		self.MarkLabel(outOfMemory)
+		self.Emit(MOV, self._MemoryManagerRegister, ZERO)
+		self.Emit(RET)
+
+		#Free: pointer in.
+		freeFinish = self.NewLabel()
+		skipNext = self.NewLabel()
+		skipPrevious = self.NewLabel()
+		keepTop = self.NewLabel()
+		self.MarkLabel(self._MemoryManagerFree)
+		#If pointer is null, ignore.
+		self.Emit(BRZ, freeFinish, self._MemoryManagerRegister)
+		self.Emit(SUB, size, self._MemoryManagerRegister, 1)
+		self.Emit(LOD, bin, size)
+		self.Emit(RSH, bin, bin)
+		#Merge with the following block if it is free.
+		self.Emit(ADD, block, size, bin)
+		self.Emit(LOD, temp, topAddress)
+		self.Emit(BRE, skipNext, block, temp)
+		self.Emit(LOD, temp, block)
+		self.Emit(AND, next, temp, 1)
+		self.Emit(BNZ, skipNext, next)
+		self.Emit(RSH, temp, temp)
+		self.Emit(ADD, bin, bin, temp)
+		self.Emit(CAL, unlink)
+		self.MarkLabel(skipNext)
+		#Merge with the preceding block if it is free, using its footer.
+		self.Emit(BRE, skipPrevious, size, heapStart)
+		self.Emit(SUB, block, size, 1)
+		self.Emit(LOD, temp, block)
+		self.Emit(AND, next, temp, 1)
+		self.Emit(BNZ, skipPrevious, next)
+		self.Emit(RSH, temp, temp)
+		self.Emit(SUB, size, size, temp)
+		self.Emit(ADD, bin, bin, temp)
+		self.Emit(MOV, block, size)
+		self.Emit(CAL, unlink)
+		self.MarkLabel(skipPrevious)
+		#If the block now ends at the top of the heap, give it back to the heap.
+		self.Emit(ADD, block, size, bin)
+		self.Emit(LOD, temp, topAddress)
+		self.Emit(BNE, keepTop, block, temp)
+		self.Emit(STR, topAddress, size)
+		self.Emit(RET)
+		self.MarkLabel(keepTop)
+		self.Emit(MOV, block, size)
+		self.Emit(MOV, blockSize, bin)
+		self.Emit(CAL, insert)
+		self.MarkLabel(freeFinish)
+		self.Emit(RET)
+
+		#Size class of a block: exact for small blocks, then one list per power of two, clamped to the last list.
+		binCount = self.NewLabel()
+		binDone = self.NewLabel()
+		binFinish = self.NewLabel()
+		binLarge = self.NewLabel()
+		self.MarkLabel(getBin)
+		self.Emit(BGE, binLarge, binSize, FREE_LIST_EXACT_SIZES + 4)
+		self.Emit(SUB, binIndex, binSize, 4)
+		self.Emit(RET)
+		self.MarkLabel(binLarge)
+		self.Emit(IMM, binIndex, FREE_LIST_EXACT_SIZES - 1)
+		self.Emit(RSH, binSize, binSize)
+		self.Emit(RSH, binSize, binSize)
+		self.Emit(RSH, binSize, binSize)
+		self.Emit(RSH, binSize, binSize)
+		self.MarkLabel(binCount)
+		self.Emit(BRZ, binDone, binSize)
+		self.Emit(INC, binIndex, binIndex)
+		self.Emit(RSH, binSize, binSize)
+		self.Emit(JMP, binCount)
+		self.MarkLabel(binDone)
+		self.Emit(BRL, binFinish, binIndex, FREE_LIST_BINS)
+		self.Emit(IMM, binIndex, FREE_LIST_BINS - 1)
+		self.MarkLabel(binFinish)
+		self.Emit(RET)
+
+		#Unlink a free block from its list.
+		unlinkHead = self.NewLabel()
+		unlinkNext = self.NewLabel()
+		unlinkFinish = self.NewLabel()
+		self.MarkLabel(unlink)
+		self.Emit(ADD, temp, block, 1)
+		self.Emit(LOD, next, temp)
+		self.Emit(ADD, temp, block, 2)
+		self.Emit(LOD, previous, temp)
+		self.Emit(BRZ, unlinkHead, previous)
+		self.Emit(ADD, temp, previous, 1)
+		self.Emit(STR, temp, next)
+		self.Emit(JMP, unlinkNext)
+		self.MarkLabel(unlinkHead)
+		self.Emit(LOD, binSize, block)
+		self.Emit(RSH, binSize, binSize)
+		self.Emit(CAL, getBin)
+		self.Emit(ADD, temp, binIndex, binBase)
+		self.Emit(STR, temp, next)
+		self.MarkLabel(unlinkNext)
+		self.Emit(BRZ, unlinkFinish, next)
+		self.Emit(ADD, temp, next, 2)
+		self.Emit(STR, temp, previous)
+		self.MarkLabel(unlinkFinish)
+		self.Emit(RET)
+
+		#Mark a block free and push it onto the list for its size.
+		insertFinish = self.NewLabel()
+		self.MarkLabel(insert)
+		self.Emit(LSH, temp, blockSize)
+		self.Emit(STR, block, temp)
+		self.Emit(ADD, previous, block, blockSize)
+		self.Emit(DEC, previous, previous)
+		self.Emit(STR, previous, temp)
+		self.Emit(MOV, binSize, blockSize)
+		self.Emit(CAL, getBin)
+		self.Emit(ADD, temp, binIndex, binBase)
+		self.Emit(LOD, next, temp)
+		self.Emit(STR, temp, block)
+		self.Emit(ADD, previous, block, 1)
+		self.Emit(STR, previous, next)
+		self.Emit(ADD, previous, block, 2)
+		self.Emit(STR, previous, ZERO)
+		self.Emit(BRZ, insertFinish, next)
+		self.Emit(ADD, previous, next, 2)
+		self.Emit(STR, previous, block)
+		self.MarkLabel(insertFinish)
+		self.Emit(RET)
+
+		self.MarkLabel(entryPoint)
+		self._InlineMemoryManagement = False
+
 	def GetBasePointer(self):
 		"""Get or allocate a register designated as the stack base pointer."""
 		if self.BP == None:
@@ -267,16 +718,11 @@ class Emitter:
 	
 	def IsRegister(self, value):
 		"""Determine if a value is an URCL register."""
-		value = str(value)
-		if (len(value) > 0 and value[0] == "R") or value == "SP":
-			return True
-		else:
-			return False
+		return GetOperandKind(value) == OPERAND_REGISTER
 	
 	def IsLabel(self, value):
 		"""Determine if a value is an URCL label."""
-		value = str(value)
-		return len(value) > 0 and value[0] == "." and not " " in value
+		return GetOperandKind(value) == OPERAND_LABEL
 
 	def NewRegister(self):
 		"""Allocate a register for use."""
@@ -318,8 +764,8 @@ class Emitter:
 			self.Emit(RSH, length, length)
 			#If the in-use bit is set, go to the next block.
 			self.Emit(BNZ, searchLoop, value)
-			#If the block is too small, go to the next block.
-			self.Emit(BRL, searchLoop, length, inSize)
+			#If the block is too small, go to the next block. (The length includes the length field.)
+			self.Emit(BLE, searchLoop, length, inSize)
 			#Add the in-use bit to the length.
 			self.Emit(LSH, length, length)
 			self.Emit(OR, length, length, 1)
@@ -330,6 +776,8 @@ class Emitter:
 			self.Emit(JMP, finish)
 
 			self.MarkLabel(outOfMemory)
+			#Discard the size of the block pushed below.
+			self.Emit(POP, length)
 			self.Emit(MOV, outPointer, ZERO)
 			self.Emit(JMP, finish)
 
@@ -413,6 +861,72 @@ class Emitter:
 		"""Allocate a block of memory for the specified type."""
 		self.NewPointer(type.GetSize(), outPointer)
 
+	def NewArena(self, inSize=ZERO, outArena=ZERO):
+		"""Allocate an arena with room for the specified number of words. Objects are allocated from it in constant time and released together with ResetArena or FreeArena."""
+		finish = self.NewLabel()
+		size = self.NewRegister()
+		address = self.NewRegister()
+
+		#Reserve two words for the cursor and the limit.
+		self.Emit(ADD, size, inSize, 2)
+		self.NewPointer(size, outArena)
+		#If there isn't enough memory, return a null arena.
+		self.Emit(BRZ, finish, outArena)
+		#Set the limit to the end of the arena.
+		self.Emit(ADD, size, outArena, size)
+		self.Emit(ADD, address, outArena, 1)
+		self.Emit(STR, address, size)
+		#Set the cursor to the start of the arena's data.
+		self.Emit(ADD, size, outArena, 2)
+		self.Emit(STR, outArena, size)
+		self.MarkLabel(finish)
+
+		self.FreeRegister(size)
+		self.FreeRegister(address)
+
+	def ArenaAllocate(self, inArena=ZERO, inSize=ZERO, outPointer=ZERO):
+		"""Allocate a block of memory from an arena."""
+		outOfMemory = self.NewLabel()
+		finish = self.NewLabel()
+		cursor = self.NewRegister()
+		next = self.NewRegister()
+		limit = self.NewRegister()
+
+		#Get the current cursor and move it past the block.
+		self.Emit(LOD, cursor, inArena)
+		self.Emit(ADD, next, cursor, inSize)
+		#If the block doesn't fit below the limit, return a null pointer.
+		self.Emit(ADD, limit, inArena, 1)
+		self.Emit(LOD, limit, limit)
+		self.Emit(BRG, outOfMemory, next, limit)
+		#Update the cursor in memory.
+		self.Emit(STR, inArena, next)
+		self.Emit(MOV, outPointer, cursor)
+		self.Emit(JMP, finish)
+
+		self.MarkLabel(outOfMemory)
+		self.Emit(MOV, outPointer, ZERO)
+		self.MarkLabel(finish)
+
+		self.FreeRegister(cursor)
+		self.FreeRegister(next)
+		self.FreeRegister(limit)
+
+	def ArenaNewObject(self, inArena=ZERO, type=PENDING, outPointer=ZERO):
+		"""Allocate a block of memory for the specified type from an arena."""
+		self.ArenaAllocate(inArena, type.GetSize(), outPointer)
+
+	def ResetArena(self, inArena=ZERO):
+		"""Release every block allocated from an arena."""
+		cursor = self.NewRegister()
+		self.Emit(ADD, cursor, inArena, 2)
+		self.Emit(STR, inArena, cursor)
+		self.FreeRegister(cursor)
+
+	def FreeArena(self, inArena=ZERO):
+		"""Free an arena and every block allocated from it."""
+		self.FreePointer(inArena)
+
 	def Emit(self, operation="NOP", operandA=None, operandB=None, operandC=None):
 		"""Emit an URCL instruction with the specified operation and operands."""
 		self.Instructions.append(Instruction(operation, operandA, operandB, operandC))
@@ -421,11 +935,73 @@ class Emitter:
 		return 0
 
 	def CallFunction(self, label, emitArgsFunc=_CallFunctionDefaultArguments, emitArgsFuncArg=None, outCount=0):
-		"""Emit a function call that passes the arguments pushed onto the stack by the specified emitArgsFunc(emitter, emitArgsFuncArg), which returns the number of arguments that was pushed."""
+		"""Emit a function call that passes the arguments pushed onto the stack by the specified emitArgsFunc(emitter, emitArgsFuncArg), which returns the number of arguments that was pushed. Calls to functions with at most inlineFunctionSize body instructions are inlined when possible, and never when inlineFunctionSize is None."""
+		start = len(self.Instructions)
 		self.Emit(SUB, SP, SP, outCount)
 		inCount = emitArgsFunc(self, emitArgsFuncArg)
+		if self._InlineFunction(label, start, inCount, outCount):
+			return
 		self.Emit(CAL, label)
 		self.Emit(ADD, SP, SP, inCount)
+
+	def _InlineFunction(self, label, start, inCount, outCount):
+		"""Replace a call whose arguments were just pushed with a copy of the function body. Returns False and leaves the call untouched if the function can't be inlined."""
+		function = self._Functions.get(label)
+		if self._InlineFunctionSize == None or function == None or function[3] > self._InlineFunctionSize or label in [frame.Label for frame in self._InlineFrames]:
+			return False
+		pushes = self.Instructions[start + 1:len(self.Instructions)]
+		if len(pushes) != inCount:
+			return False
+		for position in range(start + 1, len(self.Instructions)):
+			if position in self.Labels:
+				return False
+		for inst in pushes:
+			if inst.Operation != PSH or inst.OperandA == SP:
+				return False
+		localCount, emitBodyFunc, emitBodyFuncArg, size = function
+		startLabels = self.Labels.get(start)
+		inlinedCalls = self.InlinedCalls
+		del self.Instructions[start:len(self.Instructions)]
+
+		#Arguments are copied to new registers, since the body may overwrite the registers they were pushed from.
+		if outCount != 0:
+			self.Emit(SUB, SP, SP, outCount)
+		frame = _InlineFrame(label)
+		for inst in pushes:
+			if self.IsRegister(inst.OperandA):
+				register = self.NewRegister()
+				self.Emit(MOV, register, inst.OperandA)
+				frame.Registers.append(register)
+				frame.Arguments.append(register)
+			else:
+				frame.Arguments.append(inst.OperandA)
+		bodyStart = len(self.Instructions)
+		returnLabel = self.NewLabel()
+		self._InlineFrames.append(frame)
+		emitBodyFunc(self, emitBodyFuncArg, returnLabel)
+		self._InlineFrames.pop()
+		self.MarkLabel(returnLabel)
+		for register in frame.Registers:
+			self.FreeRegister(register)
+
+		#A body that returns itself or uses the frame directly needs a real call.
+		#So does a body that still calls out, since the callee may reuse the registers holding its arguments and locals.
+		for inst in self.Instructions[bodyStart:len(self.Instructions)]:
+			if inst.Operation == RET or inst.Operation == CAL or self.BP in inst.GetOperands():
+				del self.Instructions[start:len(self.Instructions)]
+				for position in list(self.Labels):
+					if position > start:
+						del self.Labels[position]
+				if startLabels == None:
+					self.Labels.pop(start, None)
+				else:
+					self.Labels[start] = startLabels
+				self.Emit(SUB, SP, SP, outCount)
+				self.Instructions += pushes
+				self.InlinedCalls = inlinedCalls
+				return False
+		self.InlinedCalls += 1
+		return True
 	
 	def _EmitFunctionDefaultBody(self, arg, returnLabel):
 		return
@@ -437,7 +1013,9 @@ class Emitter:
 		self.Emit(MOV, self.GetBasePointer(), SP)
 		self.Emit(SUB, SP, SP, localCount)
 		returnLabel = self.NewLabel()
+		bodyStart = len(self.Instructions)
 		emitBodyFunc(self, emitBodyFuncArg, returnLabel)
+		self._Functions[label] = (localCount, emitBodyFunc, emitBodyFuncArg, len(self.Instructions) - bodyStart)
 		self.MarkLabel(returnLabel)
 		self.Emit(MOV, SP, self.GetBasePointer())
 		self.Emit(POP, self.GetBasePointer())
@@ -445,16 +1023,31 @@ class Emitter:
 	
 	def EmitGetArgument(self, argumentCount=0, argumentIndex=0, outValue=ZERO):
 		"""Get the value of the function argument with the specified total arguments and argument index."""
+		if len(self._InlineFrames) > 0:
+			arguments = self._InlineFrames[-1].Arguments
+			index = argumentIndex + len(arguments) - argumentCount
+			if 0 <= index < len(arguments):
+				if self.IsRegister(arguments[index]):
+					self.Emit(MOV, outValue, arguments[index])
+				else:
+					self.Emit(IMM, outValue, arguments[index])
+				return
 		self.Emit(ADD, outValue, self.GetBasePointer(), (argumentCount - argumentIndex) + 1)
 		self.Emit(LOD, outValue, outValue)
 	
 	def EmitGetLocal(self, localIndex=0, outValue=ZERO):
 		"""Get the value of the function local with the specified local index."""
+		if len(self._InlineFrames) > 0:
+			self.Emit(MOV, outValue, self._InlineFrames[-1].GetLocal(self, localIndex))
+			return
 		self.Emit(SUB, outValue, self.GetBasePointer(), localIndex)
 		self.Emit(LOD, outValue, outValue)
 	
 	def EmitSetLocal(self, localIndex=0, inValue=ZERO):
 		"""Set the value of the function local with the specified local index and value."""
+		if len(self._InlineFrames) > 0:
+			self.Emit(MOV, self._InlineFrames[-1].GetLocal(self, localIndex), inValue)
+			return
 		localPointer = self.NewRegister()
 		self.Emit(SUB, localPointer, self.GetBasePointer(), localIndex)
 		self.Emit(STR, localPointer, inValue)
@@ -465,7 +1058,7 @@ class Emitter:
 		fieldPointer = self.NewRegister()
 		self.Emit(ADD, fieldPointer, inPointer, fieldIndex)
 		self.Emit(LOD, outValue, fieldPointer)
-		self.FreePointer(fieldPointer)
+		self.FreeRegister(fieldPointer)
 	
 	def EmitSetObjectField(self, inPointer=ZERO, fieldIndex=0, inValue=ZERO):
 		"""Set the value of the object field with the specified pointer and field index."""
@@ -474,10 +1067,27 @@ class Emitter:
 		self.Emit(STR, fieldPointer, inValue)
 		self.FreeRegister(fieldPointer)
 
-	def Compile(self):
-		"""Compile the emitter instructions with the emitter target."""
-		return str(self)
+	def GetProgram(self):
+		"""Get a read-only snapshot of the emitted instructions and labels."""
+		return Program(self)
+
+	def Compile(self, emitTarget=None):
+		"""Compile the emitter instructions with the emitter target, or another target."""
+		if emitTarget == None:
+			emitTarget = self._EmitterTarget
+		return emitTarget.Emit(self)
+
+	def CompileTo(self, stream, emitTarget=None):
+		"""Compile the emitter instructions with the emitter target, or another target, and write the result to a stream."""
+		if emitTarget == None:
+			emitTarget = self._EmitterTarget
+		if hasattr(emitTarget, "EmitTo"):
+			writer = TextWriter(stream)
+			emitTarget.EmitTo(self, writer)
+			writer.Flush()
+		else:
+			stream.write(emitTarget.Emit(self))
 
 	def __str__(self):
 		"""Compile the emitter instructions with the emitter target."""
-		return self._EmitterTarget.Emit(self)
\ No newline at end of file
+		return self.Compile()
\ No newline at end of file
@@ -1,3 +1,6 @@
+from urcl import ZERO, OPERAND_LABEL, OPERAND_REGISTER, GetOperandKind, GetRegisterIndex
+from urclopt import GetLoopDepths
+
 NextLabelID = 0
 
 def NewLabel():
@@ -32,6 +35,17 @@ SP = "sp"
 
 REGISTERS = [AX, BX, CX, DX, SI, DI, BP, SP]
 
+#Machine registers the macros never touch, so URCL registers can live in them.
+PINNED_REGISTERS = [SI, DI, CX, BP]
+PINNED_REGISTERS_64 = ["r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15"]
+
+def GetMachineRegister(reg, bits):
+	if not reg in REGISTERS or bits == 16:
+		return reg
+	elif bits == 32:
+		return "e" + reg
+	return "r" + reg
+
 REG_SP = REF("REG_SP")
 
 ARGA = "%1"
@@ -70,6 +84,12 @@ JBE = "jbe"
 
 MEMORYOFFSET = NewLabel()
 
+#URCL operations that are emitted as a single x86 operation when their target is a pinned register.
+PINNED_OPERATIONS = {"ADD": ADD, "SUB": SUB, "AND": AND, "OR": OR, "XOR": XOR}
+PINNED_COMMUTATIVE = ["ADD", "AND", "OR", "XOR"]
+PINNED_UNARY = {"INC": (ADD, 1), "DEC": (SUB, 1), "LSH": (SHL, 1), "RSH": (SHR, 1)}
+PINNED_BRANCHES = {"BRZ": JZ, "BNZ": JNZ}
+
 class I86:
 	def __init__(self, op=NOP, a=None, b=None):
 		self.Operation = op
@@ -360,20 +380,26 @@ MACRO_HLT = Macro("URCL_HLT", 0, [
 ])
 
 class X86Emit:
-	def __init__(self, bits=32, useSections=False, expandMacros=False):
+	def __init__(self, bits=32, useSections=False, expandMacros=False, pinRegisters=False):
 		self.Macros = {}
-		self.Instructions = []
-		self.Registers = ["REG_SP"]
-		self.Labels = {}
-		self.NextLabelID = 0
+		self.Reset()
 		self.Bits = bits
 		self.UseSections = useSections
 		self.ExpandMacros = expandMacros
+		self.PinRegisters = pinRegisters
 		vars = globals()
 		for key in vars:
 			if key.startswith("MACRO_") and len(key) > 6:
 				self.Macros[key[6:len(key)]] = vars[key]
 	
+	def Reset(self):
+		self.Instructions = []
+		self.Registers = ["REG_SP"]
+		self.Labels = {}
+		self.NextLabelID = 0
+		self.PinnedRegisters = {}
+		self.InstructionStarts = []
+
 	def FormatLabel(self, label):
 		if label.startswith("."):
 			label = label[1:len(label)]
@@ -408,14 +434,58 @@ class X86Emit:
 			return "db"
 	
 	def IsRegister(self, value):
-		if value == None:
-			return False
-		value = str(value)
-		if value.startswith("R") or value == "SP":
-			return value != "R0"
+		return value != ZERO and GetOperandKind(value) == OPERAND_REGISTER
 	
 	def IsLabel(self, value):
-		return value != None and str(value).startswith(".")
+		return GetOperandKind(value) == OPERAND_LABEL
+
+	def GetPinnableRegisters(self):
+		if self.Bits == 64:
+			return [GetMachineRegister(reg, self.Bits) for reg in PINNED_REGISTERS] + PINNED_REGISTERS_64
+		return [GetMachineRegister(reg, self.Bits) for reg in PINNED_REGISTERS]
+
+	def PinHotRegisters(self, emitter):
+		#Registers used inside loops are weighted like the register allocator does, and the heaviest ones get machine registers.
+		depths = GetLoopDepths(emitter)
+		weights = {}
+		for i in range(len(emitter.Instructions)):
+			for operand in emitter.Instructions[i].GetOperands():
+				if self.IsRegister(operand) and GetRegisterIndex(operand) > 0:
+					weights[operand] = weights.get(operand, 0) + 10 ** min(depths[i], 6)
+		hot = sorted(weights, key=lambda reg: (-weights[reg], GetRegisterIndex(reg)))
+		machineRegisters = self.GetPinnableRegisters()
+		for i in range(min(len(hot), len(machineRegisters))):
+			self.PinnedRegisters[hot[i]] = machineRegisters[i]
+		#Machine registers don't start at zero like the REG_ words do.
+		for reg in self.PinnedRegisters.values():
+			self.Instructions += [I86(XOR, reg, reg)]
+
+	def EmitPinnedInstruction(self, op, operands):
+		a = operands[0]
+		if op == "MOV" or op == "IMM":
+			self.Instructions += [I86(MOV, a, operands[1])]
+		elif op in PINNED_OPERATIONS:
+			b = operands[1]
+			c = operands[2]
+			if b == a:
+				self.Instructions += [I86(PINNED_OPERATIONS[op], a, c)]
+			elif c != a:
+				self.Instructions += [I86(MOV, a, b), I86(PINNED_OPERATIONS[op], a, c)]
+			elif op in PINNED_COMMUTATIVE:
+				self.Instructions += [I86(PINNED_OPERATIONS[op], a, b)]
+			else:
+				return False
+		elif op in PINNED_UNARY:
+			if operands[1] != a:
+				self.Instructions += [I86(MOV, a, operands[1])]
+			self.Instructions += [I86(PINNED_UNARY[op][0], a, PINNED_UNARY[op][1])]
+		elif op == "NOT":
+			if operands[1] != a:
+				self.Instructions += [I86(MOV, a, operands[1])]
+			self.Instructions += [I86(NOT, a)]
+		else:
+			return False
+		return True
 
 	def EmitURCLInstruction(self, inst):
 		operands = []
@@ -423,7 +493,9 @@ class X86Emit:
 			if operand == None:
 				break
 			operand = str(operand)
-			if self.IsRegister(operand):
+			if operand in self.PinnedRegisters:
+				operand = self.PinnedRegisters[operand]
+			elif self.IsRegister(operand):
 				operand = "REG_" + operand
 				if not operand in self.Registers:
 					self.Registers += [operand]
@@ -432,6 +504,15 @@ class X86Emit:
 				operand = self.FormatLabel(operand)
 			operands += [operand]
 
+		#Instructions on pinned registers use them directly instead of going through ax.
+		pinned = self.PinnedRegisters.values()
+		if inst.Operation in self.Macros and self.Macros[inst.Operation].ArgumentCount == len(operands) and len(operands) > 0 and len(pinned) > 0:
+			if operands[0] in pinned and self.EmitPinnedInstruction(inst.Operation, operands):
+				return
+			if inst.Operation in PINNED_BRANCHES and operands[1] in pinned and self.IsLabel(inst.OperandA):
+				self.Instructions += [I86(CMP, operands[1], 0), I86(PINNED_BRANCHES[inst.Operation], operands[0])]
+				return
+
 		if inst.Operation in self.Macros:
 			macro = self.Macros[inst.Operation]
 			if macro.ArgumentCount == len(operands):
@@ -442,11 +523,16 @@ class X86Emit:
 			print("ERROR: " + str(inst.Operation) + " is not a valid instruction.")
 
 	def Emit(self, emitter):
+		self.Reset()
+		if self.PinRegisters:
+			self.PinHotRegisters(emitter)
 		for i in range(len(emitter.Instructions)):
 			if i in emitter.Labels:
 				for j in range(len(emitter.Labels[i])):
 					self.MarkLabel(str(emitter.Labels[i][j]))
+			self.InstructionStarts += [len(self.Instructions)]
 			self.EmitURCLInstruction(emitter.Instructions[i])
+		self.InstructionStarts += [len(self.Instructions)]
 		if len(emitter.Instructions) in emitter.Labels:
 			for i in range(len(emitter.Labels[len(emitter.Instructions)])):
 				self.MarkLabel(str(emitter.Labels[len(emitter.Instructions)][i]))
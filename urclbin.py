@@ -0,0 +1,139 @@
+import gc
+import mmap
+import struct
+import sys
+from array import array
+from urcl import *
+from urclvm import Machine, OPERATIONS
+
+BINARY_MAGIC = b"URCLBIN\0"
+BINARY_VERSION = 2
+
+#The order is part of the format, so operations are only ever appended.
+BINARY_OPERATIONS = [NOP, HLT, BRK, RET, PSH, POP, JMP, CAL, LOD, STR, MOV, IMM, LSH, RSH, INC, DEC, NOT, BRZ, BNZ, CPY, ADD, SUB, MLT, DIV, MOD, AND, OR, XOR, BSL, BSR, BRE, BNE, BRL, BRG, BLE, BGE]
+BINARY_OPCODES = {BINARY_OPERATIONS[i]: i for i in range(len(BINARY_OPERATIONS))}
+BINARY_DYNAMIC = 256
+
+#Magic, version, instruction count, register count, then the byte sizes of the name, label and source sections.
+_Header = struct.Struct("<8sIIIIII")
+
+#Constants are stored as unsigned 64-bit words with a sign byte each, so both negative numbers and addresses up to 2 ** 64 - 1 fit.
+_WORD_MASK = (1 << 64) - 1
+
+def _Align(data):
+	return data + b"\0" * (-len(data) % 8)
+
+def _LittleEndian(values):
+	if sys.byteorder != "little":
+		values.byteswap()
+	return values
+
+def _ReadArray(typecode, view, offset, count):
+	values = array(typecode)
+	values.frombytes(view[offset:offset + count * values.itemsize])
+	return _LittleEndian(values)
+
+class _Resolver(Machine):
+	#Decodes like a machine, but keeps the resolved operands of each instruction instead of binding a handler.
+	def _Bind(self, op, a, b, c, dynamic, nxt):
+		if dynamic:
+			return (BINARY_OPCODES[op] | BINARY_DYNAMIC, a, b, c)
+		return (BINARY_OPCODES[op], a, b, c)
+
+def WriteBinary(emitter, stream):
+	"""Write an emitter's program to a binary stream with operands resolved to register indices and jump targets."""
+	resolver = _Resolver(emitter)
+	code = array("i")
+	for record in resolver.ROM[0:resolver.Size]:
+		code.extend(record)
+	registers = array("Q")
+	signs = bytearray()
+	for value in resolver.Registers:
+		if not isinstance(value, int) or value < -(1 << 63) or value > _WORD_MASK:
+			raise ValueError("Constant \"" + str(value) + "\" can not be stored in a binary program.")
+		registers.append(value & _WORD_MASK)
+		signs.append(value < 0)
+	names = _Align("\n".join([name + " " + str(index) for name, index in resolver.RegisterNames.items()]).encode())
+	labels = _Align("\n".join([label + " " + str(position) for label, position in resolver.Labels.items()]).encode())
+	sources = [str(inst).encode() for inst in resolver.Instructions]
+	offsets = array("I", [0])
+	for source in sources:
+		offsets.append(offsets[-1] + len(source))
+	sourceBlob = b"".join(sources)
+	stream.write(_Header.pack(BINARY_MAGIC, BINARY_VERSION, resolver.Size, len(registers), len(names), len(labels), len(sourceBlob)))
+	stream.write(_LittleEndian(registers).tobytes())
+	stream.write(_Align(bytes(signs)))
+	stream.write(_LittleEndian(code).tobytes())
+	stream.write(names)
+	stream.write(labels)
+	stream.write(_LittleEndian(offsets).tobytes())
+	stream.write(sourceBlob)
+
+def _ParseTable(data):
+	table = {}
+	for line in bytes(data).rstrip(b"\0").decode().split("\n"):
+		if len(line) > 0:
+			name, value = line.rsplit(" ", 1)
+			table[sys.intern(name)] = int(value)
+	return table
+
+class BinaryMachine(Machine):
+	"""A machine loaded from a memory-mapped binary program. No URCL is parsed and instruction sources are only read when displayed."""
+	def __init__(self, path):
+		with open(path, "rb") as file:
+			self._Buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, size, registerCount, nameSize, labelSize, sourceSize = _Header.unpack_from(self._Buffer, 0)
+		if magic != BINARY_MAGIC:
+			raise ValueError("\"" + str(path) + "\" is not a binary URCL program.")
+		if version != BINARY_VERSION:
+			raise ValueError("\"" + str(path) + "\" has binary format version " + str(version) + ", expected " + str(BINARY_VERSION) + ".")
+		view = memoryview(self._Buffer)
+		offset = _Header.size
+		registers = _ReadArray("Q", view, offset, registerCount).tolist()
+		offset += registerCount * 8
+		for i in range(registerCount):
+			if view[offset + i]:
+				registers[i] -= 1 << 64
+		offset += registerCount + (-registerCount % 8)
+		code = _ReadArray("i", view, offset, size * 4)
+		offset += size * 16
+		names = _ParseTable(view[offset:offset + nameSize])
+		offset += nameSize
+		labels = _ParseTable(view[offset:offset + labelSize])
+		offset += labelSize
+		self._SourceOffsets = _ReadArray("I", view, offset, size + 1)
+		self._SourceStart = offset + (size + 1) * 4
+		view.release()
+		self.Instructions = None
+		self._Code = code
+		self._Initialize(size, labels)
+		self.RegisterNames = names
+		self.Registers = registers
+		rom = self.ROM
+		bind = self._Bind
+		collecting = gc.isenabled()
+		gc.disable()
+		try:
+			for position in range(size):
+				index = position * 4
+				opcode = code[index]
+				rom.append(bind(BINARY_OPERATIONS[opcode & 255], code[index + 1], code[index + 2], code[index + 3], opcode >= BINARY_DYNAMIC, position + 1))
+		finally:
+			if collecting:
+				gc.enable()
+		rom.append(self._OutOfBounds)
+
+	def _GetWrite(self, position):
+		op = BINARY_OPERATIONS[self._Code[position * 4] & 255]
+		if not OPERATIONS[op][3]:
+			return (op, None)
+		return (op, self._Code[position * 4 + 1])
+
+	def _GetAddress(self, position):
+		return self._Code[position * 4 + 1]
+
+	def GetSource(self, position):
+		"""Get the URCL source of the instruction at a ROM address."""
+		start = self._SourceStart + self._SourceOffsets[position]
+		end = self._SourceStart + self._SourceOffsets[position + 1]
+		return self._Buffer[start:end].decode()
@@ -1,11 +1,29 @@
 from urcl import *
 
+PROGRAM_BINARY_OPERATIONS = {ADD: "+", SUB: "-", MLT: "*", DIV: "/", MOD: "%", AND: "&", OR: "|", XOR: "^", BSL: "<<", BSR: ">>"}
+PROGRAM_UNARY_OPERATIONS = {MOV: "{0}", IMM: "{0}", LSH: "{0} << 1", RSH: "{0} >> 1", INC: "{0} + 1", DEC: "{0} - 1", NOT: "~{0}"}
+PROGRAM_CONDITIONS = {JMP: "", BRZ: "{0} == 0", BNZ: "{0} != 0", BRE: "{0} == {1}", BNE: "{0} != {1}", BRL: "{0} < {1}", BRG: "{0} > {1}", BLE: "{0} <= {1}", BGE: "{0} >= {1}"}
+PROGRAM_OPERAND_COUNTS = {NOP: 0, HLT: 0, BRK: 0, RET: 0, PSH: 1, POP: 1, JMP: 1, CAL: 1, LOD: 2, STR: 2, CPY: 2, BRZ: 2, BNZ: 2}
+
+DISPATCH_TABLE = "table"
+DISPATCH_SWITCH = "switch"
+DISPATCH_GOTO = "goto"
+
 class CEmit:
-	def __init__(self, ramSize, stackSize):
+	def __init__(self, ramSize, stackSize, dispatch=DISPATCH_TABLE):
+		self.Dispatch = dispatch
+		self.RAMSize = ramSize
+		self.StackSize = stackSize
+		self.Reset()
+
+	def Reset(self):
+		ramSize = self.RAMSize
+		stackSize = self.StackSize
 		self.Registers = ["SP"]
+		self._RegisterSet = set(self.Registers)
 		self._LocalRegisters = []
 		self.Labels = {}
-		self.Source = "#pragma once\n#define False 0\n#define True 1\n#define sizeof(x) (sizeof(x) / sizeof(int))\n" + \
+		self.Source = "#pragma once\n#include <stdio.h>\n#include <string.h>\n#define False 0\n#define True 1\n#define sizeof(x) (sizeof(x) / sizeof(int))\n" + \
 			"int RAM[" + str(ramSize) + "];\n" + \
 			"int STACK[" + str(stackSize) + "];\n" + \
 			"static const char* SUCCESS = \"Success.\";\n" + \
@@ -40,31 +58,16 @@ class CEmit:
 			"\t\tif (BREAK) return;\n\t}\n}\n#undef sizeof\n#undef True\n#undef False"
 	
 	def IsLabel(self, value):
-		if value == None:
-			return False
-		value = str(value)
-		return len(value) > 0 and value[0] == '.'
+		return GetOperandKind(value) == OPERAND_LABEL
 	
 	def IsRegister(self, value):
-		value = str(value)
-		if value == None:
-			return False
-		elif value != "R0" and (len(value) > 0 and value[0] == "R"):
-			try:
-				value = int(value[1:len(value)])
-				return True
-			except:
-				return False
-		else:
-			return value == "SP"
+		return value != ZERO and GetOperandKind(value) == OPERAND_REGISTER
 	
 	def IncludeInstructionRegisters(self, inst):
-		if self.IsRegister(inst.OperandA) and not inst.OperandA in self.Registers:
-			self.Registers += [inst.OperandA]
-		if self.IsRegister(inst.OperandB) and not inst.OperandB in self.Registers:
-			self.Registers += [inst.OperandB]
-		if self.IsRegister(inst.OperandC) and not inst.OperandC in self.Registers:
-			self.Registers += [inst.OperandC]
+		for operand in inst.GetOperands():
+			if self.IsRegister(operand) and not operand in self._RegisterSet:
+				self._RegisterSet.add(operand)
+				self.Registers += [operand]
 
 	def GetLabelName(self, label):
 		return "LABEL_" + label[1:len(label)]
@@ -148,15 +151,15 @@ class CEmit:
 
 		self.Source += "static void INST_" + str(position) + "()\n{\n"
 
-		inst.OperandA = self.ResolveOperand(inst.OperandA)
-		inst.OperandB = self.ResolveOperand(inst.OperandB)
-		inst.OperandC = self.ResolveOperand(inst.OperandC)
+		a = self.ResolveOperand(inst.OperandA)
+		b = self.ResolveOperand(inst.OperandB)
+		c = self.ResolveOperand(inst.OperandC)
 
 		op = inst.Operation
-		isZeroOperand = inst.OperandA == None
-		isOneOperand = inst.OperandA != None and inst.OperandB == None
-		isTwoOperand = inst.OperandA != None and inst.OperandB != None and inst.OperandC == None
-		isThreeOperand = inst.OperandA != None and inst.OperandB != None and inst.OperandC != None
+		isZeroOperand = a == None
+		isOneOperand = a != None and b == None
+		isTwoOperand = a != None and b != None and c == None
+		isThreeOperand = a != None and b != None and c != None
 
 		if isZeroOperand:
 			if op == NOP:
@@ -171,74 +174,74 @@ class CEmit:
 				self.EmitError("\"" + str(op) + "\" does not take zero operands.")
 		elif isOneOperand:
 			if op == PSH:
-				self.EmitPush(inst.OperandA)
+				self.EmitPush(a)
 			elif op == POP:
-				self.EmitPop(inst.OperandA)
+				self.EmitPop(a)
 			elif op == JMP:
-				self.EmitOperation("IP", inst.OperandA, "-", 1)
+				self.EmitOperation("IP", a, "-", 1)
 			elif op == CAL:
 				self.EmitPush("IP")
-				self.EmitOperation("IP", inst.OperandA, "-", 1)
+				self.EmitOperation("IP", a, "-", 1)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take one operand.")
 		elif isTwoOperand:
 			if op == LOD:
-				self.EmitLoad(inst.OperandA, inst.OperandB)
+				self.EmitLoad(a, b)
 			elif op == STR:
-				self.EmitStore(inst.OperandA, inst.OperandB)
+				self.EmitStore(a, b)
 			elif op == MOV or op == IMM:
-				self.EmitOperation(inst.OperandA, inst.OperandA, "", inst.OperandB)
+				self.EmitOperation(a, a, "", b)
 			elif op == LSH:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "<<", 1)
+				self.EmitOperation(a, b, "<<", 1)
 			elif op == RSH:
-				self.EmitOperation(inst.OperandA, inst.OperandB, ">>", 1)
+				self.EmitOperation(a, b, ">>", 1)
 			elif op == INC:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "+", 1)
+				self.EmitOperation(a, b, "+", 1)
 			elif op == DEC:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "-", 1)
+				self.EmitOperation(a, b, "-", 1)
 			elif op == NOT:
-				self.EmitAssignment(inst.OperandA, "~" + str(inst.OperandB))
+				self.EmitAssignment(a, "~" + str(b))
 			elif op == BRZ:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "==", 0)
+				self.EmitBranch(a, b, "==", 0)
 			elif op == BNZ:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "!=", 0)
+				self.EmitBranch(a, b, "!=", 0)
 			elif op == CPY:
-				self.EmitCopy(inst.OperandA, inst.OperandB)
+				self.EmitCopy(a, b)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take two operands.")
 		elif isThreeOperand:
 			if op == ADD:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "+", inst.OperandC)
+				self.EmitOperation(a, b, "+", c)
 			elif op == SUB:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "-", inst.OperandC)
+				self.EmitOperation(a, b, "-", c)
 			elif op == MLT:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "*", inst.OperandC)
+				self.EmitOperation(a, b, "*", c)
 			elif op == DIV:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "/", inst.OperandC)
+				self.EmitOperation(a, b, "/", c)
 			elif op == MOD:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "%", inst.OperandC)
+				self.EmitOperation(a, b, "%", c)
 			elif op == AND:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "&", inst.OperandC)
+				self.EmitOperation(a, b, "&", c)
 			elif op == OR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "|", inst.OperandC)
+				self.EmitOperation(a, b, "|", c)
 			elif op == XOR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "^", inst.OperandC)
+				self.EmitOperation(a, b, "^", c)
 			elif op == BSL:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "<<", inst.OperandC)
+				self.EmitOperation(a, b, "<<", c)
 			elif op == BSR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, ">>", inst.OperandC)
+				self.EmitOperation(a, b, ">>", c)
 			elif op == BRE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "==", inst.OperandC)
+				self.EmitBranch(a, b, "==", c)
 			elif op == BNE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "!=", inst.OperandC)
+				self.EmitBranch(a, b, "!=", c)
 			elif op == BRL:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "<", inst.OperandC)
+				self.EmitBranch(a, b, "<", c)
 			elif op == BRG:
-				self.EmitBranch(inst.OperandA, inst.OperandB, ">", inst.OperandC)
+				self.EmitBranch(a, b, ">", c)
 			elif op == BLE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "<=", inst.OperandC)
+				self.EmitBranch(a, b, "<=", c)
 			elif op == BGE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, ">=", inst.OperandC)
+				self.EmitBranch(a, b, ">=", c)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take three operands.")
 		else:
@@ -247,32 +250,325 @@ class CEmit:
 		self.Source += "}\n\n"
 		return "INST_" + str(position)
 
+	def GetLocalOperand(self, operand):
+		if operand == ZERO:
+			return "0"
+		elif GetOperandKind(operand) == OPERAND_REGISTER:
+			return str(operand).lower()
+		elif self.IsLabel(operand):
+			return self.GetLabelName(operand)
+		return str(operand)
+
+	def GetJumpTarget(self, operand, labelPositions, size):
+		if self.IsLabel(operand) and operand in labelPositions and labelPositions[operand] < size:
+			return labelPositions[operand]
+		elif isinstance(operand, int) and 0 <= operand < size:
+			return operand
+		return None
+
+	def GetDispatchTargets(self, emitter, labelPositions):
+		#Positions execution can resume at without a static jump: the start, labels, return sites and after a break.
+		size = len(emitter.Instructions)
+		targets = set([0])
+		for position in labelPositions.values():
+			targets.add(position)
+		for position in range(size):
+			inst = emitter.Instructions[position]
+			if inst.Operation == CAL or inst.Operation == BRK:
+				targets.add(position + 1)
+			elif inst.Operation in BRANCHES and isinstance(inst.OperandA, int):
+				targets.add(inst.OperandA)
+		return sorted([target for target in targets if 0 <= target < size])
+
+	def GetProgramExit(self, ip):
+		return "{ IP = " + str(ip) + "; goto EXIT; }"
+
+	def GetProgramJump(self, operand, labelPositions, size):
+		target = self.GetJumpTarget(operand, labelPositions, size)
+		if target != None:
+			return "goto INST_" + str(target) + ";"
+		return "{ IP = " + self.GetLocalOperand(operand) + "; goto DISPATCH; }"
+
+	def GetProgramLoad(self, target, address, position):
+		return "if ((unsigned)(" + address + ") < sizeof(RAM)) " + target + " = RAM[" + address + "]; " + \
+			"else { " + target + " = Get(" + address + "); if (STATUS != SUCCESS) " + self.GetProgramExit(position) + " }"
+
+	def GetProgramStore(self, address, source, position):
+		return "if ((unsigned)(" + address + ") < sizeof(RAM)) RAM[" + address + "] = " + source + "; " + \
+			"else { Set(" + address + ", " + source + "); if (STATUS != SUCCESS) " + self.GetProgramExit(position) + " }"
+
+	def GetProgramPush(self, source, position):
+		#A positive stack pointer pushes into RAM, like Set does.
+		return "if ((unsigned)(-sp) < sizeof(STACK)) { sp -= 1; STACK[-sp - 1] = " + source + "; } " + \
+			"else if (sp > 0) { " + self.GetProgramStore("sp - 1", source, position) + " sp -= 1; } " + \
+			"else { Error(\"Stack overflow.\"); " + self.GetProgramExit(position) + " }"
+
+	def GetProgramPop(self, target, position):
+		result = "if (sp >= 0) { Error(ERR_UNDERFLOW); " + self.GetProgramExit(position) + " } "
+		if target != "0":
+			result += target + " = STACK[-sp - 1]; "
+		return result + "sp += 1;"
+
+	def GetProgramStatements(self, inst, position, labelPositions, size):
+		op = inst.Operation
+		operands = inst.GetOperands()
+		if (op in PROGRAM_OPERAND_COUNTS and PROGRAM_OPERAND_COUNTS[op] != len(operands)) or (op in PROGRAM_BINARY_OPERATIONS and len(operands) != 3):
+			self.EmitError("\"" + str(op) + "\" does not take " + str(len(operands)) + " operands.")
+			return []
+		values = [self.GetLocalOperand(operand) for operand in operands]
+		if op == NOP:
+			return []
+		elif op == HLT:
+			return ["HALT = True;", self.GetProgramExit(position + 1)]
+		elif op == BRK:
+			return ["BREAK = True;", self.GetProgramExit(position + 1)]
+		elif op == RET:
+			return [self.GetProgramPop("IP", position), "IP += 1;", "goto DISPATCH;"]
+		elif op == PSH:
+			return [self.GetProgramPush(values[0], position)]
+		elif op == POP:
+			return [self.GetProgramPop(values[0], position)]
+		elif op == CAL:
+			return [self.GetProgramPush(str(position), position), self.GetProgramJump(operands[0], labelPositions, size)]
+		elif op == LOD:
+			if values[0] == "0":
+				return []
+			return [self.GetProgramLoad(values[0], values[1], position)]
+		elif op == STR:
+			return [self.GetProgramStore(values[0], values[1], position)]
+		elif op == CPY:
+			return ["{ int value; " + self.GetProgramLoad("value", values[1], position) + " " + self.GetProgramStore(values[0], "value", position) + " }"]
+		elif op in PROGRAM_CONDITIONS:
+			jump = self.GetProgramJump(operands[0], labelPositions, size)
+			if op == JMP:
+				return [jump]
+			return ["if (" + PROGRAM_CONDITIONS[op].format(*values[1:len(values)]) + ") " + jump]
+		elif values[0] == "0":
+			return []
+		elif op in PROGRAM_UNARY_OPERATIONS and len(operands) == 2:
+			return [values[0] + " = " + PROGRAM_UNARY_OPERATIONS[op].format(values[1]) + ";"]
+		elif op in PROGRAM_BINARY_OPERATIONS:
+			return [values[0] + " = " + values[1] + " " + PROGRAM_BINARY_OPERATIONS[op] + " " + values[2] + ";"]
+		self.EmitError("Invalid instruction \"" + str(inst) + "\".")
+		return []
+
+	def GetCheckpointCode(self):
+		#Writes the checkpoint format of urclckpt.py with registers sorted by name, so either runtime can restore it.
+		names = sorted(self.Registers)
+		namesSize = len("\n".join(names))
+		namesSize += -namesSize % 8
+		return "\n#define CHECKPOINT_MAGIC \"URCLCKP\"\n#define CHECKPOINT_VERSION 1\n" + \
+			"#define REGISTER_COUNT " + str(len(names)) + "\n#define REGISTER_NAMES_SIZE " + str(namesSize) + "\n" + \
+			"int* REGISTERS[] = { " + ", ".join(["&" + reg for reg in names]) + " };\n" + \
+			"static const char REGISTER_NAMES[REGISTER_NAMES_SIZE + 1] = \"" + "\\n".join(names) + "\";\n\n" + \
+			"static void WriteCheckpointValue(FILE* file, unsigned long long value, int size)\n" + \
+			"{\n" + \
+			"\tfor (int i = 0; i < size; i++) fputc((int)((value >> (i * 8)) & 255), file);\n" + \
+			"}\n" + \
+			"\n" + \
+			"static int ReadCheckpointValue(FILE* file, unsigned long long* value, int size)\n" + \
+			"{\n" + \
+			"\t*value = 0;\n" + \
+			"\tfor (int i = 0; i < size; i++)\n" + \
+			"\t{\n" + \
+			"\t\tint byte = fgetc(file);\n" + \
+			"\t\tif (byte == EOF) return False;\n" + \
+			"\t\t*value |= (unsigned long long)byte << (i * 8);\n" + \
+			"\t}\n" + \
+			"\treturn True;\n" + \
+			"}\n" + \
+			"\n" + \
+			"static long long GetCheckpointWord(long long addr)\n" + \
+			"{\n" + \
+			"\tif (addr < 0) return (-addr - 1) < sizeof(STACK) ? STACK[-addr - 1] : 0;\n" + \
+			"\treturn addr < sizeof(RAM) ? RAM[addr] : 0;\n" + \
+			"}\n" + \
+			"\n" + \
+			"static int SetCheckpointWord(long long addr, long long value)\n" + \
+			"{\n" + \
+			"\tif (addr < 0 && (-addr - 1) < sizeof(STACK)) STACK[-addr - 1] = (int)value;\n" + \
+			"\telse if (addr >= 0 && addr < sizeof(RAM)) RAM[addr] = (int)value;\n" + \
+			"\telse return value == 0;\n" + \
+			"\treturn True;\n" + \
+			"}\n" + \
+			"\n" + \
+			"static int IsCheckpointPageUsed(long long page)\n" + \
+			"{\n" + \
+			"\tfor (long long word = 0; word < 256; word++)\n" + \
+			"\t{\n" + \
+			"\t\tif (GetCheckpointWord(page * 256 + word) != 0) return True;\n" + \
+			"\t}\n" + \
+			"\treturn False;\n" + \
+			"}\n" + \
+			"\n" + \
+			"int SaveCheckpoint(const char* path)\n" + \
+			"{\n" + \
+			"\tlong long first = -(((long long)sizeof(STACK) + 255) / 256);\n" + \
+			"\tlong long last = ((long long)sizeof(RAM) + 255) / 256;\n" + \
+			"\tunsigned long long pages = 0;\n" + \
+			"\tfor (long long page = first; page < last; page++) pages += IsCheckpointPageUsed(page);\n" + \
+			"\tchar temporary[4096];\n" + \
+			"\tif (snprintf(temporary, 4096, \"%s.tmp\", path) >= 4096) return False;\n" + \
+			"\tFILE* file = fopen(temporary, \"wb\");\n" + \
+			"\tif (!file) return False;\n" + \
+			"\tfwrite(CHECKPOINT_MAGIC, 1, 8, file);\n" + \
+			"\tWriteCheckpointValue(file, CHECKPOINT_VERSION, 4);\n" + \
+			"\tWriteCheckpointValue(file, (HALT ? 1 : 0) | (BREAK ? 2 : 0), 4);\n" + \
+			"\tWriteCheckpointValue(file, (unsigned long long)(long long)IP, 8);\n" + \
+			"\tWriteCheckpointValue(file, REGISTER_COUNT, 4);\n" + \
+			"\tWriteCheckpointValue(file, REGISTER_NAMES_SIZE, 4);\n" + \
+			"\tWriteCheckpointValue(file, pages, 4);\n" + \
+			"\tfor (int i = 0; i < REGISTER_COUNT; i++) WriteCheckpointValue(file, (unsigned long long)(long long)*REGISTERS[i], 8);\n" + \
+			"\tfwrite(REGISTER_NAMES, 1, REGISTER_NAMES_SIZE, file);\n" + \
+			"\tfor (long long page = first; page < last; page++)\n" + \
+			"\t{\n" + \
+			"\t\tif (IsCheckpointPageUsed(page)) WriteCheckpointValue(file, (unsigned long long)page, 8);\n" + \
+			"\t}\n" + \
+			"\tfor (long long page = first; page < last; page++)\n" + \
+			"\t{\n" + \
+			"\t\tif (!IsCheckpointPageUsed(page)) continue;\n" + \
+			"\t\tfor (long long word = 0; word < 256; word++) WriteCheckpointValue(file, (unsigned long long)GetCheckpointWord(page * 256 + word), 8);\n" + \
+			"\t}\n" + \
+			"\tif (fclose(file) != 0) return False;\n" + \
+			"\t//The previous checkpoint is only replaced once the new one is complete.\n" + \
+			"\tif (rename(temporary, path) == 0) return True;\n" + \
+			"\tremove(path);\n" + \
+			"\treturn rename(temporary, path) == 0;\n" + \
+			"}\n" + \
+			"\n" + \
+			"int LoadCheckpoint(const char* path)\n" + \
+			"{\n" + \
+			"\tFILE* file = fopen(path, \"rb\");\n" + \
+			"\tif (!file) return False;\n" + \
+			"\tchar magic[8];\n" + \
+			"\tchar names[REGISTER_NAMES_SIZE + 1];\n" + \
+			"\tint values[REGISTER_COUNT];\n" + \
+			"\tunsigned long long version, flags, ip, count, namesSize, pages, value, page;\n" + \
+			"\tint valid = fread(magic, 1, 8, file) == 8 && memcmp(magic, CHECKPOINT_MAGIC, 8) == 0;\n" + \
+			"\tvalid = valid && ReadCheckpointValue(file, &version, 4) && version == CHECKPOINT_VERSION;\n" + \
+			"\tvalid = valid && ReadCheckpointValue(file, &flags, 4) && ReadCheckpointValue(file, &ip, 8);\n" + \
+			"\tvalid = valid && ReadCheckpointValue(file, &count, 4) && ReadCheckpointValue(file, &namesSize, 4) && ReadCheckpointValue(file, &pages, 4);\n" + \
+			"\t//Registers are matched by name, so a checkpoint of the same program always has the same names.\n" + \
+			"\tvalid = valid && count == REGISTER_COUNT && namesSize == REGISTER_NAMES_SIZE;\n" + \
+			"\tfor (int i = 0; i < REGISTER_COUNT && valid; i++)\n" + \
+			"\t{\n" + \
+			"\t\tvalid = ReadCheckpointValue(file, &value, 8);\n" + \
+			"\t\tvalues[i] = (int)value;\n" + \
+			"\t}\n" + \
+			"\tvalid = valid && fread(names, 1, REGISTER_NAMES_SIZE, file) == REGISTER_NAMES_SIZE && memcmp(names, REGISTER_NAMES, REGISTER_NAMES_SIZE) == 0;\n" + \
+			"\tlong start = ftell(file);\n" + \
+			"\tvalid = valid && fseek(file, 0, SEEK_END) == 0 && (unsigned long long)ftell(file) == start + pages * 257 * 8;\n" + \
+			"\tfor (long long addr = -(long long)sizeof(STACK); addr < (long long)sizeof(RAM) && valid; addr++) SetCheckpointWord(addr, 0);\n" + \
+			"\tfor (unsigned long long i = 0; i < pages && valid; i++)\n" + \
+			"\t{\n" + \
+			"\t\tvalid = fseek(file, start + (long)(i * 8), SEEK_SET) == 0 && ReadCheckpointValue(file, &page, 8);\n" + \
+			"\t\tvalid = valid && fseek(file, start + (long)(pages * 8 + i * 256 * 8), SEEK_SET) == 0;\n" + \
+			"\t\tfor (long long word = 0; word < 256 && valid; word++)\n" + \
+			"\t\t{\n" + \
+			"\t\t\tvalid = ReadCheckpointValue(file, &value, 8) && SetCheckpointWord((long long)page * 256 + word, (long long)value);\n" + \
+			"\t\t}\n" + \
+			"\t}\n" + \
+			"\tfclose(file);\n" + \
+			"\tif (!valid) return False;\n" + \
+			"\tfor (int i = 0; i < REGISTER_COUNT; i++) *REGISTERS[i] = values[i];\n" + \
+			"\tIP = (int)ip;\n" + \
+			"\tHALT = (flags & 1) != 0;\n" + \
+			"\tBREAK = (flags & 2) != 0;\n" + \
+			"\treturn True;\n" + \
+			"}\n" + \
+			"\n"
+
+	def EmitProgramCode(self, emitter):
+		labelPositions = {}
+		for position in emitter.Labels:
+			for label in emitter.Labels[position]:
+				labelPositions[label] = position
+		size = len(emitter.Instructions)
+		targets = self.GetDispatchTargets(emitter, labelPositions)
+		targetSet = set(targets)
+
+		#A run can stop in the middle of a block after an error, or be restored from a checkpoint there,
+		#so it first steps through the instruction table until it reaches a dispatch target.
+		self.Source += "static const char TARGET_POSITIONS[] = { " + ", ".join([str(int(position in targetSet)) for position in range(size)] + ["1"]) + " };\n\n"
+		self.Source += "static int Resume()\n{\n" + \
+			"\twhile (!HALT && (unsigned)IP < " + str(size) + " && !TARGET_POSITIONS[IP])\n\t{\n" + \
+			"\t\tROM[IP]();\n" + \
+			"\t\tif (STATUS != SUCCESS) return False;\n" + \
+			"\t\tIP += 1;\n" + \
+			"\t\tif (BREAK) return False;\n\t}\n" + \
+			"\treturn !HALT;\n}\n\n"
+		self.Source += "void Execute()\n{\n"
+		self.Source += "\tBREAK = False;\n\tSTATUS = SUCCESS;\n\tif (!Resume()) return;\n"
+		for reg in self.Registers:
+			self.Source += "\tint " + reg.lower() + " = " + reg + ";\n"
+		if self.Dispatch == DISPATCH_GOTO:
+			self.Source += "\tstatic void* TARGETS[] = { "
+			entries = []
+			for position in range(size):
+				if position in targetSet:
+					entries.append("&&INST_" + str(position))
+				else:
+					entries.append("&&RESUME")
+			self.Source += ", ".join(entries + ["&&SEGFAULT"]) + " };\n"
+			self.Source += "DISPATCH:\n\tif ((unsigned)IP > " + str(size) + ") goto SEGFAULT;\n\tgoto *TARGETS[IP];\n"
+		else:
+			self.Source += "DISPATCH:\n\tswitch (IP)\n\t{\n"
+			self.Source += "".join(["\tcase " + str(position) + ": goto INST_" + str(position) + ";\n" for position in targets])
+			self.Source += "\tdefault: goto RESUME;\n\t}\n"
+
+		lines = [self.Source]
+		for position in range(size):
+			inst = emitter.Instructions[position]
+			lines.append("INST_" + str(position) + ": //" + str(inst) + "\n")
+			for statement in self.GetProgramStatements(inst, position, labelPositions, size):
+				lines.append("\t" + statement + "\n")
+		self.Source = "".join(lines)
+		self.Source += "\tIP = " + str(size) + ";\n\tgoto SEGFAULT;\n"
+		#Register jumps can land anywhere, so one that misses a dispatch target steps through the table with the registers written back.
+		self.Source += "RESUME:\n\tif ((unsigned)IP >= " + str(size) + ") goto SEGFAULT;\n"
+		for reg in self.Registers:
+			self.Source += "\t" + reg + " = " + reg.lower() + ";\n"
+		self.Source += "\tif (!Resume()) return;\n"
+		for reg in self.Registers:
+			self.Source += "\t" + reg.lower() + " = " + reg + ";\n"
+		self.Source += "\tgoto DISPATCH;\n"
+		self.Source += "SEGFAULT:\n\tError(\"Code segfault.\");\n"
+		self.Source += "EXIT:\n"
+		for reg in self.Registers:
+			self.Source += "\t" + reg + " = " + reg.lower() + ";\n"
+		self.Source += "}\n#undef sizeof\n#undef True\n#undef False"
+
 	def Emit(self, emitter):
+		self.Reset()
 		for inst in emitter.Instructions:
 			self.IncludeInstructionRegisters(inst)
 		
 		for reg in self.Registers:
 			self.Source += "int " + str(reg) + " = 0;\n"
+		self.Source += self.GetCheckpointCode()
 
+		#Each piece of code is emitted into an empty source and joined at the end, so emitting stays linear in the program size.
+		chunks = [self.Source]
 		for position in emitter.Labels:
 			for label in emitter.Labels[position]:
+				self.Source = ""
 				self.EmitLabelCode(label, position)
-		
-		self.Source += "\n"
+				chunks.append(self.Source)
+		chunks.append("\n")
 
 		instructions = []
 		for position in range(len(emitter.Instructions)):
+			self.Source = ""
 			instructions += [self.EmitInstructionCode(emitter.Instructions[position], position)]
+			chunks.append(self.Source)
+		chunks.append("void (*ROM[])() = { " + ", ".join(instructions) + " };\n\n")
 
-		self.Source += "void (*ROM[])() = { "
-		first = True
-		for inst in instructions:
-			if first:
-				self.Source += inst
-				first = False
-			else:
-				self.Source += ", " + inst
-
-		self.Source += " };\n\n" + self.Executor
+		if self.Dispatch != DISPATCH_TABLE:
+			self.Source = ""
+			self.EmitProgramCode(emitter)
+			chunks.append(self.Source)
+		else:
+			chunks.append(self.Executor)
+		self.Source = "".join(chunks)
 
 		return self.Source
\ No newline at end of file
@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+import pickle
+import urcl
+from urcl import *
+
+def _GetParserVersion():
+	#The parser and the cached format live in these modules, so changing either one changes every key and old entries are never loaded.
+	digest = hashlib.sha256()
+	for path in [urcl.__file__, __file__]:
+		with open(path, "rb") as file:
+			digest.update(file.read())
+	return digest.hexdigest()
+
+PARSER_VERSION = _GetParserVersion()
+
+DEFAULT_CACHE_DIRECTORY = ".urclcache"
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+def ParseRecords(stream):
+	"""Parse URCL from a file object with ParseStream into a list of (lineNumber, value) pairs, where value is a label or an (operation, operandA, operandB, operandC) tuple."""
+	parsed = []
+	for lineNumber, value in ParseStream(stream):
+		if isinstance(value, str):
+			parsed.append((lineNumber, value))
+		else:
+			parsed.append((lineNumber, (value.Operation, value.OperandA, value.OperandB, value.OperandC)))
+	return parsed
+
+def ParseSource(source):
+	"""Parse URCL source bytes into a list of (lineNumber, value) pairs."""
+	return ParseRecords(io.BytesIO(source))
+
+def ParseFile(path):
+	"""Parse an URCL file without using a cache."""
+	with open(path, "rb") as file:
+		return ParseRecords(file)
+
+def EmitParsed(emitter, parsed, path="<input>", definitions=None):
+	"""Emit the labels and instructions of a parsed source. Labels are recorded in definitions as (path, lineNumber) so a label defined twice raises a ValueError."""
+	if definitions == None:
+		definitions = {}
+	for lineNumber, value in parsed:
+		if emitter.IsLabel(value):
+			if value in definitions:
+				previous = definitions[value]
+				raise ValueError(path + ":" + str(lineNumber) + ": Label \"" + value + "\" is already defined at " + previous[0] + ":" + str(previous[1]) + ".")
+			definitions[value] = (path, lineNumber)
+			emitter.MarkLabel(value)
+		else:
+			emitter.Emit(value[0], value[1], value[2], value[3])
+
+_WorkerCache = None
+
+def _SetWorkerCache(directory, maxSize):
+	global _WorkerCache
+	if directory != None:
+		_WorkerCache = BuildCache(directory, maxSize)
+
+def _ParseWorkerFile(path):
+	if _WorkerCache == None:
+		return (ParseFile(path), None)
+	hits = _WorkerCache.Hits
+	readBytes = _WorkerCache.ReadBytes
+	writtenBytes = _WorkerCache.WrittenBytes
+	parsed = _WorkerCache.Parse(path)
+	return (parsed, (_WorkerCache.Hits - hits, _WorkerCache.ReadBytes - readBytes, _WorkerCache.WrittenBytes - writtenBytes))
+
+def ParseFiles(paths, cache=None, workers=1):
+	"""Parse URCL files, in a pool of worker processes when workers is more than one. Returns the parsed files in the order of paths, whatever order they finish in."""
+	if workers <= 1 or len(paths) <= 1:
+		if cache != None:
+			return [cache.Parse(path) for path in paths]
+		return [ParseFile(path) for path in paths]
+	from concurrent.futures import ProcessPoolExecutor
+	directory = None
+	maxSize = DEFAULT_CACHE_SIZE
+	if cache != None:
+		directory = cache.Directory
+		maxSize = cache.MaxSize
+	files = []
+	workers = min(workers, len(paths))
+	#A few chunks per worker keeps the workers balanced without a round trip for every file.
+	chunkSize = max(1, len(paths) // (workers * 4))
+	with ProcessPoolExecutor(workers, initializer=_SetWorkerCache, initargs=(directory, maxSize)) as pool:
+		for parsed, stats in pool.map(_ParseWorkerFile, paths, chunksize=chunkSize):
+			if stats != None:
+				cache.Hits += stats[0]
+				cache.Misses += 1 - stats[0]
+				cache.ReadBytes += stats[1]
+				cache.WrittenBytes += stats[2]
+			files.append(parsed)
+	return files
+
+class BuildCache:
+	"""An on-disk cache of parsed URCL sources keyed by content hash and parser version. The least recently used entries are removed when the cache grows past maxSize bytes."""
+	def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, maxSize=DEFAULT_CACHE_SIZE):
+		self.Directory = directory
+		self.MaxSize = maxSize
+		self.Hits = 0
+		self.Misses = 0
+		self.Evictions = 0
+		self.ReadBytes = 0
+		self.WrittenBytes = 0
+		os.makedirs(directory, exist_ok=True)
+
+	def GetKey(self, source):
+		"""Get the cache key of source bytes."""
+		digest = hashlib.sha256()
+		digest.update(("urcl-" + PARSER_VERSION + "\n").encode())
+		digest.update(source)
+		return digest.hexdigest()
+
+	def GetPath(self, key):
+		"""Get the file path of a cache entry."""
+		return os.path.join(self.Directory, key + ".pickle")
+
+	def Lookup(self, key):
+		"""Get a cached entry, or None if the key is not cached."""
+		path = self.GetPath(key)
+		try:
+			with open(path, "rb") as file:
+				data = file.read()
+			value = pickle.loads(data)
+		except (OSError, EOFError, pickle.UnpicklingError):
+			return None
+		#The modification time records the last use for eviction.
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		self.ReadBytes += len(data)
+		return value
+
+	def Store(self, key, value):
+		"""Write an entry to the cache."""
+		path = self.GetPath(key)
+		data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		temporary = path + "." + str(os.getpid()) + ".tmp"
+		try:
+			with open(temporary, "wb") as file:
+				file.write(data)
+			os.replace(temporary, path)
+		except OSError:
+			try:
+				os.remove(temporary)
+			except OSError:
+				pass
+			return
+		self.WrittenBytes += len(data)
+
+	def Parse(self, path):
+		"""Get the parsed form of an URCL file, from the cache if its contents were parsed before."""
+		with open(path, "rb") as file:
+			source = file.read()
+		key = self.GetKey(source)
+		parsed = self.Lookup(key)
+		if parsed != None:
+			self.Hits += 1
+			return parsed
+		self.Misses += 1
+		parsed = ParseSource(source)
+		self.Store(key, parsed)
+		return parsed
+
+	def GetSize(self):
+		"""Get the total size of the cache entries in bytes."""
+		return sum([entry[2] for entry in self._GetEntries()])
+
+	def _GetEntries(self):
+		entries = []
+		with os.scandir(self.Directory) as scan:
+			for entry in scan:
+				if entry.name.endswith(".pickle"):
+					try:
+						stat = entry.stat()
+					except OSError:
+						continue
+					entries.append((stat.st_mtime, entry.path, stat.st_size))
+		return entries
+
+	def Trim(self):
+		"""Remove the least recently used entries until the cache fits in maxSize bytes."""
+		entries = self._GetEntries()
+		entries.sort()
+		size = sum([entry[2] for entry in entries])
+		for modified, path, entrySize in entries:
+			if size <= self.MaxSize:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+			size -= entrySize
+			self.Evictions += 1
+
+	def __str__(self):
+		"""Summarize the cache statistics."""
+		return "hits=" + str(self.Hits) + " misses=" + str(self.Misses) + " evictions=" + str(self.Evictions) + " read_bytes=" + str(self.ReadBytes) + " written_bytes=" + str(self.WrittenBytes)
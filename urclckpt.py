@@ -0,0 +1,199 @@
+import os
+import struct
+from array import array
+from urcl import *
+from urclbin import _Align, _LittleEndian, _ReadArray
+
+CHECKPOINT_MAGIC = b"URCLCKP\0"
+CHECKPOINT_VERSION = 1
+
+#Memory is stored in pages of 2 ** CHECKPOINT_PAGE_BITS words, and only pages with a nonzero word are written.
+CHECKPOINT_PAGE_BITS = 8
+CHECKPOINT_PAGE_SIZE = 1 << CHECKPOINT_PAGE_BITS
+
+CHECKPOINT_HALT = 1
+CHECKPOINT_BREAK = 2
+
+#Magic, version, flags, IP, register count, byte size of the register names and page count.
+_Header = struct.Struct("<8sIIqIII")
+
+class Checkpoint:
+	"""The full state of a machine: the instruction pointer, HALT and BREAK, registers by name and the nonzero words of memory by address. Stack addresses are negative."""
+	def __init__(self, ip=0, halt=False, brk=False, registers=None, memory=None):
+		self.IP = ip
+		self.HALT = halt
+		self.BREAK = brk
+		self.Registers = registers
+		self.Memory = memory
+		if registers == None:
+			self.Registers = {}
+		if memory == None:
+			self.Memory = {}
+
+	def GetPages(self):
+		"""Get the page numbers and words of the pages that hold nonzero words, ordered by page number."""
+		pages = {}
+		for addr, value in self.Memory.items():
+			page = addr >> CHECKPOINT_PAGE_BITS
+			if not page in pages:
+				pages[page] = [0] * CHECKPOINT_PAGE_SIZE
+			pages[page][addr - (page << CHECKPOINT_PAGE_BITS)] = value
+		return sorted(pages.items())
+
+def _CheckWord(value):
+	if not isinstance(value, int) or value < -(1 << 63) or value >= (1 << 63):
+		raise ValueError("Value \"" + str(value) + "\" can not be stored in a checkpoint.")
+	return value
+
+def WriteCheckpoint(checkpoint, stream):
+	"""Write a checkpoint to a binary stream."""
+	names = sorted(checkpoint.Registers)
+	nameData = _Align("\n".join(names).encode())
+	pages = checkpoint.GetPages()
+	flags = 0
+	if checkpoint.HALT:
+		flags |= CHECKPOINT_HALT
+	if checkpoint.BREAK:
+		flags |= CHECKPOINT_BREAK
+	registers = array("q", [_CheckWord(checkpoint.Registers[name]) for name in names])
+	pageNumbers = array("q", [page for page, words in pages])
+	words = array("q")
+	for page, values in pages:
+		words.extend([_CheckWord(value) for value in values])
+	stream.write(_Header.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, flags, checkpoint.IP, len(names), len(nameData), len(pages)))
+	stream.write(_LittleEndian(registers).tobytes())
+	stream.write(nameData)
+	stream.write(_LittleEndian(pageNumbers).tobytes())
+	stream.write(_LittleEndian(words).tobytes())
+
+def ReadCheckpoint(stream):
+	"""Read a checkpoint from a binary stream."""
+	data = stream.read()
+	if len(data) < _Header.size:
+		raise ValueError("Checkpoint is truncated.")
+	magic, version, flags, ip, registerCount, nameSize, pageCount = _Header.unpack_from(data, 0)
+	if magic != CHECKPOINT_MAGIC:
+		raise ValueError("Data is not an URCL checkpoint.")
+	if version != CHECKPOINT_VERSION:
+		raise ValueError("Checkpoint has version " + str(version) + ", expected " + str(CHECKPOINT_VERSION) + ".")
+	if len(data) != _Header.size + registerCount * 8 + nameSize + pageCount * 8 * (CHECKPOINT_PAGE_SIZE + 1):
+		raise ValueError("Checkpoint is truncated.")
+	view = memoryview(data)
+	offset = _Header.size
+	registers = _ReadArray("q", view, offset, registerCount)
+	offset += registerCount * 8
+	names = bytes(view[offset:offset + nameSize]).rstrip(b"\0").decode().split("\n")
+	offset += nameSize
+	pageNumbers = _ReadArray("q", view, offset, pageCount)
+	offset += pageCount * 8
+	words = _ReadArray("q", view, offset, pageCount * CHECKPOINT_PAGE_SIZE).tolist()
+	memory = {}
+	for i in range(pageCount):
+		base = (pageNumbers[i] << CHECKPOINT_PAGE_BITS) - i * CHECKPOINT_PAGE_SIZE
+		for index in range(i * CHECKPOINT_PAGE_SIZE, (i + 1) * CHECKPOINT_PAGE_SIZE):
+			if words[index] != 0:
+				memory[base + index] = words[index]
+	if registerCount == 0:
+		names = []
+	return Checkpoint(ip, (flags & CHECKPOINT_HALT) != 0, (flags & CHECKPOINT_BREAK) != 0, dict(zip(names, registers.tolist())), memory)
+
+def _GetMemory(ram, stack):
+	memory = {}
+	if isinstance(ram, dict):
+		for addr, value in ram.items():
+			if value != 0:
+				memory[addr] = value
+	else:
+		for addr in range(len(ram)):
+			if ram[addr] != 0:
+				memory[addr] = ram[addr]
+	for index in range(len(stack)):
+		if stack[index] != 0:
+			memory[-index - 1] = stack[index]
+	return memory
+
+def _SetMemory(ram, stack, memory):
+	#Memory is changed in place, since generated code and machine handlers keep references to it.
+	if isinstance(ram, dict):
+		ram.clear()
+	else:
+		ram[0:len(ram)] = _Zeros(ram)
+	stack[0:len(stack)] = _Zeros(stack)
+	for addr, value in memory.items():
+		try:
+			if addr >= 0:
+				ram[addr] = value
+			else:
+				index = -addr - 1
+				if isinstance(ram, dict) and index >= len(stack):
+					stack.extend([0] * (index + 1 - len(stack)))
+				stack[index] = value
+		except (IndexError, OverflowError):
+			raise ValueError("Address " + str(addr) + " of the checkpoint does not fit the memory of the program.")
+
+def _Zeros(words):
+	if isinstance(words, array):
+		return array(words.typecode, bytes(len(words) * words.itemsize))
+	return [0] * len(words)
+
+def CaptureModule(module):
+	"""Capture the state of a module generated by PythonEmit from its globals."""
+	registers = {name: module[name] for name in module["REGISTERS"]}
+	return Checkpoint(module["IP"], module["HALT"], module["BREAK"], registers, _GetMemory(module["RAM"], module["STACK"]))
+
+def RestoreModule(checkpoint, module):
+	"""Restore a checkpoint into the globals of a module generated by PythonEmit for the same program."""
+	for name in checkpoint.Registers:
+		if not name in module["REGISTERS"]:
+			raise ValueError("Register \"" + name + "\" of the checkpoint is not used by the program.")
+	for name in module["REGISTERS"]:
+		module[name] = checkpoint.Registers.get(name, 0)
+	_SetMemory(module["RAM"], module["STACK"], checkpoint.Memory)
+	module["IP"] = checkpoint.IP
+	module["HALT"] = checkpoint.HALT
+	module["BREAK"] = checkpoint.BREAK
+
+def CaptureMachine(machine):
+	"""Capture the state of a Machine."""
+	registers = {name: machine.Registers[index] for name, index in machine.RegisterNames.items() if name != ZERO}
+	return Checkpoint(machine.IP, machine.HALT, machine.BREAK, registers, _GetMemory(machine.RAM, machine.STACK))
+
+def RestoreMachine(checkpoint, machine):
+	"""Restore a checkpoint into a Machine running the same program."""
+	for name in checkpoint.Registers:
+		if not name in machine.RegisterNames or name == ZERO:
+			raise ValueError("Register \"" + name + "\" of the checkpoint is not used by the program.")
+	for name in machine.RegisterNames:
+		if name != ZERO:
+			machine.SetRegister(name, checkpoint.Registers.get(name, 0))
+	_SetMemory(machine.RAM, machine.STACK, checkpoint.Memory)
+	machine.MemoryVersion += 1
+	machine.IP = checkpoint.IP
+	machine.HALT = checkpoint.HALT
+	machine.BREAK = checkpoint.BREAK
+	machine._Resume = None
+	if machine.Journal != None:
+		#Recorded steps lead up to the old state, so recording starts over.
+		machine.EnableJournal(machine.Journal.Entries.maxlen, machine.Journal.SnapshotInterval, machine.Journal.Snapshots.maxlen)
+
+def SaveCheckpoint(target, path):
+	"""Save the state of a Machine or of the globals of a generated module to a file. The file is replaced atomically, so a crash while saving keeps the previous checkpoint."""
+	if isinstance(target, dict):
+		checkpoint = CaptureModule(target)
+	else:
+		checkpoint = CaptureMachine(target)
+	temporary = path + "." + str(os.getpid()) + ".tmp"
+	with open(temporary, "wb") as file:
+		WriteCheckpoint(checkpoint, file)
+	os.replace(temporary, path)
+	return checkpoint
+
+def LoadCheckpoint(target, path):
+	"""Restore the state of a Machine or of the globals of a generated module from a file."""
+	with open(path, "rb") as file:
+		checkpoint = ReadCheckpoint(file)
+	if isinstance(target, dict):
+		RestoreModule(checkpoint, target)
+	else:
+		RestoreMachine(checkpoint, target)
+	return checkpoint
@@ -0,0 +1,728 @@
+from urcl import *
+
+WRITE_OPERATIONS = [POP, LOD, MOV, IMM, LSH, RSH, INC, DEC, NOT, ADD, SUB, MLT, DIV, MOD, AND, OR, XOR, BSL, BSR]
+JUMP_OPERATIONS = BRANCHES + [CAL]
+READ_A_OPERATIONS = JUMP_OPERATIONS + [PSH, STR, CPY]
+
+def GetLabelPositions(emitter):
+	"""Get a dictionary of label names to instruction positions."""
+	positions = {}
+	for position in emitter.Labels:
+		for label in emitter.Labels[position]:
+			positions[label] = position
+	return positions
+
+def GetWrittenOperand(inst):
+	"""Get the register written by an instruction, or None."""
+	if inst.Operation in WRITE_OPERATIONS and GetOperandKind(inst.OperandA) == OPERAND_REGISTER:
+		return inst.OperandA
+	return None
+
+def GetReadOperands(inst):
+	"""Get the registers read by an instruction."""
+	operands = inst.GetOperands()
+	if inst.Operation in WRITE_OPERATIONS:
+		operands = operands[1:len(operands)]
+	elif not inst.Operation in READ_A_OPERATIONS:
+		operands = []
+	return [operand for operand in operands if GetOperandKind(operand) == OPERAND_REGISTER]
+
+def GetSuccessors(emitter, labelPositions=None):
+	"""Get the positions that can execute after each instruction. Returns are assumed to reach every call site and register jumps every label."""
+	if labelPositions == None:
+		labelPositions = GetLabelPositions(emitter)
+	instructions = emitter.Instructions
+	size = len(instructions)
+	returnSites = [position + 1 for position in range(size) if instructions[position].Operation == CAL and position + 1 < size]
+	allLabels = sorted(set([position for position in labelPositions.values() if position < size]))
+	successors = []
+	for position in range(size):
+		inst = instructions[position]
+		op = inst.Operation
+		targets = []
+		if op in JUMP_OPERATIONS:
+			kind = GetOperandKind(inst.OperandA)
+			if kind == OPERAND_LABEL:
+				if inst.OperandA in labelPositions:
+					targets.append(labelPositions[inst.OperandA])
+			elif kind == OPERAND_REGISTER:
+				targets += allLabels
+			elif isinstance(inst.OperandA, int):
+				targets.append(inst.OperandA)
+			if op != JMP and op != CAL:
+				targets.append(position + 1)
+		elif op == RET:
+			targets += returnSites
+		elif op != HLT:
+			targets.append(position + 1)
+		successors.append([target for target in targets if 0 <= target < size])
+	return successors
+
+def GetLoopDepths(emitter, labelPositions=None):
+	"""Estimate the loop depth of each instruction from the backward jumps that enclose it."""
+	if labelPositions == None:
+		labelPositions = GetLabelPositions(emitter)
+	instructions = emitter.Instructions
+	changes = [0] * (len(instructions) + 1)
+	for position in range(len(instructions)):
+		inst = instructions[position]
+		if inst.Operation in BRANCHES and inst.OperandA in labelPositions:
+			target = labelPositions[inst.OperandA]
+			if target <= position:
+				changes[target] += 1
+				changes[position + 1] -= 1
+	depths = []
+	depth = 0
+	for position in range(len(instructions)):
+		depth += changes[position]
+		depths.append(depth)
+	return depths
+
+def RewriteInstructions(emitter, replacements):
+	"""Replace each instruction with a list of instructions, moving labels and numeric jump targets to the start of the replacement."""
+	positions = []
+	instructions = []
+	for replacement in replacements:
+		positions.append(len(instructions))
+		instructions += replacement
+	positions.append(len(instructions))
+	for inst in instructions:
+		if inst.Operation in JUMP_OPERATIONS and isinstance(inst.OperandA, int) and 0 <= inst.OperandA < len(positions):
+			inst.OperandA = positions[inst.OperandA]
+	labels = {}
+	for position in emitter.Labels:
+		newPosition = positions[min(position, len(positions) - 1)]
+		if newPosition in labels:
+			labels[newPosition] += emitter.Labels[position]
+		else:
+			labels[newPosition] = list(emitter.Labels[position])
+	emitter.Instructions = instructions
+	emitter.Labels = labels
+	return positions
+
+def GetRegisterIndices(instructions):
+	"""Get a dictionary of the registers used by instructions to bit indices, excluding R0 and SP."""
+	registers = {}
+	for inst in instructions:
+		for operand in inst.GetOperands():
+			if GetOperandKind(operand) == OPERAND_REGISTER and operand != ZERO and operand != SP and not operand in registers:
+				registers[operand] = len(registers)
+	return registers
+
+def GetLiveOut(instructions, registers, successors):
+	"""Get a bit set of the registers live after each instruction."""
+	size = len(instructions)
+	uses = []
+	defs = []
+	for inst in instructions:
+		use = 0
+		for operand in GetReadOperands(inst):
+			if operand in registers:
+				use |= 1 << registers[operand]
+		uses.append(use)
+		written = GetWrittenOperand(inst)
+		if written in registers:
+			defs.append(1 << registers[written])
+		else:
+			defs.append(0)
+	liveIn = [0] * size
+	liveOut = [0] * size
+	changed = True
+	while changed:
+		changed = False
+		for position in range(size - 1, -1, -1):
+			out = 0
+			for successor in successors[position]:
+				out |= liveIn[successor]
+			live = uses[position] | (out & ~defs[position])
+			if out != liveOut[position] or live != liveIn[position]:
+				liveOut[position] = out
+				liveIn[position] = live
+				changed = True
+	return liveOut
+
+class RegisterAllocator:
+	"""Maps the unbounded virtual registers of a finished program onto a bounded set of registers using liveness analysis. Registers that don't fit are spilled to RAM starting at spillAddress, which is required when anything is spilled."""
+	def __init__(self, registerCount=8, spillAddress=None):
+		self.RegisterCount = registerCount
+		self.SpillAddress = spillAddress
+		self.Assignment = {}
+		self.Spills = {}
+		self.ScratchRegisters = []
+		self.VirtualRegisterCount = 0
+		self.MaxLive = 0
+		self.PeakRegisterCount = 0
+		self.SpillInstructionCount = 0
+		self.RegisterWeights = {}
+
+	def _GetInterference(self, instructions, registers, liveOut):
+		neighbours = [0] * len(registers)
+		for position in range(len(instructions)):
+			inst = instructions[position]
+			written = GetWrittenOperand(inst)
+			live = liveOut[position]
+			self.MaxLive = max(self.MaxLive, bin(live).count("1"))
+			if not written in registers:
+				continue
+			index = registers[written]
+			#A move doesn't make its target interfere with its source.
+			if inst.Operation == MOV and inst.OperandB in registers:
+				live &= ~(1 << registers[inst.OperandB])
+			live &= ~(1 << index)
+			neighbours[index] |= live
+			other = 0
+			while live:
+				if live & 1:
+					neighbours[other] |= 1 << index
+				live >>= 1
+				other += 1
+		return neighbours
+
+	def _Color(self, registers, neighbours):
+		names = list(registers)
+		order = sorted(names, key=lambda name: -self.RegisterWeights.get(name, 0))
+		colors = {}
+		for name in order:
+			index = registers[name]
+			used = set()
+			mask = neighbours[index]
+			other = 0
+			while mask:
+				if mask & 1 and names[other] in colors:
+					used.add(colors[names[other]])
+				mask >>= 1
+				other += 1
+			for color in range(self.RegisterCount):
+				if not color in used:
+					colors[name] = color
+					break
+			if not name in colors:
+				self.Spills[name] = len(self.Spills)
+		return colors
+
+	def _GetSpillAddress(self, emitter, name):
+		return self.SpillAddress + self.Spills[name]
+
+	def _RewriteInstruction(self, emitter, inst):
+		operands = inst.GetOperands()
+		written = GetWrittenOperand(inst)
+		reads = GetReadOperands(inst)
+		before = []
+		after = []
+		scratch = {}
+		for operand in reads:
+			if operand in self.Spills and not operand in scratch:
+				scratch[operand] = self.ScratchRegisters[len(scratch)]
+				before.append(Instruction(LOD, scratch[operand], self._GetSpillAddress(emitter, operand)))
+		if written in self.Spills:
+			if not written in scratch:
+				scratch[written] = self.ScratchRegisters[0]
+			after.append(Instruction(STR, self._GetSpillAddress(emitter, written), scratch[written]))
+		for i in range(len(operands)):
+			if operands[i] in scratch:
+				operands[i] = scratch[operands[i]]
+			elif operands[i] in self.Assignment:
+				operands[i] = self.Assignment[operands[i]]
+		while len(operands) < 3:
+			operands.append(None)
+		self.SpillInstructionCount += len(before) + len(after)
+		return before + [Instruction(inst.Operation, operands[0], operands[1], operands[2])] + after
+
+	def Run(self, emitter):
+		"""Allocate the registers of an emitter's instructions in place."""
+		labelPositions = GetLabelPositions(emitter)
+		instructions = emitter.Instructions
+		registers = GetRegisterIndices(instructions)
+		self.VirtualRegisterCount = len(registers)
+		depths = GetLoopDepths(emitter, labelPositions)
+		for position in range(len(instructions)):
+			for operand in instructions[position].GetOperands():
+				if operand in registers:
+					self.RegisterWeights[operand] = self.RegisterWeights.get(operand, 0) + 10 ** min(depths[position], 6)
+		liveOut = GetLiveOut(instructions, registers, GetSuccessors(emitter, labelPositions))
+		colors = self._Color(registers, self._GetInterference(instructions, registers, liveOut))
+		if len(self.Spills) > 0 and self.SpillAddress == None:
+			#The memory manager may use every address up to its maximum, so there is no safe default for spill slots.
+			raise ValueError(str(len(self.Spills)) + " registers have to be spilled, but no spillAddress was given.")
+		for name in colors:
+			self.Assignment[name] = "R" + str(colors[name] + 1)
+		physicalCount = 0
+		if len(colors) > 0:
+			physicalCount = max(colors.values()) + 1
+		scratchCount = 0
+		if len(self.Spills) > 0:
+			for inst in instructions:
+				spilled = set([operand for operand in inst.GetOperands() if operand in self.Spills])
+				scratchCount = max(scratchCount, len(spilled))
+		self.ScratchRegisters = ["R" + str(physicalCount + i + 1) for i in range(scratchCount)]
+		self.PeakRegisterCount = physicalCount + scratchCount
+		RewriteInstructions(emitter, [self._RewriteInstruction(emitter, inst) for inst in instructions])
+		emitter._Registers.Reset()
+		for i in range(self.PeakRegisterCount):
+			emitter._Registers.New()
+		return self
+
+	def GetHotRegisters(self, count=None):
+		"""Get the allocated registers ordered by loop-weighted use, hottest first."""
+		weights = {}
+		for name in self.Assignment:
+			register = self.Assignment[name]
+			weights[register] = weights.get(register, 0) + self.RegisterWeights.get(name, 0)
+		hot = sorted(weights, key=lambda register: -weights[register])
+		if count != None:
+			hot = hot[0:count]
+		return hot
+
+	def __str__(self):
+		"""Summarize the allocation."""
+		return "virtual=" + str(self.VirtualRegisterCount) + " max_live=" + str(self.MaxLive) + " peak=" + str(self.PeakRegisterCount) + " spilled=" + str(len(self.Spills)) + " spill_instructions=" + str(self.SpillInstructionCount)
+
+PEEPHOLE_NO_OPS = "noops"
+PEEPHOLE_JUMP_CHAINS = "jumpchains"
+PEEPHOLE_UNREACHABLE = "unreachable"
+PEEPHOLE_MOVES = "moves"
+PEEPHOLE_RULES = [PEEPHOLE_NO_OPS, PEEPHOLE_JUMP_CHAINS, PEEPHOLE_UNREACHABLE, PEEPHOLE_MOVES]
+
+IDENTITY_OPERATIONS = {ADD: 0, SUB: 0, OR: 0, XOR: 0, BSL: 0, BSR: 0, MLT: 1, DIV: 1}
+
+def GetLeaders(emitter):
+	"""Get the positions that can be reached other than by falling through: labels and numeric jump targets."""
+	leaders = set(emitter.Labels)
+	for inst in emitter.Instructions:
+		if inst.Operation in JUMP_OPERATIONS and isinstance(inst.OperandA, int):
+			leaders.add(inst.OperandA)
+	return leaders
+
+class PeepholeOptimizer:
+	"""Removes redundant instructions from a finished program. Labels stay attached to the instruction that follows them."""
+	def __init__(self, rules=PEEPHOLE_RULES, maxPasses=16):
+		self.Rules = rules
+		self.MaxPasses = maxPasses
+		self.Hits = {}
+		for rule in rules:
+			self.Hits[rule] = 0
+		self.RemovedCount = 0
+
+	def _Apply(self, emitter, rule, replacements, hits):
+		if hits == 0:
+			return False
+		self.Hits[rule] += hits
+		self.RemovedCount += len(emitter.Instructions) - sum([len(replacement) for replacement in replacements])
+		RewriteInstructions(emitter, replacements)
+		return True
+
+	def _IsNoOp(self, inst):
+		op = inst.Operation
+		if op == NOP:
+			return True
+		if op == MOV and inst.OperandA == inst.OperandB:
+			return True
+		if op in IDENTITY_OPERATIONS and inst.OperandA == inst.OperandB and inst.OperandC == IDENTITY_OPERATIONS[op]:
+			return True
+		return False
+
+	def _RunNoOps(self, emitter):
+		replacements = []
+		hits = 0
+		for inst in emitter.Instructions:
+			op = inst.Operation
+			if self._IsNoOp(inst):
+				replacements.append([])
+				hits += 1
+			elif op in IDENTITY_OPERATIONS and inst.OperandC == IDENTITY_OPERATIONS[op] and GetOperandKind(inst.OperandB) == OPERAND_REGISTER:
+				#An identity operation on a register is a move.
+				replacements.append([Instruction(MOV, inst.OperandA, inst.OperandB)])
+				hits += 1
+			else:
+				replacements.append([inst])
+		return self._Apply(emitter, PEEPHOLE_NO_OPS, replacements, hits)
+
+	def _RunJumpChains(self, emitter):
+		labelPositions = GetLabelPositions(emitter)
+		instructions = emitter.Instructions
+		replacements = []
+		hits = 0
+		for position in range(len(instructions)):
+			inst = instructions[position]
+			target = inst.OperandA
+			if inst.Operation in BRANCHES and target in labelPositions:
+				#Follow jumps that land on an unconditional jump to a label.
+				visited = set([target])
+				while labelPositions[target] < len(instructions):
+					next = instructions[labelPositions[target]]
+					if next.Operation != JMP or not next.OperandA in labelPositions or next.OperandA in visited:
+						break
+					target = next.OperandA
+					visited.add(target)
+				if labelPositions[target] == position + 1:
+					#A jump to the next instruction does nothing.
+					replacements.append([])
+					hits += 1
+					continue
+				if target != inst.OperandA:
+					replacements.append([Instruction(inst.Operation, target, inst.OperandB, inst.OperandC)])
+					hits += 1
+					continue
+			replacements.append([inst])
+		return self._Apply(emitter, PEEPHOLE_JUMP_CHAINS, replacements, hits)
+
+	def _RunUnreachable(self, emitter):
+		leaders = GetLeaders(emitter)
+		replacements = []
+		hits = 0
+		reachable = True
+		for position in range(len(emitter.Instructions)):
+			inst = emitter.Instructions[position]
+			if position in leaders:
+				reachable = True
+			if reachable:
+				replacements.append([inst])
+			else:
+				replacements.append([])
+				hits += 1
+			if inst.Operation in [JMP, RET, HLT]:
+				reachable = False
+		return self._Apply(emitter, PEEPHOLE_UNREACHABLE, replacements, hits)
+
+	def _RunMoves(self, emitter):
+		instructions = emitter.Instructions
+		leaders = GetLeaders(emitter)
+		registers = GetRegisterIndices(instructions)
+		liveOut = GetLiveOut(instructions, registers, GetSuccessors(emitter))
+		replacements = [[inst] for inst in instructions]
+		hits = 0
+		position = 0
+		while position + 1 < len(instructions):
+			inst = instructions[position]
+			next = instructions[position + 1]
+			if position + 1 in leaders:
+				position += 1
+				continue
+			combined = None
+			source = inst.OperandA
+			dead = source in registers and not ((liveOut[position + 1] >> registers[source]) & 1)
+			if next.Operation == MOV and next.OperandB == source and source in registers and GetOperandKind(next.OperandA) == OPERAND_REGISTER and GetWrittenOperand(inst) == source and dead:
+				#Write straight to the target of a move from a dead register.
+				combined = [Instruction(inst.Operation, next.OperandA, inst.OperandB, inst.OperandC)]
+			elif inst.Operation == MOV and source in registers and GetOperandKind(inst.OperandB) == OPERAND_REGISTER and inst.OperandB != SP and source in GetReadOperands(next) and (dead or GetWrittenOperand(next) == source):
+				#Read the source of a move instead of its dead target.
+				operands = next.GetOperands()
+				written = GetWrittenOperand(next)
+				for i in range(len(operands)):
+					if operands[i] == source and not (i == 0 and written != None):
+						operands[i] = inst.OperandB
+				while len(operands) < 3:
+					operands.append(None)
+				combined = [Instruction(next.Operation, operands[0], operands[1], operands[2])]
+			elif inst.Operation == MOV and next.Operation == MOV and next.OperandA == inst.OperandB and next.OperandB == source:
+				#Moving a value back to where it came from.
+				combined = [inst]
+			elif inst.Operation == PSH and next.Operation == POP and inst.OperandA != SP and next.OperandA != SP:
+				#A push followed by a pop is a move.
+				if inst.OperandA == next.OperandA:
+					combined = []
+				elif GetOperandKind(inst.OperandA) != OPERAND_REGISTER:
+					combined = [Instruction(IMM, next.OperandA, inst.OperandA)]
+				else:
+					combined = [Instruction(MOV, next.OperandA, inst.OperandA)]
+			if combined == None:
+				position += 1
+				continue
+			replacements[position] = combined
+			replacements[position + 1] = []
+			hits += 1
+			position += 2
+		return self._Apply(emitter, PEEPHOLE_MOVES, replacements, hits)
+
+	def Run(self, emitter):
+		"""Optimize an emitter's instructions in place until no rule applies."""
+		rules = {
+			PEEPHOLE_NO_OPS: self._RunNoOps,
+			PEEPHOLE_JUMP_CHAINS: self._RunJumpChains,
+			PEEPHOLE_UNREACHABLE: self._RunUnreachable,
+			PEEPHOLE_MOVES: self._RunMoves
+		}
+		for i in range(self.MaxPasses):
+			changed = False
+			for rule in self.Rules:
+				if rules[rule](emitter):
+					changed = True
+			if not changed:
+				break
+		return self
+
+	def __str__(self):
+		"""Summarize the rules that applied."""
+		return " ".join([rule + "=" + str(self.Hits[rule]) for rule in self.Rules]) + " removed=" + str(self.RemovedCount)
+
+#Folded values must be valid immediates for every target, so they are kept within a signed 32-bit word.
+CONSTANT_MIN = -(1 << 31)
+CONSTANT_MAX = (1 << 31) - 1
+
+CONSTANT_OPERATIONS = {
+	IMM: lambda b, c: b,
+	MOV: lambda b, c: b,
+	ADD: lambda b, c: b + c,
+	SUB: lambda b, c: b - c,
+	MLT: lambda b, c: b * c,
+	AND: lambda b, c: b & c,
+	OR: lambda b, c: b | c,
+	XOR: lambda b, c: b ^ c,
+	NOT: lambda b, c: ~b,
+	INC: lambda b, c: b + 1,
+	DEC: lambda b, c: b - 1,
+	LSH: lambda b, c: b << 1,
+	RSH: lambda b, c: b >> 1,
+	BSL: lambda b, c: b << c,
+	BSR: lambda b, c: b >> c,
+	DIV: lambda b, c: b // c,
+	MOD: lambda b, c: b % c
+}
+
+#Targets differ on division, right shifts and ordered comparisons of negative words, so those only fold for non-negative operands.
+UNSIGNED_OPERATIONS = [RSH, BSR, DIV, MOD, BRL, BLE, BRG, BGE]
+
+CONSTANT_BRANCHES = {
+	BRZ: lambda b, c: b == 0,
+	BNZ: lambda b, c: b != 0,
+	BRE: lambda b, c: b == c,
+	BNE: lambda b, c: b != c,
+	BRL: lambda b, c: b < c,
+	BLE: lambda b, c: b <= c,
+	BRG: lambda b, c: b > c,
+	BGE: lambda b, c: b >= c
+}
+
+#Operations that can't take an immediate in place of a register operand on every target.
+REGISTER_OPERAND_C_OPERATIONS = [MLT, DIV, MOD]
+
+class ConstantPropagator:
+	"""Propagates constant registers through the control flow graph of a finished program, folds arithmetic on them, resolves branches with known conditions and removes unreachable instructions and writes to registers that are never read. Registers hold no known value when the program starts."""
+	def __init__(self, maxPasses=16):
+		self.MaxPasses = maxPasses
+		self.Folded = 0
+		self.Propagated = 0
+		self.Branches = 0
+		self.Unreachable = 0
+		self.DeadStores = 0
+		self.RemovedCount = 0
+
+	def _GetValue(self, operand, state):
+		if operand == ZERO:
+			return 0
+		kind = GetOperandKind(operand)
+		if kind == OPERAND_REGISTER:
+			return state.get(operand)
+		if kind == OPERAND_IMMEDIATE and isinstance(operand, int) and CONSTANT_MIN <= operand <= CONSTANT_MAX:
+			return operand
+		return None
+
+	def _Fold(self, inst, state):
+		#Get the constant result of an instruction, or None if it isn't known.
+		op = inst.Operation
+		b = self._GetValue(inst.OperandB, state)
+		c = 0
+		if op in [ADD, SUB, MLT, AND, OR, XOR, BSL, BSR, DIV, MOD]:
+			c = self._GetValue(inst.OperandC, state)
+		if b == None or c == None:
+			return None
+		if op in UNSIGNED_OPERATIONS and (b < 0 or c < 0):
+			return None
+		if (op == DIV or op == MOD) and c == 0:
+			return None
+		if (op == BSL or op == BSR) and (c < 0 or c >= 32):
+			return None
+		value = CONSTANT_OPERATIONS[op](b, c)
+		if value < CONSTANT_MIN or value > CONSTANT_MAX:
+			return None
+		return value
+
+	def _GetCondition(self, inst, state):
+		#Get whether a conditional branch is taken, or None if it isn't known.
+		b = self._GetValue(inst.OperandB, state)
+		c = 0
+		if not inst.Operation in [BRZ, BNZ]:
+			c = self._GetValue(inst.OperandC, state)
+		if b == None or c == None:
+			return None
+		if inst.Operation in UNSIGNED_OPERATIONS and (b < 0 or c < 0):
+			return None
+		return CONSTANT_BRANCHES[inst.Operation](b, c)
+
+	def _GetTarget(self, inst, labelPositions):
+		if GetOperandKind(inst.OperandA) == OPERAND_LABEL:
+			return labelPositions.get(inst.OperandA)
+		if isinstance(inst.OperandA, int):
+			return inst.OperandA
+		return None
+
+	def _Transfer(self, inst, state):
+		written = GetWrittenOperand(inst)
+		if written == None or written == ZERO or written == SP:
+			return state
+		state = dict(state)
+		value = None
+		if inst.Operation in CONSTANT_OPERATIONS:
+			value = self._Fold(inst, state)
+		if value == None:
+			state.pop(written, None)
+		else:
+			state[written] = value
+		return state
+
+	def _Analyze(self, emitter, labelPositions):
+		#Get the known register values before each instruction, or None for instructions that are never reached.
+		instructions = emitter.Instructions
+		size = len(instructions)
+		successors = GetSuccessors(emitter, labelPositions)
+		states = [None] * size
+		if size == 0:
+			return states
+		states[0] = {}
+		work = [0]
+		queued = set(work)
+		while len(work) > 0:
+			position = work.pop()
+			queued.discard(position)
+			inst = instructions[position]
+			state = self._Transfer(inst, states[position])
+			targets = successors[position]
+			if inst.Operation in CONSTANT_BRANCHES:
+				taken = self._GetCondition(inst, state)
+				target = self._GetTarget(inst, labelPositions)
+				if taken == True and target != None:
+					targets = [target]
+				elif taken == False:
+					targets = [position + 1]
+			for successor in targets:
+				if successor < 0 or successor >= size:
+					continue
+				old = states[successor]
+				if old == None:
+					new = state
+				else:
+					new = {register: value for register, value in old.items() if state.get(register) == value}
+				if old == None or len(new) != len(old):
+					states[successor] = new
+					if not successor in queued:
+						work.append(successor)
+						queued.add(successor)
+		return states
+
+	def _Propagate(self, emitter):
+		labelPositions = GetLabelPositions(emitter)
+		instructions = emitter.Instructions
+		states = self._Analyze(emitter, labelPositions)
+		replacements = []
+		changed = False
+		for position in range(len(instructions)):
+			inst = instructions[position]
+			state = states[position]
+			op = inst.Operation
+			if state == None:
+				replacements.append([])
+				self.Unreachable += 1
+				changed = True
+				continue
+			replacement = [inst]
+			written = GetWrittenOperand(inst)
+			if op in CONSTANT_BRANCHES:
+				taken = self._GetCondition(inst, state)
+				target = self._GetTarget(inst, labelPositions)
+				if taken == True and target != None and target != position + 1:
+					replacement = [Instruction(JMP, inst.OperandA)]
+				elif taken != None and (taken == False or target == position + 1):
+					replacement = []
+				if len(replacement) == 0 or not replacement[0] is inst:
+					self.Branches += 1
+			elif op == JMP and self._GetTarget(inst, labelPositions) == position + 1:
+				#Resolved branches can leave a jump over instructions that were removed.
+				replacement = []
+				self.Branches += 1
+			elif op in CONSTANT_OPERATIONS and written != None and written != ZERO and written != SP and op != IMM:
+				value = self._Fold(inst, state)
+				if value != None:
+					replacement = [Instruction(IMM, written, value)]
+					self.Folded += 1
+			if len(replacement) == 1 and replacement[0] is inst:
+				replacement = [self._Substitute(inst, state)]
+			if len(replacement) != 1 or not replacement[0] is inst:
+				changed = True
+			replacements.append(replacement)
+		if changed:
+			self.RemovedCount += len(instructions) - sum([len(replacement) for replacement in replacements])
+			RewriteInstructions(emitter, replacements)
+		return changed
+
+	def _Substitute(self, inst, state):
+		#Replace registers with known values by immediates.
+		op = inst.Operation
+		operands = inst.GetOperands()
+		if op in WRITE_OPERATIONS and op != POP:
+			indices = [1, 2]
+			if op in REGISTER_OPERAND_C_OPERATIONS:
+				indices = [1]
+		elif op in CONSTANT_BRANCHES:
+			indices = [1, 2]
+		elif op == STR:
+			indices = [0, 1]
+		elif op == PSH:
+			indices = [0]
+		else:
+			return inst
+		hits = 0
+		for i in indices:
+			if i < len(operands) and operands[i] != ZERO and GetOperandKind(operands[i]) == OPERAND_REGISTER and operands[i] in state:
+				operands[i] = state[operands[i]]
+				hits += 1
+		if hits == 0:
+			return inst
+		self.Propagated += hits
+		while len(operands) < 3:
+			operands.append(None)
+		return Instruction(op, operands[0], operands[1], operands[2])
+
+	def _IsRemovable(self, inst):
+		op = inst.Operation
+		if op == POP or not op in WRITE_OPERATIONS:
+			return False
+		if op == DIV or op == MOD:
+			#Removing a division could hide a division by zero.
+			return isinstance(inst.OperandC, int) and inst.OperandC != 0
+		return True
+
+	def _RemoveDeadStores(self, emitter):
+		instructions = emitter.Instructions
+		registers = GetRegisterIndices(instructions)
+		liveOut = GetLiveOut(instructions, registers, GetSuccessors(emitter))
+		replacements = []
+		hits = 0
+		for position in range(len(instructions)):
+			inst = instructions[position]
+			written = GetWrittenOperand(inst)
+			dead = written == ZERO or (written in registers and not ((liveOut[position] >> registers[written]) & 1))
+			if dead and self._IsRemovable(inst):
+				replacements.append([])
+				hits += 1
+			else:
+				replacements.append([inst])
+		if hits == 0:
+			return False
+		self.DeadStores += hits
+		self.RemovedCount += hits
+		RewriteInstructions(emitter, replacements)
+		return True
+
+	def Run(self, emitter):
+		"""Optimize an emitter's instructions in place until nothing changes. Registers only read after the program halts may lose their final values."""
+		for i in range(self.MaxPasses):
+			changed = self._Propagate(emitter)
+			if self._RemoveDeadStores(emitter):
+				changed = True
+			if not changed:
+				break
+		return self
+
+	def __str__(self):
+		"""Summarize the changes."""
+		return "folded=" + str(self.Folded) + " propagated=" + str(self.Propagated) + " branches=" + str(self.Branches) + " unreachable=" + str(self.Unreachable) + " dead_stores=" + str(self.DeadStores) + " removed=" + str(self.RemovedCount)
@@ -0,0 +1,224 @@
+import json
+import sys
+from urcl import *
+
+PROFILE_VERSION = 1
+
+CONDITIONAL_BRANCHES = [op for op in BRANCHES if op != JMP]
+
+def _GetOperation(source):
+	inst = ParseInstruction(source)
+	if inst == None or isinstance(inst, str):
+		return None
+	return inst.Operation
+
+class Profile:
+	"""Execution counts of a profiled program, with the instruction sources and labels needed to report them."""
+	def __init__(self, counts, jumps, loads, stores, folded, sources, labels, rangeBits=8):
+		self.Counts = counts
+		self.Jumps = jumps
+		self.Loads = loads
+		self.Stores = stores
+		self.Folded = folded
+		self.Sources = sources
+		self.Labels = labels
+		self.RangeBits = rangeBits
+
+	def GetTotal(self):
+		"""Get the number of instructions executed."""
+		return sum(self.Counts)
+
+	def GetLabelAt(self, position):
+		"""Get the last label marked at or before a ROM address, or None if there is none."""
+		label = None
+		labelPosition = -1
+		for name, target in self.Labels.items():
+			if target <= position and target > labelPosition:
+				label = name
+				labelPosition = target
+		return label
+
+	def GetRegions(self):
+		"""Get (count, instructions, label) for each labelled region of the program. A region runs from its label up to the next one."""
+		starts = sorted([(target, name) for name, target in self.Labels.items()])
+		if len(starts) == 0 or starts[0][0] > 0:
+			starts = [(0, "program")] + starts
+		regions = {}
+		for i in range(len(starts)):
+			start, name = starts[i]
+			end = len(self.Counts)
+			if i + 1 < len(starts):
+				end = starts[i + 1][0]
+			if end <= start:
+				continue
+			count, instructions = regions.get(name, (0, 0))
+			regions[name] = (count + sum(self.Counts[start:end]), instructions + end - start)
+		return sorted([(count, instructions, name) for name, (count, instructions) in regions.items()], key=lambda region: -region[0])
+
+	def GetBranches(self):
+		"""Get (position, taken, notTaken) for each conditional branch that was executed."""
+		branches = []
+		for position in range(len(self.Counts)):
+			if self.Counts[position] > 0 and _GetOperation(self.Sources[position]) in CONDITIONAL_BRANCHES:
+				taken = self.Jumps.get(position, 0)
+				branches.append((position, taken, self.Counts[position] - taken))
+		return branches
+
+	def GetFrameName(self, position):
+		"""Get the name of a call stack frame entered at a ROM address."""
+		for name, target in self.Labels.items():
+			if target == position:
+				return name
+		return "@" + str(position)
+
+	def GetFoldedStacks(self):
+		"""Get the call stacks in folded format, one "program;caller;callee count" line per stack."""
+		lines = []
+		for frame, count in sorted(self.Folded.items()):
+			if count > 0:
+				lines.append(";".join(["program"] + [self.GetFrameName(position) for position in frame]) + " " + str(count))
+		return "\n".join(lines) + "\n"
+
+	def Report(self, top=20):
+		"""Format the hottest instructions, labels and branches and the memory traffic as text."""
+		total = self.GetTotal()
+		lines = ["instructions=" + str(total), "", "Hot instructions:", "\tcount\tpercent\taddress\tlabel\tsource"]
+		hot = sorted([position for position in range(len(self.Counts)) if self.Counts[position] > 0], key=lambda position: -self.Counts[position])
+		for position in hot[0:top]:
+			count = self.Counts[position]
+			lines.append("\t" + str(count) + "\t" + _Percent(count, total) + "\t" + str(position) + "\t" + str(self.GetLabelAt(position)) + "\t" + self.Sources[position])
+		lines += ["", "Hot labels:", "\tcount\tpercent\tinstructions\tlabel"]
+		for count, instructions, name in self.GetRegions()[0:top]:
+			if count > 0:
+				lines.append("\t" + str(count) + "\t" + _Percent(count, total) + "\t" + str(instructions) + "\t" + name)
+		lines += ["", "Branches:", "\ttaken\tnot taken\taddress\tsource"]
+		for position, taken, notTaken in sorted(self.GetBranches(), key=lambda branch: -(branch[1] + branch[2]))[0:top]:
+			lines.append("\t" + str(taken) + "\t" + str(notTaken) + "\t" + str(position) + "\t" + self.Sources[position])
+		lines += ["", "Memory:", "\tloads\tstores\trange"]
+		for key in sorted(set(self.Loads) | set(self.Stores)):
+			lines.append("\t" + str(self.Loads.get(key, 0)) + "\t" + str(self.Stores.get(key, 0)) + "\t" + str(key << self.RangeBits) + ".." + str(((key + 1) << self.RangeBits) - 1))
+		return "\n".join(lines) + "\n"
+
+	def Save(self, path):
+		"""Write the profile to a JSON file."""
+		data = {
+			"version": PROFILE_VERSION,
+			"counts": self.Counts,
+			"jumps": [[position, count] for position, count in self.Jumps.items()],
+			"loads": [[key, count] for key, count in self.Loads.items()],
+			"stores": [[key, count] for key, count in self.Stores.items()],
+			"folded": [[list(frame), count] for frame, count in self.Folded.items()],
+			"sources": self.Sources,
+			"labels": self.Labels,
+			"rangeBits": self.RangeBits
+		}
+		with open(path, "w") as file:
+			json.dump(data, file)
+
+def _Percent(count, total):
+	if total == 0:
+		return "0.0%"
+	return str(round(count * 100 / total, 1)) + "%"
+
+def LoadProfile(path):
+	"""Read a profile written by Profile.Save."""
+	with open(path) as file:
+		data = json.load(file)
+	if data.get("version") != PROFILE_VERSION:
+		raise ValueError("\"" + str(path) + "\" has profile version " + str(data.get("version")) + ", expected " + str(PROFILE_VERSION) + ".")
+	return Profile(data["counts"],
+		{position: count for position, count in data["jumps"]},
+		{key: count for key, count in data["loads"]},
+		{key: count for key, count in data["stores"]},
+		{tuple(frame): count for frame, count in data["folded"]},
+		data["sources"], data["labels"], data["rangeBits"])
+
+def GetProfile(module):
+	"""Collect the profile of a module generated by PythonEmit with profile=True from its globals."""
+	if not "PROFILE_COUNTS" in module:
+		raise ValueError("The module was not generated with profiling enabled.")
+	folded = dict(module["PROFILE_FOLDED"])
+	#Steps since the last CAL or RET have not been charged to the current frame yet.
+	frame = module["PROFILE_FRAME"]
+	folded[frame] = folded.get(frame, 0) + module["PROFILE_STEPS"] - module["PROFILE_MARK"]
+	rom = module["ROM"]
+	sources = [getattr(rom[position], "Source", "") for position in range(len(module["PROFILE_COUNTS"]))]
+	labels = {"." + name[6:len(name)]: value for name, value in module.items() if name.startswith("LABEL_")}
+	return Profile(list(module["PROFILE_COUNTS"]), dict(module["PROFILE_JUMPS"]), dict(module["PROFILE_LOADS"]), dict(module["PROFILE_STORES"]), folded, sources, labels, module["PROFILE_RANGE_BITS"])
+
+def LoadModule(file):
+	"""Load a profiled Python module, compiling an URCL file first."""
+	if file.lower().endswith(".urcl"):
+		from urclpy import PythonEmit
+		emitter = Emitter(emitTarget=PythonEmit(useDebugger=True, profile=True))
+		with open(file) as stream:
+			for lineNumber, inst in ParseStream(stream):
+				if emitter.IsLabel(inst):
+					emitter.MarkLabel(inst)
+				else:
+					emitter.Emit(inst.Operation, inst.OperandA, inst.OperandB, inst.OperandC)
+		source = str(emitter)
+	else:
+		with open(file) as stream:
+			source = stream.read()
+	module = {}
+	exec(source, module)
+	return module
+
+if __name__ == "__main__":
+	args = sys.argv[1:len(sys.argv)]
+
+	inputs = []
+	foldedOutput = None
+	saveOutput = None
+	top = 20
+	budget = None
+	nextArg = None
+	for arg in args:
+		if arg.startswith("-"):
+			nextArg = None
+			if arg == "--folded" or arg == "--save" or arg == "--top" or arg == "--max-instructions":
+				nextArg = arg
+			else:
+				print("Unknown command line option: " + arg)
+				exit(1)
+		elif nextArg == "--folded":
+			foldedOutput = arg
+			nextArg = None
+		elif nextArg == "--save":
+			saveOutput = arg
+			nextArg = None
+		elif nextArg == "--top":
+			top = int(arg)
+			nextArg = None
+		elif nextArg == "--max-instructions":
+			budget = int(arg)
+			nextArg = None
+		else:
+			inputs += [arg]
+
+	if len(inputs) != 1:
+		print("Usage: python urclprof.py input.urcl|module.py [--top N] [--folded FILE] [--save FILE] [--max-instructions N]")
+		exit(1)
+
+	module = LoadModule(inputs[0])
+	if not "PROFILE_COUNTS" in module:
+		print("ERROR: \"" + inputs[0] + "\" was not generated with profiling enabled.")
+		exit(1)
+	executed = 0
+	try:
+		while not module["HALT"] and (budget == None or executed < budget):
+			limit = 65536
+			if budget != None:
+				limit = min(limit, budget - executed)
+			executed += module["Execute"](limit)
+	except Exception as error:
+		print("ERROR: " + str(error))
+
+	profile = GetProfile(module)
+	print(profile.Report(top), end="")
+	if foldedOutput != None:
+		with open(foldedOutput, "w") as file:
+			file.write(profile.GetFoldedStacks())
+	if saveOutput != None:
+		profile.Save(saveOutput)
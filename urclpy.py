@@ -1,76 +1,186 @@
 from urcl import *
 
+BLOCK_BINARY_OPERATIONS = {ADD: "+", SUB: "-", MLT: "*", DIV: "//", MOD: "%", AND: "&", OR: "|", XOR: "^", BSL: "<<", BSR: ">>"}
+BLOCK_UNARY_OPERATIONS = {MOV: "{0}", IMM: "{0}", LSH: "{0} << 1", RSH: "{0} >> 1", INC: "{0} + 1", DEC: "{0} - 1", NOT: "~{0}"}
+BLOCK_CONDITIONS = {BRZ: "{0} == 0", BNZ: "{0} != 0", BRE: "{0} == {1}", BNE: "{0} != {1}", BRL: "{0} < {1}", BRG: "{0} > {1}", BLE: "{0} <= {1}", BGE: "{0} >= {1}"}
+WRAPPED_OPERATIONS = [ADD, SUB, MLT, DIV, BSL, LSH, INC, DEC]
+#Immediate addresses are unsigned, so they are not wrapped to a signed word like other immediates.
+ADDRESS_OPERANDS = {LOD: [1], STR: [0], CPY: [0, 1]}
+BLOCK_OPERAND_COUNTS = {NOP: 0, HLT: 0, BRK: 0, RET: 0, PSH: 1, POP: 1, JMP: 1, CAL: 1, LOD: 2, STR: 2, CPY: 2, BRZ: 2, BNZ: 2}
+
+MEMORY_SPARSE = "sparse"
+MEMORY_DENSE = "dense"
+
+ARRAY_TYPECODES = {8: "b", 16: "h", 32: "i", 64: "q"}
+
 class PythonEmit:
-	def __init__(self, useDebugger=False, printURCLToConsole=False, printRegisterStatesToConsole=False, singleStep=False):
+	def __init__(self, useDebugger=False, printURCLToConsole=False, printRegisterStatesToConsole=False, singleStep=False, useBasicBlocks=False, memoryModel=MEMORY_SPARSE, ramSize=65536, stackSize=65536, wordBits=None, profile=False):
 		self.PrintURCLToConsole = printURCLToConsole
 		self.PrintRegisterStatesToConsole = printRegisterStatesToConsole
 		self.SingleStep = singleStep
 		self.UseDebugger = useDebugger
+		self.Profile = profile
+		self.UseBasicBlocks = useBasicBlocks and not (printURCLToConsole or printRegisterStatesToConsole or singleStep or profile)
+		self.MemoryModel = memoryModel
+		self.RAMSize = ramSize
+		self.StackSize = stackSize
+		self.WordBits = wordBits
+		self.Reset()
+
+	def Reset(self):
+		memoryModel = self.MemoryModel
+		ramSize = self.RAMSize
+		stackSize = self.StackSize
+		wordBits = self.WordBits
 		self.Registers = ["SP"]
+		self._RegisterSet = set(self.Registers)
 		self._LocalRegisters = []
 		self.Labels = {}
-		self.Source = "RAM = {}\nROM = {}\nIP = 0\nHALT = False\nBREAK = False\nSTEP = False\nSTACK = []\n" + \
-			"ERR_UNDERFLOW = ValueError(\"Stack underflow occured.\")\n\n" + \
-			"def Get(addr):\n" + \
-			"\tglobal RAM\n\tglobal STACK\n" + \
-			"\tif addr < 0:\n" + \
-			"\t\tif (-addr - 1) < len(STACK):\n" + \
-			"\t\t\treturn STACK[-addr - 1]\n" + \
-			"\t\telse:\n" + \
-			"\t\t\treturn 0\n" + \
-			"\telif addr in RAM:\n" + \
-			"\t\treturn RAM[addr]\n" + \
-			"\telse:\n" + \
-			"\t\treturn 0\n\n" + \
-			"def Set(addr, value):\n" + \
-			"\tglobal RAM\n\tglobal STACK\n" + \
-			"\tif addr < 0:\n" + \
-			"\t\twhile (-addr - 1) >= len(STACK):\n" + \
-			"\t\t\tSTACK += [0]\n" + \
-			"\t\tSTACK[-addr - 1] = value\n" + \
-			"\telse:\n" + \
-			"\t\tRAM[addr] = value\n\n" + \
-			"def Execute():\n" + \
+		profileLoad = ""
+		profileStore = ""
+		if self.Profile:
+			profileLoad = "\tPROFILE_LOADS[addr >> PROFILE_RANGE_BITS] = PROFILE_LOADS.get(addr >> PROFILE_RANGE_BITS, 0) + 1\n"
+			profileStore = "\tPROFILE_STORES[addr >> PROFILE_RANGE_BITS] = PROFILE_STORES.get(addr >> PROFILE_RANGE_BITS, 0) + 1\n"
+		if memoryModel == MEMORY_SPARSE:
+			self.Source = "RAM = {}\nROM = {}\nIP = 0\nHALT = False\nBREAK = False\nSTEP = False\nSTACK = []\n" + \
+				"ERR_UNDERFLOW = ValueError(\"Stack underflow occured.\")\n\n" + \
+				"def Get(addr):\n" + profileLoad + \
+				"\tglobal RAM\n\tglobal STACK\n" + \
+				"\tif addr < 0:\n" + \
+				"\t\tif (-addr - 1) < len(STACK):\n" + \
+				"\t\t\treturn STACK[-addr - 1]\n" + \
+				"\t\telse:\n" + \
+				"\t\t\treturn 0\n" + \
+				"\telif addr in RAM:\n" + \
+				"\t\treturn RAM[addr]\n" + \
+				"\telse:\n" + \
+				"\t\treturn 0\n\n" + \
+				"def Set(addr, value):\n" + profileStore + \
+				"\tglobal RAM\n\tglobal STACK\n" + \
+				"\tif addr < 0:\n" + \
+				"\t\twhile (-addr - 1) >= len(STACK):\n" + \
+				"\t\t\tSTACK += [0]\n" + \
+				"\t\tSTACK[-addr - 1] = value\n" + \
+				"\telse:\n" + \
+				"\t\tRAM[addr] = value\n\n"
+		elif memoryModel == MEMORY_DENSE:
+			if wordBits == None:
+				self.Source = "RAM = [0] * " + str(ramSize) + "\nSTACK = [0] * " + str(stackSize) + "\n"
+			elif wordBits in ARRAY_TYPECODES:
+				typecode = ARRAY_TYPECODES[wordBits]
+				self.Source = "from array import array\n" + \
+					"RAM = array(\"" + typecode + "\", bytes(" + str(ramSize * wordBits // 8) + "))\n" + \
+					"STACK = array(\"" + typecode + "\", bytes(" + str(stackSize * wordBits // 8) + "))\n"
+			else:
+				raise ValueError("Word width of " + str(wordBits) + " is not valid for the dense memory model.")
+			self.Source += "ROM = {}\nIP = 0\nHALT = False\nBREAK = False\nSTEP = False\n" + \
+				"ERR_UNDERFLOW = ValueError(\"Stack underflow occured.\")\n\n" + \
+				"def Get(addr):\n" + profileLoad + \
+				"\tif " + self.GetStackCondition("addr") + ":\n" + \
+				"\t\treturn STACK[~addr]\n" + \
+				"\tif " + self.GetRAMCondition("addr") + ":\n" + \
+				"\t\treturn RAM[" + self.GetRAMIndex("addr") + "]\n" + \
+				"\traise ValueError(\"Data segfault at address \" + str(addr) + \".\")\n\n" + \
+				"def Set(addr, value):\n" + profileStore + \
+				"\tif " + self.GetStackCondition("addr") + ":\n" + \
+				"\t\tSTACK[~addr] = value\n" + \
+				"\telif " + self.GetRAMCondition("addr") + ":\n" + \
+				"\t\tRAM[" + self.GetRAMIndex("addr") + "] = value\n" + \
+				"\telse:\n" + \
+				"\t\traise ValueError(\"Data segfault at address \" + str(addr) + \".\")\n\n"
+		else:
+			raise ValueError("Memory model \"" + str(memoryModel) + "\" is not valid.")
+		if self.Profile:
+			self.Source += self.GetProfileCode()
+		#SP_MIN keeps the lowest stack pointer seen between steps and blocks, since a dense stack is allocated up front.
+		self.Source += "SP_MIN = 0\n\n" + \
+			"def Execute(limit=None):\n" + \
 			"\tglobal ROM\n" + \
 			"\tglobal IP\n" + \
 			"\tglobal HALT\n" + \
 			"\tglobal BREAK\n" + \
-			"\tglobal STEP\n\n" + \
-			"\tBREAK = False\n" + \
-			"\twhile not HALT:\n" + \
-			"\t\tif not IP in ROM:\n" + \
+			"\tglobal STEP\n" + \
+			"\tglobal SP_MIN\n"
+		if self.Profile:
+			self.Source += "\tglobal PROFILE_STEPS\n"
+		self.Source += "\n\tBREAK = False\n" + \
+			"\tif limit != None:\n" + \
+			"\t\texecuted = 0\n" + \
+			"\t\twhile not HALT and executed < limit:\n" + \
+			"\t\t\tif not IP in ROM:\n" + \
+			"\t\t\t\traise ValueError(\"Instruction pointer is out of bounds.\")\n" + \
+			self.GetExecuteStep("\t\t\t") + \
+			"\t\t\texecuted += 1\n" + \
+			"\t\t\tif STEP or BREAK:\n" + \
+			"\t\t\t\tbreak\n" + \
+			"\t\treturn executed\n" + \
+			"\twhile not HALT:\n"
+		if self.UseBasicBlocks:
+			self.Source = "BLOCKS = {}\n" + self.Source + \
+				"\t\tif not STEP and IP in BLOCKS:\n" + \
+				"\t\t\tBLOCKS[IP]()\n" + \
+				"\t\t\tif SP < SP_MIN:\n" + \
+				"\t\t\t\tSP_MIN = SP\n" + \
+				"\t\t\tif BREAK:\n" + \
+				"\t\t\t\treturn\n" + \
+				"\t\t\tcontinue\n"
+		self.Source += "\t\tif not IP in ROM:\n" + \
 			"\t\t\traise ValueError(\"Instruction pointer is out of bounds.\")\n" + \
-			"\t\tROM[IP]()\n" + \
-			"\t\tIP += 1\n" + \
+			self.GetExecuteStep("\t\t") + \
 			"\t\tif STEP or BREAK:\n" + \
 			"\t\t\treturn\n\n"
+
+	def GetExecuteStep(self, indent):
+		if not self.Profile:
+			lines = ["ROM[IP]()", "IP += 1", "if SP < SP_MIN:", "\tSP_MIN = SP"]
+		else:
+			lines = ["position = IP",
+				"PROFILE_COUNTS[position] += 1",
+				"PROFILE_STEPS += 1",
+				"ROM[position]()",
+				"IP += 1",
+				"if SP < SP_MIN:",
+				"\tSP_MIN = SP",
+				"if IP != position + 1:",
+				"\tPROFILE_JUMPS[position] = PROFILE_JUMPS.get(position, 0) + 1",
+				"\tif position in PROFILE_FRAMES:",
+				"\t\tProfileFrame(position)"]
+		return "".join([indent + line + "\n" for line in lines])
+
+	def GetProfileCode(self):
+		#Instructions are counted by the Execute loop. Steps are charged to the current call stack whenever a CAL or RET changes it.
+		return "PROFILE_RANGE_BITS = 8\n" + \
+			"PROFILE_COUNTS = []\n" + \
+			"PROFILE_JUMPS = {}\n" + \
+			"PROFILE_LOADS = {}\n" + \
+			"PROFILE_STORES = {}\n" + \
+			"PROFILE_CALLS = set()\n" + \
+			"PROFILE_FRAMES = set()\n" + \
+			"PROFILE_FOLDED = {}\n" + \
+			"PROFILE_FRAME = ()\n" + \
+			"PROFILE_STEPS = 0\n" + \
+			"PROFILE_MARK = 0\n\n" + \
+			"def ProfileFrame(position):\n" + \
+			"\tglobal PROFILE_FRAME\n" + \
+			"\tglobal PROFILE_MARK\n" + \
+			"\tPROFILE_FOLDED[PROFILE_FRAME] = PROFILE_FOLDED.get(PROFILE_FRAME, 0) + PROFILE_STEPS - PROFILE_MARK\n" + \
+			"\tPROFILE_MARK = PROFILE_STEPS\n" + \
+			"\tif position in PROFILE_CALLS:\n" + \
+			"\t\tPROFILE_FRAME = PROFILE_FRAME + (IP,)\n" + \
+			"\telif len(PROFILE_FRAME) > 0:\n" + \
+			"\t\tPROFILE_FRAME = PROFILE_FRAME[0:-1]\n\n"
 	
 	def IsLabel(self, value):
-		if value == None:
-			return False
-		value = str(value)
-		return len(value) > 0 and value[0] == '.'
+		return GetOperandKind(value) == OPERAND_LABEL
 	
 	def IsRegister(self, value):
-		value = str(value)
-		if value == None:
-			return False
-		elif value != "R0" and (len(value) > 0 and value[0] == "R"):
-			try:
-				value = int(value[1:len(value)])
-				return True
-			except:
-				return False
-		else:
-			return value == "SP"
+		return value != ZERO and GetOperandKind(value) == OPERAND_REGISTER
 	
 	def IncludeInstructionRegisters(self, inst):
-		if self.IsRegister(inst.OperandA) and not inst.OperandA in self.Registers:
-			self.Registers += [inst.OperandA]
-		if self.IsRegister(inst.OperandB) and not inst.OperandB in self.Registers:
-			self.Registers += [inst.OperandB]
-		if self.IsRegister(inst.OperandC) and not inst.OperandC in self.Registers:
-			self.Registers += [inst.OperandC]
+		for operand in inst.GetOperands():
+			if self.IsRegister(operand) and not operand in self._RegisterSet:
+				self._RegisterSet.add(operand)
+				self.Registers += [operand]
 
 	def GetLabelName(self, label):
 		return "LABEL_" + label[1:len(label)]
@@ -96,6 +206,37 @@ class PythonEmit:
 		else:
 			self.Source += "\t" + str(target) + " = " + str(a) + " " + str(op) + " " + str(b) + "\n"
 	
+	def GetRAMIndex(self, address):
+		#Wrapped words are signed, so an address outside the stack is read back as an unsigned word before it indexes RAM.
+		#Callers test the stack first, since a masked stack address would otherwise land at the top of RAM.
+		if self.WordBits == None:
+			return address
+		return address + " & " + str((1 << self.WordBits) - 1)
+
+	def GetRAMCondition(self, address):
+		if self.WordBits == None:
+			return "0 <= " + address + " < " + str(self.RAMSize)
+		return self.GetRAMIndex(address) + " < " + str(self.RAMSize)
+
+	def GetStackCondition(self, address):
+		return str(-self.StackSize) + " <= " + address + " < 0"
+
+	def WrapValue(self, value):
+		half = 1 << (self.WordBits - 1)
+		return ((value + half) & ((1 << self.WordBits) - 1)) - half
+
+	def WrapExpression(self, expression):
+		if self.WordBits == None:
+			return expression
+		half = 1 << (self.WordBits - 1)
+		return "(((" + expression + ") + " + str(half) + ") & " + str((1 << self.WordBits) - 1) + ") - " + str(half)
+
+	def EmitArithmetic(self, target, a, op, b):
+		if self.WordBits == None:
+			self.EmitOperation(target, a, op, b)
+		else:
+			self.EmitAssignment(target, self.WrapExpression(str(a) + " " + str(op) + " " + str(b)))
+
 	def EmitAssignment(self, target, source):
 		self.EmitOperation(target, target, "", source)
 	
@@ -103,14 +244,23 @@ class PythonEmit:
 		self.Source += "\tif " + str(a) + " " + str(op) + " " + str(b) + ":\n\t"
 	
 	def EmitBranch(self, target, a, op, b):
+		self.EmitGlobal("IP")
 		self.EmitConditional(a, op, b)
 		self.EmitOperation("IP", target, "-", 1)
 
 	def EmitLoad(self, target, address):
-		self.Source += "\t" + str(target) + " = Get(" + str(address) + ")\n"
+		if self.MemoryModel == MEMORY_DENSE and not self.Profile:
+			self.Source += "\t" + self.GetBlockLoad(str(target), str(address))[0] + "\n"
+		else:
+			self.Source += "\t" + str(target) + " = Get(" + str(address) + ")\n"
 	
 	def EmitStore(self, address, source):
-		self.Source += "\tSet(" + str(address) + ", " + str(source) + ")\n"
+		#Profiled modules go through Get and Set so every access is counted.
+		if self.MemoryModel == MEMORY_DENSE and not self.Profile:
+			for line in self.GetBlockStore(str(address), str(source)):
+				self.Source += "\t" + line + "\n"
+		else:
+			self.Source += "\tSet(" + str(address) + ", " + str(source) + ")\n"
 	
 	def EmitCopy(self, target, source):
 		self.Source += "\tSet(" + str(target) + ", Get(" + str(source) + "))\n"
@@ -151,7 +301,7 @@ class PythonEmit:
 		if not reg in self._LocalRegisters:
 			self._LocalRegisters += [reg]
 
-	def ResolveOperand(self, operand):
+	def ResolveOperand(self, operand, isAddress=False):
 		if self.IsRegister(operand):
 			self.EmitGlobal(operand)
 			self.UseRegister(operand)
@@ -160,6 +310,8 @@ class PythonEmit:
 			self.EmitGlobal(operand)
 		elif operand == ZERO:
 			operand = 0
+		elif isinstance(operand, int) and self.WordBits != None and not isAddress:
+			operand = self.WrapValue(operand)
 		return operand
 
 	def EmitInstructionCode(self, inst, position):
@@ -171,9 +323,10 @@ class PythonEmit:
 		if self.PrintURCLToConsole:
 			self.EmitPrint("\n" + str(inst))
 
-		inst.OperandA = self.ResolveOperand(inst.OperandA)
-		inst.OperandB = self.ResolveOperand(inst.OperandB)
-		inst.OperandC = self.ResolveOperand(inst.OperandC)
+		addresses = ADDRESS_OPERANDS.get(inst.Operation, [])
+		a = self.ResolveOperand(inst.OperandA, 0 in addresses)
+		b = self.ResolveOperand(inst.OperandB, 1 in addresses)
+		c = self.ResolveOperand(inst.OperandC)
 
 		if self.PrintRegisterStatesToConsole and len(self._LocalRegisters) > 0:
 			self.EmitPrint("Pre-operation registers:")
@@ -184,10 +337,10 @@ class PythonEmit:
 			self.Source += "\tinput(\"Press enter to execute...\")\n"
 
 		op = inst.Operation
-		isZeroOperand = inst.OperandA == None
-		isOneOperand = inst.OperandA != None and inst.OperandB == None
-		isTwoOperand = inst.OperandA != None and inst.OperandB != None and inst.OperandC == None
-		isThreeOperand = inst.OperandA != None and inst.OperandB != None and inst.OperandC != None
+		isZeroOperand = a == None
+		isOneOperand = a != None and b == None
+		isTwoOperand = a != None and b != None and c == None
+		isThreeOperand = a != None and b != None and c != None
 
 		if isZeroOperand:
 			if op == NOP:
@@ -207,81 +360,79 @@ class PythonEmit:
 		elif isOneOperand:
 			if op == PSH:
 				self.EmitGlobal("SP")
-				self.EmitPush(inst.OperandA)
+				self.EmitPush(a)
 			elif op == POP:
 				self.EmitGlobal("SP")
 				self.EmitGlobal("ERR_UNDERFLOW")
-				self.EmitPop(inst.OperandA)
+				self.EmitPop(a)
 			elif op == JMP:
 				self.EmitGlobal("IP")
-				self.EmitOperation("IP", inst.OperandA, "-", 1)
+				self.EmitOperation("IP", a, "-", 1)
 			elif op == CAL:
 				self.EmitGlobal("IP")
 				self.EmitGlobal("SP")
 				self.EmitPush("IP")
-				self.EmitOperation("IP", inst.OperandA, "-", 1)
+				self.EmitOperation("IP", a, "-", 1)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take one operand.")
 		elif isTwoOperand:
 			if op == LOD:
-				self.EmitLoad(inst.OperandA, inst.OperandB)
+				self.EmitLoad(a, b)
 			elif op == STR:
-				self.EmitStore(inst.OperandA, inst.OperandB)
+				self.EmitStore(a, b)
 			elif op == MOV or op == IMM:
-				self.EmitOperation(inst.OperandA, inst.OperandA, "", inst.OperandB)
+				self.EmitOperation(a, a, "", b)
 			elif op == LSH:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "<<", 1)
+				self.EmitArithmetic(a, b, "<<", 1)
 			elif op == RSH:
-				self.EmitOperation(inst.OperandA, inst.OperandB, ">>", 1)
+				self.EmitOperation(a, b, ">>", 1)
 			elif op == INC:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "+", 1)
+				self.EmitArithmetic(a, b, "+", 1)
 			elif op == DEC:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "-", 1)
+				self.EmitArithmetic(a, b, "-", 1)
 			elif op == NOT:
-				self.EmitAssignment(inst.OperandA, "~" + str(inst.OperandB))
+				self.EmitAssignment(a, "~" + str(b))
 			elif op == BRZ:
-				self.EmitGlobal("IP")
-				self.EmitBranch(inst.OperandA, inst.OperandB, "==", 0)
+				self.EmitBranch(a, b, "==", 0)
 			elif op == BNZ:
-				self.EmitGlobal("IP")
-				self.EmitBranch(inst.OperandA, inst.OperandB, "!=", 0)
+				self.EmitBranch(a, b, "!=", 0)
 			elif op == CPY:
-				self.EmitCopy(inst.OperandA, inst.OperandB)
+				self.EmitCopy(a, b)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take two operands.")
 		elif isThreeOperand:
 			if op == ADD:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "+", inst.OperandC)
+				self.EmitArithmetic(a, b, "+", c)
 			elif op == SUB:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "-", inst.OperandC)
+				self.EmitArithmetic(a, b, "-", c)
 			elif op == MLT:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "*", inst.OperandC)
+				self.EmitArithmetic(a, b, "*", c)
 			elif op == DIV:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "//", inst.OperandC)
+				self.EmitArithmetic(a, b, "//", c)
 			elif op == MOD:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "%", inst.OperandC)
+				self.EmitOperation(a, b, "%", c)
 			elif op == AND:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "&", inst.OperandC)
+				self.EmitOperation(a, b, "&", c)
 			elif op == OR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "|", inst.OperandC)
+				self.EmitOperation(a, b, "|", c)
 			elif op == XOR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "^", inst.OperandC)
+				self.EmitOperation(a, b, "^", c)
 			elif op == BSL:
-				self.EmitOperation(inst.OperandA, inst.OperandB, "<<", inst.OperandC)
+				self.EmitArithmetic(a, b, "<<", c)
 			elif op == BSR:
-				self.EmitOperation(inst.OperandA, inst.OperandB, ">>", inst.OperandC)
+				self.EmitOperation(a, b, ">>", c)
 			elif op == BRE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "==", inst.OperandC)
+				self.EmitBranch(a, b, "==", c)
 			elif op == BNE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "!=", inst.OperandC)
+				self.EmitBranch(a, b, "!=", c)
 			elif op == BRL:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "<", inst.OperandC)
+				self.EmitBranch(a, b, "<", c)
 			elif op == BRG:
-				self.EmitBranch(inst.OperandA, inst.OperandB, ">", inst.OperandC)
+				self.EmitBranch(a, b, ">", c)
 			elif op == BLE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, "<=", inst.OperandC)
+				self.EmitBranch(a, b, "<=", c)
 			elif op == BGE:
-				self.EmitBranch(inst.OperandA, inst.OperandB, ">=", inst.OperandC)
+				self.EmitBranch(a, b, ">=", c)
 			else:
 				self.EmitError("\"" + str(op) + "\" does not take three operands.")
 		else:
@@ -294,21 +445,209 @@ class PythonEmit:
 
 		self.Source += "\treturn\nINST_" + str(position) + ".Source = \"" + self.Stringify(originalSource) + "\"\nROM[" + str(position) + "] = INST_" + str(position) + "\n\n"
 
+	def IsBlockInstruction(self, inst):
+		op = inst.Operation
+		count = inst.GetOperandCount()
+		if op in BLOCK_BINARY_OPERATIONS or op in BLOCK_CONDITIONS and not op in BLOCK_OPERAND_COUNTS:
+			return count == 3
+		elif op in BLOCK_UNARY_OPERATIONS:
+			return count == 2
+		elif op in BLOCK_OPERAND_COUNTS:
+			return count == BLOCK_OPERAND_COUNTS[op]
+		return False
+
+	def GetBlockOperand(self, operand, isAddress=False):
+		if operand == ZERO:
+			return "0"
+		elif self.IsRegister(operand):
+			return "_" + operand
+		elif self.IsLabel(operand):
+			return self.GetLabelName(operand)
+		elif isinstance(operand, int) and self.WordBits != None and not isAddress:
+			return str(self.WrapValue(operand))
+		return str(operand)
+
+	def GetBlockLoad(self, target, address):
+		if self.MemoryModel == MEMORY_DENSE:
+			return [target + " = STACK[~" + address + "] if " + self.GetStackCondition(address) + " else RAM[" + self.GetRAMIndex(address) + "] if " + \
+				self.GetRAMCondition(address) + " else Get(" + address + ")"]
+		return [target + " = RAM.get(" + address + ", 0) if " + address + " >= 0 else Get(" + address + ")"]
+
+	def GetBlockStore(self, address, source):
+		if self.MemoryModel == MEMORY_DENSE:
+			return ["if " + self.GetStackCondition(address) + ":", "\tSTACK[~" + address + "] = " + source, "elif " + self.GetRAMCondition(address) + ":", \
+				"\tRAM[" + self.GetRAMIndex(address) + "] = " + source, "else:", "\tSet(" + address + ", " + source + ")"]
+		return ["if " + address + " >= 0:", "\tRAM[" + address + "] = " + source, "else:", "\tSet(" + address + ", " + source + ")"]
+
+	def GetBlockPush(self, source):
+		if self.MemoryModel == MEMORY_DENSE:
+			return ["_SP -= 1"] + self.GetBlockStore("_SP", source)
+		return ["_SP -= 1", "if _SP < 0 and ~_SP < len(STACK):", "\tSTACK[~_SP] = " + source, "else:", "\tSet(_SP, " + source + ")"]
+
+	def GetBlockPop(self, target):
+		lines = ["if _SP >= 0:", "\traise ERR_UNDERFLOW"]
+		lines += self.GetBlockLoad(target, "_SP")
+		return lines + ["_SP += 1"]
+
+	def GetBlockStatements(self, inst):
+		op = inst.Operation
+		addresses = ADDRESS_OPERANDS.get(op, [])
+		instOperands = inst.GetOperands()
+		operands = [self.GetBlockOperand(instOperands[i], i in addresses) for i in range(len(instOperands))]
+		if op in BLOCK_BINARY_OPERATIONS:
+			if operands[0] == "0":
+				return []
+			expression = operands[1] + " " + BLOCK_BINARY_OPERATIONS[op] + " " + operands[2]
+			if op in WRAPPED_OPERATIONS:
+				expression = self.WrapExpression(expression)
+			return [operands[0] + " = " + expression]
+		elif op in BLOCK_UNARY_OPERATIONS:
+			if operands[0] == "0":
+				return []
+			expression = BLOCK_UNARY_OPERATIONS[op].format(operands[1])
+			if op in WRAPPED_OPERATIONS:
+				expression = self.WrapExpression(expression)
+			return [operands[0] + " = " + expression]
+		elif op == LOD:
+			if operands[0] == "0":
+				return []
+			return self.GetBlockLoad(operands[0], operands[1])
+		elif op == STR:
+			return self.GetBlockStore(operands[0], operands[1])
+		elif op == CPY:
+			return ["Set(" + operands[0] + ", Get(" + operands[1] + "))"]
+		elif op == PSH:
+			return self.GetBlockPush(operands[0])
+		elif op == POP:
+			if operands[0] == "0":
+				return ["if _SP >= 0:", "\traise ERR_UNDERFLOW", "_SP += 1"]
+			return self.GetBlockPop(operands[0])
+		return []
+
+	def EmitBlockCode(self, instructions, start, end, labelPositions):
+		for position in range(start, end):
+			if not self.IsBlockInstruction(instructions[position]):
+				end = position
+				break
+		if end <= start:
+			return ""
+
+		used = []
+		written = []
+		for position in range(start, end):
+			inst = instructions[position]
+			operands = inst.GetOperands()
+			if inst.Operation in [PSH, POP, CAL, RET]:
+				operands = operands + [SP]
+			for i in range(len(operands)):
+				if self.IsRegister(operands[i]):
+					if not operands[i] in used:
+						used += [operands[i]]
+					isWritten = inst.Operation in [PSH, POP, CAL, RET] and operands[i] == SP
+					isWritten = isWritten or (i == 0 and (inst.Operation in BLOCK_BINARY_OPERATIONS or inst.Operation in BLOCK_UNARY_OPERATIONS or inst.Operation in [LOD, POP]))
+					if isWritten and not operands[i] in written:
+						written += [operands[i]]
+
+		last = instructions[end - 1]
+		body = range(start, end)
+		terminator = None
+		if last.Operation in TERMINATORS:
+			body = range(start, end - 1)
+			terminator = last
+
+		writeBack = [reg + " = _" + reg for reg in written]
+		exitPosition = end
+		target = None
+		loop = False
+		if terminator != None and terminator.Operation in BRANCHES + [CAL]:
+			target = self.GetBlockOperand(terminator.OperandA)
+			if terminator.Operation != CAL:
+				loop = labelPositions.get(terminator.OperandA, terminator.OperandA) == start
+
+		lines = []
+		for position in body:
+			lines += self.GetBlockStatements(instructions[position])
+		if terminator == None:
+			lines += writeBack + ["IP = " + str(exitPosition)]
+		elif terminator.Operation == JMP:
+			if loop:
+				lines += ["continue"]
+			else:
+				lines += writeBack + ["IP = " + target]
+		elif terminator.Operation in BLOCK_CONDITIONS:
+			operands = [self.GetBlockOperand(operand) for operand in terminator.GetOperands()]
+			lines += ["if " + BLOCK_CONDITIONS[terminator.Operation].format(*operands[1:len(operands)]) + ":"]
+			if loop:
+				lines += ["\tcontinue"]
+			else:
+				lines += ["\t" + line for line in writeBack + ["IP = " + target, "return"]]
+			lines += writeBack + ["IP = " + str(exitPosition)]
+		elif terminator.Operation == CAL:
+			lines += self.GetBlockPush(str(end - 1)) + writeBack + ["IP = " + target]
+		elif terminator.Operation == RET:
+			lines += self.GetBlockPop("IP") + ["IP += 1"] + writeBack
+		elif terminator.Operation == HLT:
+			lines += writeBack + ["HALT = True", "IP = " + str(exitPosition)]
+		elif terminator.Operation == BRK:
+			lines += writeBack + ["BREAK = True", "IP = " + str(exitPosition)]
+		if loop:
+			lines += ["return"]
+			lines = ["while True:"] + ["\t" + line for line in lines]
+
+		globalNames = ["IP"]
+		if terminator != None and terminator.Operation == HLT:
+			globalNames += ["HALT"]
+		elif terminator != None and terminator.Operation == BRK:
+			globalNames += ["BREAK"]
+
+		source = "def BLOCK_" + str(start) + "():\n"
+		for name in globalNames + written:
+			source += "\tglobal " + name + "\n"
+		for reg in used:
+			source += "\t_" + reg + " = " + reg + "\n"
+		for line in lines:
+			source += "\t" + line + "\n"
+		return source + "BLOCKS[" + str(start) + "] = BLOCK_" + str(start) + "\n\n"
+
 	def Emit(self, emitter):
+		self.Reset()
 		for inst in emitter.Instructions:
 			self.IncludeInstructionRegisters(inst)
 		
 		for reg in self.Registers:
 			self.Source += str(reg) + " = 0\n"
+		self.Source += "REGISTERS = " + str(self.Registers) + "\n"
 
+		#Each piece of code is emitted into an empty source and joined at the end, so emitting stays linear in the program size.
+		chunks = [self.Source]
 		for position in emitter.Labels:
 			for label in emitter.Labels[position]:
+				self.Source = ""
 				self.EmitLabelCode(label, position)
-		
-		self.Source += "\n"
+				chunks.append(self.Source)
+		chunks.append("\n")
 
 		for position in range(len(emitter.Instructions)):
+			self.Source = ""
 			self.EmitInstructionCode(emitter.Instructions[position], position)
+			chunks.append(self.Source)
+
+		if self.UseBasicBlocks:
+			labelPositions = {}
+			for position in emitter.Labels:
+				for label in emitter.Labels[position]:
+					labelPositions[label] = position
+			for start, end in GetBasicBlocks(emitter.Instructions, emitter.Labels):
+				chunks.append(self.EmitBlockCode(emitter.Instructions, start, end, labelPositions))
+
+		if self.Profile:
+			calls = [position for position in range(len(emitter.Instructions)) if emitter.Instructions[position].Operation == CAL]
+			returns = [position for position in range(len(emitter.Instructions)) if emitter.Instructions[position].Operation == RET]
+			chunks.append("PROFILE_COUNTS = [0] * " + str(len(emitter.Instructions)) + "\n" + \
+				"PROFILE_CALLS = set(" + str(calls) + ")\n" + \
+				"PROFILE_FRAMES = set(" + str(calls + returns) + ")\n\n")
+
+		self.Source = "".join(chunks)
 
 		if self.UseDebugger:
 			return self.Source
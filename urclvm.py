@@ -0,0 +1,912 @@
+import gc
+from collections import deque
+from urcl import *
+
+ERR_UNDERFLOW = "Stack underflow occured."
+ERR_BOUNDS = "Instruction pointer is out of bounds."
+
+REGISTER_ZERO = 0
+REGISTER_DISCARD = 1
+REGISTER_SP = 2
+
+def Load(ram, stack, addr):
+	"""Read a word of RAM, or of the stack when the address is negative."""
+	if addr < 0:
+		addr = -addr - 1
+		if addr < len(stack):
+			return stack[addr]
+		return 0
+	return ram.get(addr, 0)
+
+def Store(ram, stack, addr, value):
+	"""Write a word of RAM, or of the stack when the address is negative."""
+	if addr < 0:
+		addr = -addr - 1
+		if addr >= len(stack):
+			stack.extend([0] * (addr + 1 - len(stack)))
+		stack[addr] = value
+	else:
+		ram[addr] = value
+
+def _NOP(m, a, b, c, nxt):
+	def NOP():
+		return nxt
+	return NOP
+
+def _HLT(m, a, b, c, nxt):
+	def HLT():
+		m.HALT = True
+		m.IP = nxt
+		return -1
+	return HLT
+
+def _BRK(m, a, b, c, nxt):
+	def BRK():
+		m.BREAK = True
+		m.IP = nxt
+		return -1
+	return BRK
+
+def _ADD(m, a, b, c, nxt):
+	r = m.Registers
+	def ADD():
+		r[a] = r[b] + r[c]
+		return nxt
+	return ADD
+
+def _SUB(m, a, b, c, nxt):
+	r = m.Registers
+	def SUB():
+		r[a] = r[b] - r[c]
+		return nxt
+	return SUB
+
+def _MLT(m, a, b, c, nxt):
+	r = m.Registers
+	def MLT():
+		r[a] = r[b] * r[c]
+		return nxt
+	return MLT
+
+def _DIV(m, a, b, c, nxt):
+	r = m.Registers
+	def DIV():
+		r[a] = r[b] // r[c]
+		return nxt
+	return DIV
+
+def _MOD(m, a, b, c, nxt):
+	r = m.Registers
+	def MOD():
+		r[a] = r[b] % r[c]
+		return nxt
+	return MOD
+
+def _AND(m, a, b, c, nxt):
+	r = m.Registers
+	def AND():
+		r[a] = r[b] & r[c]
+		return nxt
+	return AND
+
+def _OR(m, a, b, c, nxt):
+	r = m.Registers
+	def OR():
+		r[a] = r[b] | r[c]
+		return nxt
+	return OR
+
+def _XOR(m, a, b, c, nxt):
+	r = m.Registers
+	def XOR():
+		r[a] = r[b] ^ r[c]
+		return nxt
+	return XOR
+
+def _BSL(m, a, b, c, nxt):
+	r = m.Registers
+	def BSL():
+		r[a] = r[b] << r[c]
+		return nxt
+	return BSL
+
+def _BSR(m, a, b, c, nxt):
+	r = m.Registers
+	def BSR():
+		r[a] = r[b] >> r[c]
+		return nxt
+	return BSR
+
+def _LSH(m, a, b, c, nxt):
+	r = m.Registers
+	def LSH():
+		r[a] = r[b] << 1
+		return nxt
+	return LSH
+
+def _RSH(m, a, b, c, nxt):
+	r = m.Registers
+	def RSH():
+		r[a] = r[b] >> 1
+		return nxt
+	return RSH
+
+def _INC(m, a, b, c, nxt):
+	r = m.Registers
+	def INC():
+		r[a] = r[b] + 1
+		return nxt
+	return INC
+
+def _DEC(m, a, b, c, nxt):
+	r = m.Registers
+	def DEC():
+		r[a] = r[b] - 1
+		return nxt
+	return DEC
+
+def _NOT(m, a, b, c, nxt):
+	r = m.Registers
+	def NOT():
+		r[a] = ~r[b]
+		return nxt
+	return NOT
+
+def _MOV(m, a, b, c, nxt):
+	r = m.Registers
+	def MOV():
+		r[a] = r[b]
+		return nxt
+	return MOV
+
+def _LOD(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	def LOD():
+		addr = r[b]
+		if addr >= 0:
+			r[a] = ram.get(addr, 0)
+		else:
+			r[a] = Load(ram, stack, addr)
+		return nxt
+	return LOD
+
+def _STR(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	def STR():
+		addr = r[a]
+		if addr >= 0:
+			ram[addr] = r[b]
+		else:
+			Store(ram, stack, addr, r[b])
+		return nxt
+	return STR
+
+def _CPY(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	def CPY():
+		Store(ram, stack, r[a], Load(ram, stack, r[b]))
+		return nxt
+	return CPY
+
+def _PSH(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	def PSH():
+		sp = r[REGISTER_SP] - 1
+		r[REGISTER_SP] = sp
+		if sp < 0 and ~sp < len(stack):
+			stack[~sp] = r[a]
+		else:
+			Store(ram, stack, sp, r[a])
+		return nxt
+	return PSH
+
+def _POP(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	def POP():
+		sp = r[REGISTER_SP]
+		if sp >= 0:
+			raise ValueError(ERR_UNDERFLOW)
+		r[a] = Load(ram, stack, sp)
+		r[REGISTER_SP] = sp + 1
+		return nxt
+	return POP
+
+def _JMP(m, a, b, c, nxt):
+	def JMP():
+		return a
+	return JMP
+
+def _CAL(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	position = nxt - 1
+	def CAL():
+		sp = r[REGISTER_SP] - 1
+		r[REGISTER_SP] = sp
+		if sp < 0 and ~sp < len(stack):
+			stack[~sp] = position
+		else:
+			Store(ram, stack, sp, position)
+		return a
+	return CAL
+
+def _RET(m, a, b, c, nxt):
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	size = m.Size
+	def RET():
+		sp = r[REGISTER_SP]
+		if sp >= 0:
+			raise ValueError(ERR_UNDERFLOW)
+		target = Load(ram, stack, sp) + 1
+		r[REGISTER_SP] = sp + 1
+		if 0 <= target < size:
+			return target
+		return size
+	return RET
+
+def _BRZ(m, a, b, c, nxt):
+	r = m.Registers
+	def BRZ():
+		if r[b] == 0:
+			return a
+		return nxt
+	return BRZ
+
+def _BNZ(m, a, b, c, nxt):
+	r = m.Registers
+	def BNZ():
+		if r[b] != 0:
+			return a
+		return nxt
+	return BNZ
+
+def _BRE(m, a, b, c, nxt):
+	r = m.Registers
+	def BRE():
+		if r[b] == r[c]:
+			return a
+		return nxt
+	return BRE
+
+def _BNE(m, a, b, c, nxt):
+	r = m.Registers
+	def BNE():
+		if r[b] != r[c]:
+			return a
+		return nxt
+	return BNE
+
+def _BRL(m, a, b, c, nxt):
+	r = m.Registers
+	def BRL():
+		if r[b] < r[c]:
+			return a
+		return nxt
+	return BRL
+
+def _BRG(m, a, b, c, nxt):
+	r = m.Registers
+	def BRG():
+		if r[b] > r[c]:
+			return a
+		return nxt
+	return BRG
+
+def _BLE(m, a, b, c, nxt):
+	r = m.Registers
+	def BLE():
+		if r[b] <= r[c]:
+			return a
+		return nxt
+	return BLE
+
+def _BGE(m, a, b, c, nxt):
+	r = m.Registers
+	def BGE():
+		if r[b] >= r[c]:
+			return a
+		return nxt
+	return BGE
+
+CONDITIONS = {
+	JMP: lambda b, c: True,
+	CAL: lambda b, c: True,
+	BRZ: lambda b, c: b == 0,
+	BNZ: lambda b, c: b != 0,
+	BRE: lambda b, c: b == c,
+	BNE: lambda b, c: b != c,
+	BRL: lambda b, c: b < c,
+	BRG: lambda b, c: b > c,
+	BLE: lambda b, c: b <= c,
+	BGE: lambda b, c: b >= c
+}
+
+def _DynamicJump(m, op, a, b, c, nxt):
+	r = m.Registers
+	size = m.Size
+	condition = CONDITIONS[op]
+	push = None
+	if op == CAL:
+		push = _CAL(m, None, None, None, nxt)
+	def DynamicJump():
+		if condition(r[b], r[c]):
+			target = r[a]
+			if push != None:
+				push()
+			if 0 <= target < size:
+				return target
+			return size
+		return nxt
+	return DynamicJump
+
+#Operation: (operand count, handler factory, jump target operand, written operand)
+OPERATIONS = {
+	NOP: (0, _NOP, False, False),
+	HLT: (0, _HLT, False, False),
+	BRK: (0, _BRK, False, False),
+	RET: (0, _RET, False, False),
+	PSH: (1, _PSH, False, False),
+	POP: (1, _POP, False, True),
+	JMP: (1, _JMP, True, False),
+	CAL: (1, _CAL, True, False),
+	LOD: (2, _LOD, False, True),
+	STR: (2, _STR, False, False),
+	MOV: (2, _MOV, False, True),
+	IMM: (2, _MOV, False, True),
+	LSH: (2, _LSH, False, True),
+	RSH: (2, _RSH, False, True),
+	INC: (2, _INC, False, True),
+	DEC: (2, _DEC, False, True),
+	NOT: (2, _NOT, False, True),
+	BRZ: (2, _BRZ, True, False),
+	BNZ: (2, _BNZ, True, False),
+	CPY: (2, _CPY, False, False),
+	ADD: (3, _ADD, False, True),
+	SUB: (3, _SUB, False, True),
+	MLT: (3, _MLT, False, True),
+	DIV: (3, _DIV, False, True),
+	MOD: (3, _MOD, False, True),
+	AND: (3, _AND, False, True),
+	OR: (3, _OR, False, True),
+	XOR: (3, _XOR, False, True),
+	BSL: (3, _BSL, False, True),
+	BSR: (3, _BSR, False, True),
+	BRE: (3, _BRE, True, False),
+	BNE: (3, _BNE, True, False),
+	BRL: (3, _BRL, True, False),
+	BRG: (3, _BRG, True, False),
+	BLE: (3, _BLE, True, False),
+	BGE: (3, _BGE, True, False)
+}
+
+OPERAND_COUNT_NAMES = ["zero operands", "one operand", "two operands", "three operands"]
+
+#Operations that change SP or write memory without naming it as their written operand.
+STACK_POINTER_OPERATIONS = [PSH, POP, CAL, RET]
+MEMORY_WRITE_OPERATIONS = [STR, CPY, PSH, CAL]
+
+class Watchpoint:
+	"""A watch on a register or memory address. Execution stops after an instruction changes the watched value, if the condition holds for the new value."""
+	def __init__(self, target, read, condition, positions):
+		self.Target = target
+		self.Read = read
+		self.Condition = condition
+		self.Positions = positions
+		self.Value = read()
+
+	def Check(self):
+		"""Update the watched value and determine if execution should stop."""
+		value = self.Read()
+		if value == self.Value:
+			return False
+		self.Value = value
+		if self.Condition == None:
+			return True
+		#A condition that fails stops execution like one that holds, so the error never escapes the instruction handler.
+		try:
+			return self.Condition(value)
+		except Exception:
+			return True
+
+def _Break(m, handler, position):
+	def Break():
+		#The breakpoint the machine stopped on lets the instruction run when execution resumes.
+		if m._Resume == position:
+			m._Resume = None
+			return handler()
+		m._Resume = position
+		m.BREAK = True
+		m.IP = position
+		return -1
+	return Break
+
+def _Watch(m, handler, watch):
+	def Watch():
+		nxt = handler()
+		if watch.Check():
+			m.BREAK = True
+			m.IP = nxt
+			return -1
+		return nxt
+	return Watch
+
+def _ReadCell(ram, stack, addr):
+	#Words missing from RAM are recorded as None so undoing a write removes them again.
+	if addr >= 0:
+		return ram.get(addr)
+	return Load(ram, stack, addr)
+
+def _Record(m, handler, position):
+	#Each entry holds the IP, a register and its old value, the old SP and a memory address and its old value, with None for what the instruction does not change.
+	op, written = m._GetWrite(position)
+	r = m.Registers
+	ram = m.RAM
+	stack = m.STACK
+	append = m.Journal.Entries.append
+	if op == PSH or op == CAL:
+		def Record():
+			sp = r[REGISTER_SP]
+			entry = (position, None, None, sp, sp - 1, _ReadCell(ram, stack, sp - 1))
+			nxt = handler()
+			append(entry)
+			return nxt
+	elif op == POP:
+		def Record():
+			entry = (position, written, r[written], r[REGISTER_SP], None, None)
+			nxt = handler()
+			append(entry)
+			return nxt
+	elif op == RET:
+		def Record():
+			entry = (position, None, None, r[REGISTER_SP], None, None)
+			nxt = handler()
+			append(entry)
+			return nxt
+	elif op == STR or op == CPY:
+		a = m._GetAddress(position)
+		def Record():
+			addr = r[a]
+			entry = (position, None, None, None, addr, _ReadCell(ram, stack, addr))
+			nxt = handler()
+			append(entry)
+			return nxt
+	elif written != None:
+		def Record():
+			entry = (position, written, r[written], None, None, None)
+			nxt = handler()
+			append(entry)
+			return nxt
+	else:
+		entry = (position, None, None, None, None, None)
+		def Record():
+			nxt = handler()
+			append(entry)
+			return nxt
+	return Record
+
+class Journal:
+	"""An undo log of the most recent instructions, kept in a ring of at most capacity entries, with a full snapshot of the machine every snapshotInterval instructions. Only the last snapshotCount snapshots are kept."""
+	def __init__(self, capacity, snapshotInterval, snapshotCount):
+		self.Entries = deque(maxlen=capacity)
+		self.Snapshots = deque(maxlen=snapshotCount)
+		self.SnapshotInterval = snapshotInterval
+		self.Steps = 0
+
+	def GetEarliest(self):
+		"""Get the earliest step that can still be returned to."""
+		earliest = self.Steps - len(self.Entries)
+		if len(self.Snapshots) > 0:
+			earliest = min(earliest, self.Snapshots[0][0])
+		return earliest
+
+	def GetSnapshot(self, step):
+		"""Get the latest snapshot taken at or before a step, or None if there is none."""
+		for snapshot in reversed(self.Snapshots):
+			if snapshot[0] <= step:
+				return snapshot
+		return None
+
+class Machine:
+	"""An in-process URCL execution engine. The program is decoded once into a flat dispatch table with registers held in a preallocated list."""
+	def __init__(self, emitter):
+		self.Instructions = list(emitter.Instructions)
+		labels = {}
+		for position in emitter.Labels:
+			for label in emitter.Labels[position]:
+				labels[label] = position
+		self._Initialize(len(self.Instructions), labels)
+		#Collections triggered by the many handler closures cost more than creating them.
+		collecting = gc.isenabled()
+		gc.disable()
+		try:
+			for position in range(self.Size):
+				self.ROM.append(self._Decode(self.Instructions[position], position))
+		finally:
+			if collecting:
+				gc.enable()
+		self.ROM.append(self._OutOfBounds)
+
+	def _Initialize(self, size, labels):
+		self.Size = size
+		self.Labels = labels
+		self.RegisterNames = {ZERO: REGISTER_ZERO, SP: REGISTER_SP}
+		self.Registers = [0, 0, 0]
+		self._Constants = {}
+		self.RAM = {}
+		self.STACK = []
+		#Bumped whenever addresses are removed from RAM, so views that index it know to start over.
+		self.MemoryVersion = 0
+		self.IP = 0
+		self.HALT = False
+		self.BREAK = False
+		self.ROM = []
+		self.Breakpoints = set()
+		self.Watchpoints = {}
+		self._Originals = {}
+		self._Resume = None
+		self.Journal = None
+
+	def _OutOfBounds(self):
+		raise ValueError(ERR_BOUNDS)
+
+	def _Constant(self, value):
+		if not value in self._Constants:
+			self._Constants[value] = len(self.Registers)
+			self.Registers.append(value)
+		return self._Constants[value]
+
+	def _Register(self, name):
+		if not name in self.RegisterNames:
+			self.RegisterNames[name] = len(self.Registers)
+			self.Registers.append(0)
+		return self.RegisterNames[name]
+
+	def _Source(self, operand, written):
+		kind = GetOperandKind(operand)
+		if kind == OPERAND_REGISTER:
+			index = self._Register(operand)
+			if written and index == REGISTER_ZERO:
+				return REGISTER_DISCARD
+			return index
+		elif kind == OPERAND_LABEL:
+			if not operand in self.Labels:
+				raise ValueError("Label \"" + str(operand) + "\" is not defined.")
+			return self._Constant(self.Labels[operand])
+		elif isinstance(operand, int):
+			return self._Constant(operand)
+		else:
+			raise ValueError("Operand \"" + str(operand) + "\" is not supported.")
+
+	def _Target(self, operand):
+		kind = GetOperandKind(operand)
+		if kind == OPERAND_LABEL:
+			if not operand in self.Labels:
+				raise ValueError("Label \"" + str(operand) + "\" is not defined.")
+			return self.Labels[operand]
+		elif kind == OPERAND_IMMEDIATE and isinstance(operand, int):
+			if 0 <= operand < self.Size:
+				return operand
+			return self.Size
+		return None
+
+	def _Decode(self, inst, position):
+		op = inst.Operation
+		operands = inst.GetOperands()
+		nxt = position + 1
+		if (not op in OPERATIONS) or OPERATIONS[op][0] != len(operands):
+			print("ERROR: \"" + str(op) + "\" does not take " + OPERAND_COUNT_NAMES[len(operands)] + ".")
+			return self._Bind(NOP, REGISTER_ZERO, REGISTER_ZERO, REGISTER_ZERO, False, nxt)
+		count, handler, jumps, writes = OPERATIONS[op]
+		indices = [REGISTER_ZERO, REGISTER_ZERO, REGISTER_ZERO]
+		for i in range(1, count):
+			indices[i] = self._Source(operands[i], False)
+		if count == 0:
+			return self._Bind(op, REGISTER_ZERO, REGISTER_ZERO, REGISTER_ZERO, False, nxt)
+		elif not jumps:
+			indices[0] = self._Source(operands[0], writes)
+			return self._Bind(op, indices[0], indices[1], indices[2], False, nxt)
+		target = self._Target(operands[0])
+		if target == None:
+			indices[0] = self._Source(operands[0], False)
+			return self._Bind(op, indices[0], indices[1], indices[2], True, nxt)
+		return self._Bind(op, target, indices[1], indices[2], False, nxt)
+
+	def _Bind(self, op, a, b, c, dynamic, nxt):
+		#Operands are already resolved to register indices and jump targets, so decoded programs can be stored and bound again later.
+		if dynamic:
+			return _DynamicJump(self, op, a, b, c, nxt)
+		return OPERATIONS[op][1](self, a, b, c, nxt)
+
+	def GetRegister(self, name):
+		"""Get the value of a register by name."""
+		if not name in self.RegisterNames:
+			return 0
+		return self.Registers[self.RegisterNames[name]]
+
+	def SetRegister(self, name, value):
+		"""Set the value of a register by name."""
+		index = self._Register(name)
+		if index != REGISTER_ZERO:
+			self.Registers[index] = value
+
+	def GetSource(self, position):
+		"""Get the URCL source of the instruction at a ROM address."""
+		return str(self.Instructions[position])
+
+	def _GetWrite(self, position):
+		inst = self.Instructions[position]
+		op = inst.Operation
+		if (not op in OPERATIONS) or OPERATIONS[op][0] != inst.GetOperandCount():
+			return (NOP, None)
+		if not OPERATIONS[op][3]:
+			return (op, None)
+		return (op, self.RegisterNames.get(inst.OperandA))
+
+	def _GetAddress(self, position):
+		return self._Source(self.Instructions[position].OperandA, False)
+
+	def GetPosition(self, target):
+		"""Get the ROM address of a ROM address or label."""
+		if GetOperandKind(target) == OPERAND_LABEL:
+			if not target in self.Labels:
+				raise ValueError("Label \"" + str(target) + "\" is not defined.")
+			return self.Labels[target]
+		if not isinstance(target, int) or target < 0 or target >= self.Size:
+			raise ValueError("ROM address \"" + str(target) + "\" is out of bounds.")
+		return target
+
+	def _Patch(self, position):
+		#Breakpoints and watchpoints replace ROM entries, so instructions without one run at full speed.
+		original = self._Originals.get(position, self.ROM[position])
+		handler = original
+		if self.Journal != None:
+			handler = _Record(self, handler, position)
+		for watch in self.Watchpoints.values():
+			if position in watch.Positions:
+				handler = _Watch(self, handler, watch)
+		if position in self.Breakpoints:
+			handler = _Break(self, handler, position)
+		if handler is original:
+			self._Originals.pop(position, None)
+		else:
+			self._Originals[position] = original
+		self.ROM[position] = handler
+
+	def AddBreakpoint(self, target):
+		"""Stop before the instruction at a ROM address or label executes. Returns the ROM address."""
+		position = self.GetPosition(target)
+		self.Breakpoints.add(position)
+		self._Patch(position)
+		return position
+
+	def RemoveBreakpoint(self, target):
+		"""Remove the breakpoint at a ROM address or label."""
+		position = self.GetPosition(target)
+		self.Breakpoints.discard(position)
+		self._Patch(position)
+
+	def AddWatchpoint(self, target, condition=None):
+		"""Stop after an instruction changes a register, given by name, or a memory address. When a condition is given, it is called with the new value and execution only stops if it returns True."""
+		self.RemoveWatchpoint(target)
+		positions = set()
+		if isinstance(target, int):
+			read = lambda: Load(self.RAM, self.STACK, target)
+			for position in range(self.Size):
+				if self._GetWrite(position)[0] in MEMORY_WRITE_OPERATIONS:
+					positions.add(position)
+		elif GetOperandKind(target) == OPERAND_REGISTER and target in self.RegisterNames and target != ZERO:
+			index = self.RegisterNames[target]
+			read = lambda: self.Registers[index]
+			for position in range(self.Size):
+				op, written = self._GetWrite(position)
+				if written == index or (index == REGISTER_SP and op in STACK_POINTER_OPERATIONS):
+					positions.add(position)
+		else:
+			raise ValueError("\"" + str(target) + "\" is not a register of the program or a memory address.")
+		self.Watchpoints[target] = Watchpoint(target, read, condition, positions)
+		for position in positions:
+			self._Patch(position)
+
+	def RemoveWatchpoint(self, target):
+		"""Remove the watchpoint on a register or memory address."""
+		if target in self.Watchpoints:
+			watch = self.Watchpoints.pop(target)
+			for position in watch.Positions:
+				self._Patch(position)
+
+	def ClearBreakpoints(self):
+		"""Remove all breakpoints and watchpoints."""
+		self.Breakpoints.clear()
+		self.Watchpoints.clear()
+		for position in list(self._Originals):
+			self._Patch(position)
+
+	def EnableJournal(self, capacity=1000000, snapshotInterval=100000, snapshotCount=8):
+		"""Record executed instructions so they can be undone by StepBack and RunBackward. Memory use is bounded by capacity undo entries and snapshotCount copies of the registers, RAM and stack."""
+		self.Journal = Journal(capacity, snapshotInterval, snapshotCount)
+		self._TakeSnapshot()
+		for position in range(self.Size):
+			self._Patch(position)
+
+	def DisableJournal(self):
+		"""Stop recording executed instructions."""
+		self.Journal = None
+		for position in range(self.Size):
+			self._Patch(position)
+
+	def _TakeSnapshot(self):
+		self.Journal.Snapshots.append((self.Journal.Steps, self.IP, self.HALT, list(self.Registers), dict(self.RAM), list(self.STACK)))
+
+	def _Undo(self, entry):
+		position, register, value, sp, addr, memory = entry
+		if register != None:
+			self.Registers[register] = value
+		if sp != None:
+			self.Registers[REGISTER_SP] = sp
+		if addr != None:
+			if memory == None:
+				self.RAM.pop(addr, None)
+				self.MemoryVersion += 1
+			else:
+				Store(self.RAM, self.STACK, addr, memory)
+		self.IP = position
+
+	def _Seek(self, step):
+		#Restores the latest snapshot before the step and executes forward to it, which also refills the undo log.
+		journal = self.Journal
+		snapshot = journal.GetSnapshot(step)
+		if snapshot == None:
+			return
+		steps, self.IP, self.HALT, registers, ram, stack = snapshot
+		self.Registers[:] = registers
+		self.RAM.clear()
+		self.RAM.update(ram)
+		self.STACK[:] = stack
+		self.MemoryVersion += 1
+		journal.Steps = steps
+		journal.Entries.clear()
+		while len(journal.Snapshots) > 0 and journal.Snapshots[-1][0] > steps:
+			journal.Snapshots.pop()
+		#Breakpoints and watchpoints are lifted while replaying instructions that already ran.
+		breakpoints = set(self.Breakpoints)
+		watchpoints = dict(self.Watchpoints)
+		patched = set(breakpoints)
+		for watch in watchpoints.values():
+			patched |= watch.Positions
+		self.Breakpoints.clear()
+		self.Watchpoints.clear()
+		for position in patched:
+			self._Patch(position)
+		try:
+			while journal.Steps < step and not self.HALT:
+				if self._ExecuteJournal(step - journal.Steps) == 0:
+					break
+		finally:
+			self.Breakpoints.update(breakpoints)
+			self.Watchpoints.update(watchpoints)
+			for position in patched:
+				self._Patch(position)
+
+	def _EndBackward(self, count):
+		self.HALT = False
+		self.BREAK = False
+		self._Resume = None
+		for watch in self.Watchpoints.values():
+			watch.Value = watch.Read()
+		return count
+
+	def StepBack(self, count=1):
+		"""Undo up to count instructions. Returns the number of instructions undone."""
+		journal = self.Journal
+		if journal == None:
+			raise ValueError("The journal is not enabled.")
+		count = min(count, journal.Steps - journal.GetEarliest())
+		if count > len(journal.Entries):
+			self._Seek(journal.Steps - count)
+		else:
+			for i in range(count):
+				self._Undo(journal.Entries.pop())
+			journal.Steps -= count
+		return self._EndBackward(count)
+
+	def RunBackward(self):
+		"""Undo instructions until one with a breakpoint is reached, or until the earliest recorded step. Returns the number of instructions undone."""
+		journal = self.Journal
+		if journal == None:
+			raise ValueError("The journal is not enabled.")
+		count = 0
+		while journal.Steps > journal.GetEarliest():
+			if len(journal.Entries) > 0:
+				self._Undo(journal.Entries.pop())
+				journal.Steps -= 1
+			else:
+				self._Seek(journal.Steps - 1)
+			count += 1
+			if self.IP in self.Breakpoints:
+				self._EndBackward(count)
+				#Running forward again starts with the instruction the breakpoint is on.
+				self._Resume = self.IP
+				self.BREAK = True
+				return count
+		return self._EndBackward(count)
+
+	def _ExecuteJournal(self, limit):
+		rom = self.ROM
+		journal = self.Journal
+		ip = self.IP
+		executed = 0
+		snapshotAt = journal.Snapshots[-1][0] + journal.SnapshotInterval - journal.Steps
+		try:
+			while limit == None or executed < limit:
+				if executed >= snapshotAt:
+					self.IP = ip
+					journal.Steps += executed
+					self._TakeSnapshot()
+					journal.Steps -= executed
+					snapshotAt = executed + journal.SnapshotInterval
+				ip = rom[ip]()
+				executed += 1
+				if ip < 0:
+					if self._Resume == self.IP:
+						#A breakpoint stopped execution before its instruction ran.
+						executed -= 1
+					return executed
+			self.IP = ip
+			return executed
+		except:
+			self.IP = ip
+			raise
+		finally:
+			journal.Steps += executed
+
+	def Execute(self, limit=None):
+		"""Execute until HLT or BRK, or until limit instructions have executed. Returns the number of instructions executed when a limit is given."""
+		rom = self.ROM
+		ip = self.IP
+		self.BREAK = False
+		if self._Resume != ip:
+			self._Resume = None
+		if self.HALT:
+			return 0
+		if self.Journal != None:
+			executed = self._ExecuteJournal(limit)
+			if limit == None:
+				return None
+			return executed
+		try:
+			if limit == None:
+				while ip >= 0:
+					ip = rom[ip]()
+				return None
+			executed = 0
+			while executed < limit:
+				executed += 1
+				ip = rom[ip]()
+				if ip < 0:
+					if self._Resume == self.IP:
+						#A breakpoint stopped execution before its instruction ran.
+						return executed - 1
+					return executed
+			self.IP = ip
+			return executed
+		except:
+			self.IP = ip
+			raise
+
+	def Step(self):
+		"""Execute a single instruction. A breakpoint on the instruction does not stop a step."""
+		self._Resume = self.IP
+		return self.Execute(1)